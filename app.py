@@ -3,45 +3,57 @@ This app forwards a request to the next service in the chain
 """
 
 import os
-import logging
 import json
-import random
-import requests
+import logging
 import time
+import requests
+from functools import partial
 from opentelemetry import trace
-from opentelemetry.sdk.resources import Resource
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.instrumentation.flask import FlaskInstrumentor
 from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry.exporter.zipkin.json import ZipkinExporter
-from flask import Flask, request, jsonify, make_response
-
+from flask import Flask, Response, g, request, jsonify, make_response
+from link.admission import ADMITTED_ROUTES, AdmissionController
+from link.autosize import preloading
+from link.batch import (
+    BATCH_ROUTE,
+    BATCH_SIZE_ATTRIBUTE,
+    Batch,
+    BatchError,
+    BatchSettings,
+)
+from link.cache import CACHE_HEADER, CachedResponse, CacheTimeout, ResponseCaches
+from link.config import ServicesWatcher, get_service_urls
+from link.deadline import DEADLINE_HEADER, DeadlineSettings, deadline_exceeded
+from link.fanout import FanOut, HopResult, aggregate
+from link.hedging import ATTEMPT_HEADER, Hedger, parse_attempt
+from link.logs import LogPipeline
+from link.metrics import (
+    INJECTED_SLEEP,
+    NEXT_HOP_DURATION,
+    UNMATCHED_ROUTE,
+    RequestMetrics,
+    render,
+)
+from link.payload import PayloadBuffer, drain
+from link.sampling import KEEP_ATTRIBUTE, TRACE_DELAY_HEADER, SamplingSettings
+from link.sessions import SessionPool
+from link.streaming import StreamSettings, iter_raw, pass_through_headers
+from link.timing import SERVER_TIMING, HopTiming, ServerTimingSettings
+from link.tracing import setup_tracing
+from link.warmup import CONNECT_TIMEOUT, StartupTimer, Warmup
+from link.work import Work
+
+# how long this worker takes to set up and warm up
+startup_timer = StartupTimer()
 
 #
 # OpenTelemetry and Zipkin
 #
 
-# Configure the TracerProvider and SpanExporter
 # service_name is set in the cli.py script as a env var
 service_name = os.environ.get("CHAIN_LINK_SERVICE_NAME", "unknown")
-trace.set_tracer_provider(
-    TracerProvider(resource=Resource.create({"service.name": service_name}))
-)
-
-# create a ZipkinSpanExporter - this is specific to Zipkin deployed into
-# Kubernetes with the cli.py script
-# NOTE(curtis): this is expecting a service called zipkin-service-0 listening on
-# port 80!
-zipkin_exporter = ZipkinExporter(
-    endpoint="http://zipkin-service/api/v2/spans",
-)
-
-# Create a BatchSpanProcessor and add the exporter to it
-span_processor = BatchSpanProcessor(zipkin_exporter)
-
-# add to the tracer
-trace.get_tracer_provider().add_span_processor(span_processor)
+sampling_settings = SamplingSettings.from_env()
+span_processor = setup_tracing(service_name, sampling_settings)
 
 #
 # Flask
@@ -57,30 +69,259 @@ RequestsInstrumentor().instrument()
 #
 
 logging.basicConfig(level=logging.INFO)
+# records are sampled and written by a background thread, in the format of
+# the gunicorn logger or as JSON with the trace they belong to
+log_pipeline = LogPipeline.from_env(logging.getLogger("gunicorn.error"), service_name)
+log_pipeline.install(app.logger)
 app.logger.info("service_name %s", service_name)
 
+# the topology and latency models, reloaded when the configmap changes
+services_watcher = ServicesWatcher(service_name)
+services_watcher.start()
+app.logger.info("new services: %s", services_watcher.current.topology.services)
+
+# keep-alive connections to the next hop, shared by the threads in this worker
+session_pool = SessionPool.from_env()
+
+# threads to call all the children of a service at once
+fan_out = FanOut.from_env()
+
+# the chunk that synthetic request and response bodies are made of
+payload_buffer = PayloadBuffer.from_env()
+
+# the responses of the services that cache them, kept across config reloads
+response_caches = ResponseCaches()
+
+# the CPU and memory work of the services, and the memory it holds on to
+work = Work()
+
+# whether the next hop's response is streamed through rather than buffered
+stream_settings = StreamSettings.from_env()
+
+# how many requests can be sent down the chain together to /batch
+batch_settings = BatchSettings.from_env()
+
+# how long a request has, when the caller didn't set a deadline
+deadline_settings = DeadlineSettings.from_env()
+
+# whether each hop sends back the breakdown of its time and the next hops'
+server_timing_settings = ServerTimingSettings.from_env()
+
+# whether a slow call to the next hop is sent again, and how often it can be
+hedger = Hedger.from_env()
+if hedger.settings.enabled and stream_settings.enabled:
+    app.logger.warning("Streamed responses aren't hedged, CHAIN_LINK_HEDGE is ignored")
+
+# how many requests this worker handles at once, and how many wait for a slot
+admission = AdmissionController.from_env()
 
-# the services.json will be mounted from a configmap
-def get_service_urls():
+# the connections and tracing warmed up before the worker reports ready
+warmup = Warmup.from_env(startup_timer)
+startup_timer.since_start("init")
+
+
+def warm_up():
+    """
+    Build the span exporter and open connections to the next services in the
+    background, once per worker, and allocate its memory ballast
+    """
+    work.hold_ballast(services_watcher.current.work_profiles.ballast)
+    warmup.start(
+        services_watcher.current.topology.next_services(service_name),
+        lambda next_service: session_pool.get(
+            f"http://{next_service}/readiness", timeout=CONNECT_TIMEOUT
+        ),
+        span_processor.post_fork,
+    )
+
+
+def post_fork():
     """
-    Get the list of services from the configmap which is mounted into the pod
+    Restart in a worker what it doesn't get from the process it was forked
+    from, when gunicorn imports the app before forking its workers
     """
-    with open(
-        "/etc/chain-link.conf.d/services.json", encoding="utf-8"
-    ) as services_file:
-        services_json = services_file.read()
-    return json.loads(services_json)
+    services_watcher.start()
+    warm_up()
 
 
-services = get_service_urls()
-app.logger.info("new services: %s", services)
+# the gunicorn master that preloads the app never serves it, its threads,
+# connections and ballast would only be held on to and copied into every
+# worker, so a preloaded app warms up in post_fork instead
+if not preloading():
+    warm_up()
 
 
-def is_valid_service(svc_name):
+def is_valid_service(svc_name, topology=None):
     """
     Check if the service_name is in the services list
     """
-    return svc_name in services
+    if topology is None:
+        topology = services_watcher.current.topology
+    return svc_name in topology
+
+
+def call_next_service(next_service, body=None, deadline=None, trace_delay=None):
+    """
+    Forward the request to one of the next services in the chain, and send
+    it again if it is slow and hedging is on
+    """
+    deadline = deadline or deadline_settings.deadline()
+    return hedger.call(
+        next_service,
+        partial(
+            send_next_service, next_service, body, deadline, trace_delay=trace_delay
+        ),
+        deadline,
+        session_pool.interrupt,
+    )
+
+
+def send_next_service(
+    next_service, body, deadline, attempt=0, path="/forward", trace_delay=None
+):
+    """
+    Send the request to one of the next services in the chain, with a
+    synthetic body if there is one, and wait for it until the deadline. The
+    injected latency of the trace is passed on when keeping slow traces.
+    """
+    next_hop = deadline.next_hop()
+    if next_hop is None:
+        message, status = deadline_exceeded(next_service, "next_hop")
+        return HopResult(next_service, status, json.dumps(message), 0.0)
+    deadline_headers, timeout = next_hop
+
+    start = time.perf_counter()
+    headers = {"X-Current-Service": next_service, **deadline_headers}
+    if attempt:
+        headers[ATTEMPT_HEADER] = str(attempt)
+    if trace_delay is not None:
+        headers[TRACE_DELAY_HEADER] = str(trace_delay)
+    try:
+        response = session_pool.request(
+            "POST" if body else "GET",
+            f"http://{next_service}{path}",
+            headers=headers,
+            data=body,
+            timeout=timeout,
+        )
+    except requests.Timeout:
+        message, status = deadline_exceeded(next_service, "next_hop")
+        return HopResult(
+            next_service, status, json.dumps(message), time.perf_counter() - start
+        )
+    finally:
+        elapsed = time.perf_counter() - start
+        NEXT_HOP_DURATION.labels(next_service).observe(elapsed)
+    return HopResult(
+        next_service,
+        response.status_code,
+        response.text,
+        elapsed,
+        response.headers.get(SERVER_TIMING),
+    )
+
+
+def stream_next_service(
+    next_service, body=None, timing=None, deadline=None, trace_delay=None
+):
+    """
+    Forward the request to the next service in the chain and stream its
+    response, headers and undecoded body, back a chunk at a time
+    """
+    deadline = deadline or deadline_settings.deadline()
+    next_hop = deadline.next_hop()
+    if next_hop is None:
+        message, status = deadline_exceeded(next_service, "next_hop")
+        return make_response(jsonify(message), status)
+    deadline_headers, timeout = next_hop
+
+    # the time to the response headers, the body is then passed through
+    with NEXT_HOP_DURATION.labels(next_service).time():
+        headers = {"X-Current-Service": next_service, **deadline_headers}
+        if trace_delay is not None:
+            headers[TRACE_DELAY_HEADER] = str(trace_delay)
+        try:
+            response = session_pool.request(
+                "POST" if body else "GET",
+                f"http://{next_service}/forward",
+                headers=headers,
+                data=body,
+                timeout=timeout,
+                stream=True,
+            )
+        except requests.Timeout:
+            message, status = deadline_exceeded(next_service, "next_hop")
+            return make_response(jsonify(message), status)
+    if timing is not None:
+        timing.add_downstream(response.headers.get(SERVER_TIMING))
+    return Response(
+        iter_raw(response, stream_settings.chunk_size),
+        response.status_code,
+        headers=pass_through_headers(response.headers),
+        direct_passthrough=True,
+    )
+
+
+#
+# Metrics
+#
+
+
+@app.before_request
+def start_request_metrics():
+    """
+    Start recording the request, by the route it matched
+    """
+    route = request.url_rule.rule if request.url_rule else UNMATCHED_ROUTE
+    g.request_metrics = RequestMetrics(route)
+    g.hop_timing = HopTiming()
+
+
+@app.before_request
+def admit_request():
+    """
+    Let the request in if there is room for it, or shed it with a 503
+    """
+    if not admission.settings.enabled or request.path not in ADMITTED_ROUTES:
+        return None
+    deadline = deadline_settings.deadline(request.headers.get(DEADLINE_HEADER))
+    g.admission_ticket = admission.acquire(deadline.remaining())
+    if g.admission_ticket is None:
+        message, status, headers = admission.rejection(service_name)
+        return make_response(jsonify(message), status, headers)
+    return None
+
+
+@app.after_request
+def record_response_metrics(response):
+    """
+    Record the status of the response and how long it took to get to it
+    """
+    request_metrics = g.get("request_metrics")
+    if request_metrics is not None:
+        request_metrics.respond(response.status_code)
+    admission_ticket = g.get("admission_ticket")
+    if admission_ticket is not None:
+        admission_ticket.respond(response.status_code)
+    hop_timing = g.get("hop_timing")
+    if hop_timing is not None and server_timing_settings.enabled:
+        value = hop_timing.header(server_timing_settings.max_hops)
+        if value is not None:
+            response.headers[SERVER_TIMING] = value
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    """
+    Stop counting the request as in flight, and give up its admission slot
+    """
+    request_metrics = g.pop("request_metrics", None)
+    if request_metrics is not None:
+        request_metrics.finish()
+    admission_ticket = g.pop("admission_ticket", None)
+    if admission_ticket is not None:
+        admission.release(admission_ticket)
 
 
 #
@@ -88,44 +329,163 @@ def is_valid_service(svc_name):
 #
 
 
-@app.route("/", methods=["GET"])
+@app.route("/", methods=["GET", "POST"])
 def process_request():
     """
     Process the request and forward it to the next service in the chain
     """
 
-    # one of the nodes should take longer to respond, so we are going to randomly
-    # sleep for 2 seconds on one of the nodes (well, this isn't perfect but you
-    # get the idea)
-    random_number = random.random()
-    app.logger.info(f"Node's random_number: {random_number}")
-    if random_number < 1 / len(services):
-        sleep_duration = 2  # Sleep for 2 seconds
-        app.logger.info("This node is sleeping for %s seconds", sleep_duration)
-        time.sleep(sleep_duration)
+    # use the same config for the whole request, even if it is reloaded
+    link_config = services_watcher.current
+    topology = link_config.topology
 
     current_service = request.headers.get("X-Current-Service", service_name)
 
-    # check if the current service is valid and then set the index in the chain
-    # to the current service
-    if current_service and not is_valid_service(current_service):
+    # check if the current service is valid, a request without one starts at
+    # the entry of the chain
+    if current_service and not is_valid_service(current_service, topology):
         return make_response(jsonify({"message": "Invalid service"}), 400)
     elif current_service:
         app.logger.info("current_service: %s", current_service)
-        index = services.index(current_service)
     else:
-        index = 0
+        current_service = topology.entry
+
+    timing = g.hop_timing
+    timing.service = current_service
+
+    # give up on a request its caller has already given up on
+    deadline = deadline_settings.deadline(request.headers.get(DEADLINE_HEADER))
+    if deadline.expired:
+        message, status = deadline_exceeded(current_service, "arrival")
+        return make_response(jsonify(message), status)
+
+    # a service with a cache answers a request it has seen before without
+    # going down the chain, see link/cache.py
+    cache = response_caches.cache(
+        current_service, link_config.cache_policies.policy(current_service)
+    )
+    key = (
+        cache.key(request.method, request.full_path, request.headers) if cache else None
+    )
+    if key is None:
+        return answer_request(link_config, current_service, timing, deadline)
+    try:
+        cached, result = cache.fetch(
+            key,
+            lambda: cache_response(
+                answer_request(link_config, current_service, timing, deadline)
+            ),
+            max(0.0, deadline.remaining()),
+        )
+    except CacheTimeout:
+        message, status = deadline_exceeded(current_service, "cache")
+        return make_response(jsonify(message), status)
+    response = make_response(cached.body, cached.status)
+    response.content_type = cached.content_type
+    response.headers[CACHE_HEADER] = result
+    return response
+
+
+def cache_response(rv):
+    """
+    Turn what a view returns into a response the cache can keep, reading the
+    whole body of a streamed one
+    """
+    response = app.make_response(rv)
+    # a streamed response from the next hop is passed through as it is read
+    response.direct_passthrough = False
+    try:
+        return CachedResponse(
+            response.get_data(), response.status_code, response.content_type
+        )
+    finally:
+        response.close()
+
+
+def answer_request(link_config, current_service, timing, deadline):
+    """
+    Answer the request as current_service: sleep for the injected latency,
+    then forward it to the next services, or answer it as the final link
+    """
+    topology = link_config.topology
+
+    # the latency model of the service decides if this node is slow for this
+    # trace, and for how long it sleeps
+    span = trace.get_current_span()
+    trace_id = span.get_span_context().trace_id
+    sleep_duration = link_config.latency_injector.delay(
+        current_service, trace_id, parse_attempt(request.headers.get(ATTEMPT_HEADER))
+    )
+    INJECTED_SLEEP.labels(current_service).observe(sleep_duration)
+    trace_delay = None
+    if sampling_settings.keep_slow:
+        trace_delay = sampling_settings.trace_delay(
+            request.headers.get(TRACE_DELAY_HEADER),
+            link_config.latency_injector,
+            trace_id,
+        )
+        if sampling_settings.is_slow(max(sleep_duration, trace_delay)):
+            span.set_attribute(KEEP_ATTRIBUTE, True)
+    if sleep_duration:
+        app.logger.info("This node is sleeping for %s seconds", sleep_duration)
+        # there is no point sleeping past the deadline
+        with timing.delaying():
+            time.sleep(max(0.0, min(sleep_duration, deadline.remaining())))
+        if deadline.expired:
+            message, status = deadline_exceeded(current_service, "delay")
+            return make_response(jsonify(message), status)
+
+    # the CPU and memory the service uses on the request, see link/work.py
+    work.run(link_config.work_profiles, current_service, trace_id)
+
+    # read the body sent by the previous hop, unless it is to be echoed back
+    payload_policy = link_config.payload_sizes.policy(current_service)
+    if not payload_policy.echo:
+        drain(request.stream)
+
+    body = None
+    if payload_policy.request_bytes:
+        body = payload_buffer.payload(payload_policy.request_bytes)
 
     # if the current service is not the last service in the chain, then forward
-    # the request to the next service in the chain
-    if index + 1 < len(services):
-        next_service = services[index + 1]
-        app.logger.info("next_service: %s", next_service)
-        headers = {"X-Current-Service": next_service}
-        response = requests.get(
-            f"http://{next_service}/forward", headers=headers, timeout=3
+    # the request to the next service, or all the next services at once
+    next_services = topology.next_services(current_service)
+    if len(next_services) == 1:
+        app.logger.info("next_service: %s", next_services[0])
+        with timing.waiting():
+            if stream_settings.enabled:
+                return stream_next_service(
+                    next_services[0], body, timing, deadline, trace_delay
+                )
+            result = call_next_service(next_services[0], body, deadline, trace_delay)
+        timing.add_downstream(result.server_timing)
+        return result.body, result.status
+    elif next_services:
+        app.logger.info("next_services: %s", next_services)
+        with timing.waiting():
+            results = fan_out.map(
+                partial(
+                    call_next_service,
+                    body=body,
+                    deadline=deadline,
+                    trace_delay=trace_delay,
+                ),
+                next_services,
+            )
+        for result in results:
+            timing.add_downstream(result.server_timing)
+        message, status = aggregate(current_service, results)
+        return jsonify(message), status
+    elif payload_policy.echo:
+        return Response(request.get_data(), 200, mimetype="application/octet-stream")
+    elif payload_policy.response_bytes is not None:
+        payload = payload_buffer.payload(payload_policy.response_bytes)
+        return Response(
+            payload,
+            200,
+            mimetype="application/octet-stream",
+            headers={"Content-Length": str(len(payload))},
         )
-        return response.text, response.status_code
     else:
         return (
             jsonify(
@@ -136,7 +496,7 @@ def process_request():
 
 
 # I just want a route named /forward :)
-@app.route("/forward", methods=["GET"])
+@app.route("/forward", methods=["GET", "POST"])
 def forward_request():
     """
     Forward the request to the next service in the chain
@@ -144,23 +504,134 @@ def forward_request():
     return process_request()
 
 
+@app.route(BATCH_ROUTE, methods=["POST"])
+def process_batch():
+    """
+    Process a batch of requests at once and forward the items left to each
+    of the next services in one request, see link/batch.py
+    """
+    link_config = services_watcher.current
+    topology = link_config.topology
+
+    current_service = request.headers.get("X-Current-Service", service_name)
+    if current_service and not is_valid_service(current_service, topology):
+        return make_response(jsonify({"message": "Invalid service"}), 400)
+    elif not current_service:
+        current_service = topology.entry
+
+    timing = g.hop_timing
+    timing.service = current_service
+
+    deadline = deadline_settings.deadline(request.headers.get(DEADLINE_HEADER))
+    if deadline.expired:
+        message, status = deadline_exceeded(current_service, "arrival")
+        return make_response(jsonify(message), status)
+
+    try:
+        batch = Batch.parse(request.get_data(), batch_settings.max_items)
+    except BatchError as exc:
+        return make_response(jsonify({"message": str(exc)}), 400)
+    app.logger.info("batch of %s items", len(batch.items))
+    span = trace.get_current_span()
+    span.set_attribute(BATCH_SIZE_ATTRIBUTE, len(batch.items))
+
+    # each item has the latency of its own trace, and they all sleep at once
+    latency_injector = link_config.latency_injector
+    delays = batch.delays(current_service, latency_injector)
+    for delay in delays:
+        INJECTED_SLEEP.labels(current_service).observe(delay)
+    if sampling_settings.keep_slow:
+        batch.trace_delays(latency_injector)
+        if any(
+            sampling_settings.is_slow(max(delay, item["trace_delay"]))
+            for delay, item in zip(delays, batch.items)
+        ):
+            span.set_attribute(KEEP_ATTRIBUTE, True)
+    sleep_duration = max(delays, default=0.0)
+    if sleep_duration:
+        slept = max(0.0, min(sleep_duration, deadline.remaining()))
+        with timing.delaying():
+            time.sleep(slept)
+        batch.expire(current_service, delays, slept, deadline.expired)
+    for i in batch.pending():
+        work.run(link_config.work_profiles, current_service, batch.items[i]["trace_id"])
+
+    payload_policy = link_config.payload_sizes.policy(current_service)
+    next_services = topology.next_services(current_service)
+    if next_services and batch.pending():
+        payload = None
+        if payload_policy.request_bytes:
+            payload = payload_buffer.text(payload_policy.request_bytes)
+        send = partial(
+            send_next_service,
+            body=batch.forward_body(payload),
+            deadline=deadline,
+            path=BATCH_ROUTE,
+        )
+        with timing.waiting():
+            if len(next_services) == 1:
+                results = [send(next_services[0])]
+            else:
+                results = fan_out.map(send, next_services)
+        for result in results:
+            timing.add_downstream(result.server_timing)
+        batch.merge(results)
+    elif not next_services:
+        payload = None
+        if payload_policy.response_bytes is not None:
+            payload = payload_buffer.text(payload_policy.response_bytes)
+        batch.finish(current_service, payload, payload_policy.echo)
+    return jsonify(batch.response(current_service)), 200
+
+
 @app.route("/readiness", methods=["GET"])
 def readiness():
     """
-    Readiness probe
+    Readiness probe, the worker isn't ready until it has warmed up
+    """
+    if not warmup.ready():
+        return make_response(
+            jsonify({"message": "warming up", "startup": startup_timer.phases}), 503
+        )
+    return make_response(
+        jsonify({"message": "ok", "startup": startup_timer.phases}), 200
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Prometheus metrics of all the workers
+    """
+    body, content_type = render()
+    return Response(body, 200, content_type=content_type)
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    """
+    Connection pool, response cache and work memory statistics for this worker
     """
-    return make_response(jsonify({"message": "ok"}), 200)
+    return make_response(
+        jsonify(
+            {
+                "pool": session_pool.stats(),
+                "cache": response_caches.stats(),
+                "work": work.stats(),
+            }
+        ),
+        200,
+    )
 
 
 #
 # Main
 #
 
-# if running out of gunicorn, use the gunicorn logger
+# if running out of gunicorn, log at the level of the gunicorn logger
 # https://trstringer.com/logging-flask-gunicorn-the-manageable-way/
 if __name__ != "__main__":
     gunicorn_logger = logging.getLogger("gunicorn.error")
-    app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
 
 if __name__ == "__main__":
@@ -0,0 +1,654 @@
+"""
+This is the asyncio (ASGI) version of app.py, it forwards a request to the next
+service in the chain without tying up a thread while it sleeps or waits on the
+next hop
+"""
+
+import os
+import json
+import asyncio
+import logging
+import time
+import httpx
+from functools import partial
+from opentelemetry import trace
+from opentelemetry.instrumentation.asgi import OpenTelemetryMiddleware
+from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.middleware import Middleware
+from starlette.responses import (
+    HTMLResponse,
+    JSONResponse,
+    Response,
+    StreamingResponse,
+)
+from starlette.routing import Route
+from link.admission import AdmissionController, AdmissionMiddleware
+from link.batch import (
+    BATCH_ROUTE,
+    BATCH_SIZE_ATTRIBUTE,
+    Batch,
+    BatchError,
+    BatchSettings,
+)
+from link.cache import CACHE_HEADER, CachedResponse, CacheTimeout, ResponseCaches
+from link.config import ServicesWatcher
+from link.deadline import DEADLINE_HEADER, DeadlineSettings, deadline_exceeded
+from link.env import env_bool, env_float, env_int
+from link.fanout import HopResult, aggregate
+from link.hedging import ATTEMPT_HEADER, Hedger, parse_attempt
+from link.logs import LogPipeline
+from link.metrics import INJECTED_SLEEP, NEXT_HOP_DURATION, MetricsMiddleware, render
+from link.payload import PayloadBuffer
+from link.sampling import KEEP_ATTRIBUTE, TRACE_DELAY_HEADER, SamplingSettings
+from link.streaming import StreamSettings, pass_through_headers
+from link.timing import (
+    SERVER_TIMING,
+    STATE_KEY,
+    HopTiming,
+    ServerTimingMiddleware,
+    ServerTimingSettings,
+)
+from link.tracing import setup_tracing
+from link.transport import TransportSettings
+from link.warmup import CONNECT_TIMEOUT, StartupTimer, Warmup
+from link.work import Work
+
+# how long this worker takes to set up and warm up
+startup_timer = StartupTimer()
+
+#
+# OpenTelemetry and Zipkin
+#
+
+# service_name is set in the cli.py script as a env var
+service_name = os.environ.get("CHAIN_LINK_SERVICE_NAME", "unknown")
+sampling_settings = SamplingSettings.from_env()
+span_processor = setup_tracing(service_name, sampling_settings)
+
+# the httpx client has to be instrumented before it is created so the trace
+# context is injected into the requests to the next hop
+HTTPXClientInstrumentor().instrument()
+
+#
+# Logging
+#
+
+# records are sampled and written by a background thread, in the format of
+# the uvicorn logger or as JSON with the trace they belong to
+logger = logging.getLogger("chain_link")
+logger.setLevel(logging.INFO)
+log_pipeline = LogPipeline.from_env(logging.getLogger("uvicorn.error"), service_name)
+log_pipeline.install(logger)
+logger.info("service_name %s", service_name)
+
+# the topology and latency models, reloaded when the configmap changes
+services_watcher = ServicesWatcher(service_name)
+services_watcher.start()
+logger.info("new services: %s", services_watcher.current.topology.services)
+
+# the most children of a service that are called at once, like the size of
+# the fan out thread pool in the sync app
+fan_out_limit = None
+
+# one client, and so one connection pool, per worker and its event loop
+client = None
+
+# the chunk that synthetic request and response bodies are made of
+payload_buffer = PayloadBuffer.from_env()
+
+# the responses of the services that cache them, kept across config reloads
+response_caches = ResponseCaches()
+
+# the CPU and memory work of the services, and the memory it holds on to
+work = Work()
+
+# whether the next hop's response is streamed through rather than buffered
+stream_settings = StreamSettings.from_env()
+
+# whether the next hop is called over HTTP/1.1 or multiplexed over HTTP/2
+transport_settings = TransportSettings.from_env()
+
+# how many requests can be sent down the chain together to /batch
+batch_settings = BatchSettings.from_env()
+
+# how long a request has, when the caller didn't set a deadline
+deadline_settings = DeadlineSettings.from_env()
+
+# whether each hop sends back the breakdown of its time and the next hops'
+server_timing_settings = ServerTimingSettings.from_env()
+
+# whether a slow call to the next hop is sent again, and how often it can be
+hedger = Hedger.from_env()
+if hedger.settings.enabled and stream_settings.enabled:
+    logger.warning("Streamed responses aren't hedged, CHAIN_LINK_HEDGE is ignored")
+
+# how many requests this worker handles at once, and how many wait for a slot
+admission = AdmissionController.from_env()
+
+# the connections and tracing warmed up before the worker reports ready
+warmup = Warmup.from_env(startup_timer)
+warmup_task = None
+startup_timer.since_start("init")
+
+
+def post_fork():
+    """
+    Restart in a worker what it doesn't get from the process it was forked
+    from, when gunicorn imports the app before forking its workers
+    """
+    services_watcher.start()
+    span_processor.post_fork()
+
+
+def create_client():
+    """
+    Create the httpx client used to call the next hop, sized from the same
+    CHAIN_LINK_POOL_* env vars as the sync app, over HTTP/1.1 or HTTP/2
+    """
+    keepalive = env_bool("CHAIN_LINK_POOL_KEEPALIVE", True)
+    limits = httpx.Limits(
+        max_connections=env_int("CHAIN_LINK_ASYNC_MAX_CONNECTIONS", 1000),
+        max_keepalive_connections=env_int("CHAIN_LINK_POOL_SIZE", 10)
+        if keepalive
+        else 0,
+        keepalive_expiry=env_float("CHAIN_LINK_POOL_IDLE_TIMEOUT", 60.0),
+    )
+    return httpx.AsyncClient(limits=limits, **transport_settings.client_options())
+
+
+def client_stats():
+    """
+    Connection counters of the client's pool in this worker, like the
+    SessionPool stats of the sync app
+    """
+    # httpx doesn't expose its pool, a mock transport in the tests has none
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(pool.connections) if pool is not None else []
+    return {
+        "transport": transport_settings.transport,
+        "keepalive": env_bool("CHAIN_LINK_POOL_KEEPALIVE", True),
+        "connections": len(connections),
+        "idle_connections": sum(1 for conn in connections if conn.is_idle()),
+    }
+
+
+async def startup():
+    """
+    Create the client once the worker's event loop is running, and allocate
+    the memory ballast of the worker
+    """
+    global client, fan_out_limit, warmup_task
+    work.hold_ballast(services_watcher.current.work_profiles.ballast)
+    client = create_client()
+    fan_out_limit = asyncio.Semaphore(env_int("CHAIN_LINK_FANOUT_WORKERS", 16))
+    warmup_task = asyncio.ensure_future(
+        warmup.run_async(
+            services_watcher.current.topology.next_services(service_name),
+            lambda next_service: client.get(
+                f"http://{next_service}/readiness", timeout=CONNECT_TIMEOUT
+            ),
+            span_processor.post_fork,
+        )
+    )
+
+
+async def shutdown():
+    """
+    Stop warming up and close the pooled connections to the next hop
+    """
+    if warmup_task is not None:
+        warmup_task.cancel()
+    if client is not None:
+        await client.aclose()
+
+
+def is_valid_service(svc_name, topology=None):
+    """
+    Check if the service_name is in the services list
+    """
+    if topology is None:
+        topology = services_watcher.current.topology
+    return svc_name in topology
+
+
+def build_next_request(
+    next_service, next_hop, body=None, attempt=0, path="/forward", trace_delay=None
+):
+    """
+    Build the request to one of the next services in the chain, with the
+    deadline and timeout of the next hop, the injected latency of the trace
+    when keeping slow traces, and a synthetic body or the body of a batch if
+    there is one
+    """
+    deadline_headers, timeout = next_hop
+    headers = {"X-Current-Service": next_service, **deadline_headers}
+    if attempt:
+        headers[ATTEMPT_HEADER] = str(attempt)
+    if trace_delay is not None:
+        headers[TRACE_DELAY_HEADER] = str(trace_delay)
+    content = None
+    if body:
+        headers["Content-Length"] = str(len(body))
+        content = body if isinstance(body, bytes) else aiter(body)
+    return client.build_request(
+        "POST" if body else "GET",
+        f"http://{next_service}{path}",
+        headers=headers,
+        content=content,
+        timeout=timeout,
+    )
+
+
+async def call_next_service(next_service, body=None, deadline=None, trace_delay=None):
+    """
+    Forward the request to one of the next services in the chain, and send
+    it again if it is slow and hedging is on
+    """
+    deadline = deadline or deadline_settings.deadline()
+    return await hedger.call_async(
+        next_service,
+        partial(
+            send_next_service, next_service, body, deadline, trace_delay=trace_delay
+        ),
+        deadline,
+    )
+
+
+async def send_next_service(
+    next_service, body, deadline, attempt=0, path="/forward", trace_delay=None
+):
+    """
+    Send the request to one of the next services in the chain, and wait for
+    it until the deadline
+    """
+    next_hop = deadline.next_hop()
+    if next_hop is None:
+        message, status = deadline_exceeded(next_service, "next_hop")
+        return HopResult(next_service, status, json.dumps(message), 0.0)
+
+    start = time.perf_counter()
+    try:
+        response = await client.send(
+            build_next_request(next_service, next_hop, body, attempt, path, trace_delay)
+        )
+    except httpx.TimeoutException:
+        message, status = deadline_exceeded(next_service, "next_hop")
+        return HopResult(
+            next_service, status, json.dumps(message), time.perf_counter() - start
+        )
+    finally:
+        elapsed = time.perf_counter() - start
+        NEXT_HOP_DURATION.labels(next_service).observe(elapsed)
+    return HopResult(
+        next_service,
+        response.status_code,
+        response.text,
+        elapsed,
+        response.headers.get(SERVER_TIMING),
+    )
+
+
+async def fan_out_next_service(
+    next_service, body=None, deadline=None, trace_delay=None
+):
+    """
+    Forward the request to one of the next services, waiting for a slot if
+    too many children are being called at once
+    """
+    async with fan_out_limit:
+        return await call_next_service(next_service, body, deadline, trace_delay)
+
+
+async def stream_next_service(
+    next_service, body=None, timing=None, deadline=None, trace_delay=None
+):
+    """
+    Forward the request to the next service in the chain and stream its
+    response, headers and undecoded body, back a chunk at a time
+    """
+    deadline = deadline or deadline_settings.deadline()
+    next_hop = deadline.next_hop()
+    if next_hop is None:
+        message, status = deadline_exceeded(next_service, "next_hop")
+        return JSONResponse(message, status)
+
+    # the time to the response headers, the body is then passed through
+    with NEXT_HOP_DURATION.labels(next_service).time():
+        try:
+            response = await client.send(
+                build_next_request(
+                    next_service, next_hop, body, trace_delay=trace_delay
+                ),
+                stream=True,
+            )
+        except httpx.TimeoutException:
+            message, status = deadline_exceeded(next_service, "next_hop")
+            return JSONResponse(message, status)
+    if timing is not None:
+        timing.add_downstream(response.headers.get(SERVER_TIMING))
+    return StreamingResponse(
+        response.aiter_raw(stream_settings.chunk_size),
+        response.status_code,
+        headers=dict(pass_through_headers(response.headers)),
+        background=BackgroundTask(response.aclose),
+    )
+
+
+#
+# Routes
+#
+
+
+async def process_request(request):
+    """
+    Process the request and forward it to the next service in the chain
+    """
+
+    # use the same config for the whole request, even if it is reloaded
+    link_config = services_watcher.current
+    topology = link_config.topology
+
+    current_service = request.headers.get("X-Current-Service", service_name)
+
+    # check if the current service is valid, a request without one starts at
+    # the entry of the chain
+    if current_service and not is_valid_service(current_service, topology):
+        return JSONResponse({"message": "Invalid service"}, 400)
+    elif current_service:
+        logger.info("current_service: %s", current_service)
+    else:
+        current_service = topology.entry
+
+    # the ServerTimingMiddleware started timing the request, unless it is off
+    timing = request.scope.get("state", {}).get(STATE_KEY) or HopTiming()
+    timing.service = current_service
+
+    # give up on a request its caller has already given up on
+    deadline = deadline_settings.deadline(request.headers.get(DEADLINE_HEADER))
+    if deadline.expired:
+        return JSONResponse(*deadline_exceeded(current_service, "arrival"))
+
+    # a service with a cache answers a request it has seen before without
+    # going down the chain, see link/cache.py
+    cache = response_caches.cache(
+        current_service, link_config.cache_policies.policy(current_service)
+    )
+    path = f"{request.url.path}?{request.url.query}"
+    key = cache.key(request.method, path, request.headers) if cache else None
+    if key is None:
+        return await answer_request(
+            request, link_config, current_service, timing, deadline
+        )
+
+    async def load():
+        return await cache_response(
+            await answer_request(
+                request, link_config, current_service, timing, deadline
+            )
+        )
+
+    try:
+        cached, result = await cache.fetch_async(
+            key, load, max(0.0, deadline.remaining())
+        )
+    except CacheTimeout:
+        return JSONResponse(*deadline_exceeded(current_service, "cache"))
+    return Response(
+        cached.body,
+        cached.status,
+        headers={"Content-Type": cached.content_type, CACHE_HEADER: result},
+    )
+
+
+async def cache_response(response):
+    """
+    Turn a response into one the cache can keep, reading the whole body of a
+    streamed one
+    """
+    if isinstance(response, StreamingResponse):
+        body = b"".join(
+            [
+                chunk.encode() if isinstance(chunk, str) else bytes(chunk)
+                async for chunk in response.body_iterator
+            ]
+        )
+        if response.background is not None:
+            await response.background()
+    else:
+        body = response.body
+    return CachedResponse(
+        body, response.status_code, response.headers.get("content-type")
+    )
+
+
+async def answer_request(request, link_config, current_service, timing, deadline):
+    """
+    Answer the request as current_service: sleep for the injected latency,
+    then forward it to the next services, or answer it as the final link
+    """
+    topology = link_config.topology
+
+    # the latency model of the service decides if this node is slow for this
+    # trace, and for how long it sleeps, without blocking the event loop
+    span = trace.get_current_span()
+    trace_id = span.get_span_context().trace_id
+    sleep_duration = link_config.latency_injector.delay(
+        current_service, trace_id, parse_attempt(request.headers.get(ATTEMPT_HEADER))
+    )
+    INJECTED_SLEEP.labels(current_service).observe(sleep_duration)
+    trace_delay = None
+    if sampling_settings.keep_slow:
+        trace_delay = sampling_settings.trace_delay(
+            request.headers.get(TRACE_DELAY_HEADER),
+            link_config.latency_injector,
+            trace_id,
+        )
+        if sampling_settings.is_slow(max(sleep_duration, trace_delay)):
+            span.set_attribute(KEEP_ATTRIBUTE, True)
+    if sleep_duration:
+        logger.info("This node is sleeping for %s seconds", sleep_duration)
+        # there is no point sleeping past the deadline
+        with timing.delaying():
+            await asyncio.sleep(max(0.0, min(sleep_duration, deadline.remaining())))
+        if deadline.expired:
+            return JSONResponse(*deadline_exceeded(current_service, "delay"))
+
+    # the CPU and memory the service uses on the request, blocking the event
+    # loop like CPU-bound code would, see link/work.py
+    work.run(link_config.work_profiles, current_service, trace_id)
+
+    # read the body sent by the previous hop, unless it is to be echoed back
+    payload_policy = link_config.payload_sizes.policy(current_service)
+    if not payload_policy.echo:
+        async for _ in request.stream():
+            pass
+
+    body = None
+    if payload_policy.request_bytes:
+        body = payload_buffer.payload(payload_policy.request_bytes)
+
+    # if the current service is not the last service in the chain, then forward
+    # the request to the next service, or all the next services at once
+    next_services = topology.next_services(current_service)
+    if len(next_services) == 1:
+        logger.info("next_service: %s", next_services[0])
+        with timing.waiting():
+            if stream_settings.enabled:
+                return await stream_next_service(
+                    next_services[0], body, timing, deadline, trace_delay
+                )
+            result = await call_next_service(
+                next_services[0], body, deadline, trace_delay
+            )
+        timing.add_downstream(result.server_timing)
+        return HTMLResponse(result.body, result.status)
+    elif next_services:
+        logger.info("next_services: %s", next_services)
+        with timing.waiting():
+            results = await asyncio.gather(
+                *(
+                    fan_out_next_service(next_service, body, deadline, trace_delay)
+                    for next_service in next_services
+                )
+            )
+        for result in results:
+            timing.add_downstream(result.server_timing)
+        message, status = aggregate(current_service, results)
+        return JSONResponse(message, status)
+    elif payload_policy.echo:
+        return Response(
+            await request.body(), 200, media_type="application/octet-stream"
+        )
+    elif payload_policy.response_bytes is not None:
+        payload = payload_buffer.payload(payload_policy.response_bytes)
+        return StreamingResponse(
+            payload,
+            200,
+            media_type="application/octet-stream",
+            headers={"Content-Length": str(len(payload))},
+        )
+    else:
+        return JSONResponse(
+            {"message": f"You have reached the final chain link {current_service}"},
+            200,
+        )
+
+
+async def process_batch(request):
+    """
+    Process a batch of requests at once and forward the items left to each
+    of the next services in one request, see link/batch.py
+    """
+    link_config = services_watcher.current
+    topology = link_config.topology
+
+    current_service = request.headers.get("X-Current-Service", service_name)
+    if current_service and not is_valid_service(current_service, topology):
+        return JSONResponse({"message": "Invalid service"}, 400)
+    elif not current_service:
+        current_service = topology.entry
+
+    timing = request.scope.get("state", {}).get(STATE_KEY) or HopTiming()
+    timing.service = current_service
+
+    deadline = deadline_settings.deadline(request.headers.get(DEADLINE_HEADER))
+    if deadline.expired:
+        return JSONResponse(*deadline_exceeded(current_service, "arrival"))
+
+    try:
+        batch = Batch.parse(await request.body(), batch_settings.max_items)
+    except BatchError as exc:
+        return JSONResponse({"message": str(exc)}, 400)
+    logger.info("batch of %s items", len(batch.items))
+    span = trace.get_current_span()
+    span.set_attribute(BATCH_SIZE_ATTRIBUTE, len(batch.items))
+
+    # each item has the latency of its own trace, and they all sleep at once
+    latency_injector = link_config.latency_injector
+    delays = batch.delays(current_service, latency_injector)
+    for delay in delays:
+        INJECTED_SLEEP.labels(current_service).observe(delay)
+    if sampling_settings.keep_slow:
+        batch.trace_delays(latency_injector)
+        if any(
+            sampling_settings.is_slow(max(delay, item["trace_delay"]))
+            for delay, item in zip(delays, batch.items)
+        ):
+            span.set_attribute(KEEP_ATTRIBUTE, True)
+    sleep_duration = max(delays, default=0.0)
+    if sleep_duration:
+        slept = max(0.0, min(sleep_duration, deadline.remaining()))
+        with timing.delaying():
+            await asyncio.sleep(slept)
+        batch.expire(current_service, delays, slept, deadline.expired)
+    for i in batch.pending():
+        work.run(link_config.work_profiles, current_service, batch.items[i]["trace_id"])
+
+    payload_policy = link_config.payload_sizes.policy(current_service)
+    next_services = topology.next_services(current_service)
+    if next_services and batch.pending():
+        payload = None
+        if payload_policy.request_bytes:
+            payload = payload_buffer.text(payload_policy.request_bytes)
+        body = batch.forward_body(payload)
+        with timing.waiting():
+            results = await asyncio.gather(
+                *(
+                    send_next_service(next_service, body, deadline, path=BATCH_ROUTE)
+                    for next_service in next_services
+                )
+            )
+        for result in results:
+            timing.add_downstream(result.server_timing)
+        batch.merge(results)
+    elif not next_services:
+        payload = None
+        if payload_policy.response_bytes is not None:
+            payload = payload_buffer.text(payload_policy.response_bytes)
+        batch.finish(current_service, payload, payload_policy.echo)
+    return JSONResponse(batch.response(current_service), 200)
+
+
+async def readiness(request):
+    """
+    Readiness probe, the worker isn't ready until it has warmed up
+    """
+    if not warmup.ready():
+        return JSONResponse(
+            {"message": "warming up", "startup": startup_timer.phases}, 503
+        )
+    return JSONResponse({"message": "ok", "startup": startup_timer.phases}, 200)
+
+
+async def metrics(request):
+    """
+    Prometheus metrics of all the workers
+    """
+    body, content_type = render()
+    return Response(body, 200, headers={"Content-Type": content_type})
+
+
+async def stats(request):
+    """
+    Connection pool, response cache and work memory statistics for this worker
+    """
+    return JSONResponse(
+        {
+            "pool": client_stats(),
+            "cache": response_caches.stats(),
+            "work": work.stats(),
+        },
+        200,
+    )
+
+
+routes = [
+    Route("/", process_request, methods=["GET", "POST"]),
+    # I just want a route named /forward :)
+    Route("/forward", process_request, methods=["GET", "POST"]),
+    Route(BATCH_ROUTE, process_batch, methods=["POST"]),
+    Route("/readiness", readiness, methods=["GET"]),
+    Route("/metrics", metrics, methods=["GET"]),
+    Route("/stats", stats, methods=["GET"]),
+]
+
+# the OpenTelemetryMiddleware extracts the incoming trace context, so the spans
+# of this hop are parented to the previous hop just like in the Flask app
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(OpenTelemetryMiddleware),
+        Middleware(MetricsMiddleware, routes=[route.path for route in routes]),
+        Middleware(
+            AdmissionMiddleware,
+            controller=admission,
+            service=service_name,
+            deadline_settings=deadline_settings,
+        ),
+        Middleware(ServerTimingMiddleware, settings=server_timing_settings),
+    ],
+    on_startup=[startup],
+    on_shutdown=[shutdown],
+)
@@ -0,0 +1,4 @@
+"""
+End to end benchmarks of chains of chain-link processes on localhost, see
+python -m bench --help
+"""
@@ -0,0 +1,414 @@
+"""
+Benchmark chains of chain-link processes on localhost, e.g.
+
+    python -m bench --lengths 1,3,6 --servers 1x2,2x4 --payloads 0,64KiB \
+        --output results.json --baseline bench/baseline.json
+
+Every combination of chain length, gunicorn workers x threads and payload
+size is started with a Zipkin stub, warmed up, and then sent requests by
+--concurrency workers for --duration seconds. The results are written as
+JSON, and compared with the baseline: a scenario whose throughput drops, or
+whose p50 or p99 latency grows, by more than the tolerance fails the run.
+
+To see what hedging does to the tail, give the links a latency model where
+a few requests are slow, and run every scenario with and without it, e.g.
+
+    python -m bench --lengths 6 --servers 2x4 --hedging off,on \
+        --latency '{"distribution": "fixed", "value": 0.05, "probability": 0.02}'
+
+Each worker of a link stands in for a replica: the hedge of a request draws
+its own latency, as if it had gone to another pod.
+
+To compare the transports between the links, run the async app over
+HTTP/1.1 and over HTTP/2 on the same chain, e.g.
+
+    python -m bench --lengths 6 --servers async,http2 --concurrency 64
+
+To see how much sending requests down the chain in batches moves its
+throughput ceiling, run each scenario with batches of a few sizes, e.g.
+
+    python -m bench --lengths 6 --servers 2x4 --batches 1,10,100
+
+Every item of a batch counts as a request, see link/batch.py.
+
+To see how the workers and threads of gunicorn-run.sh hold up when the links
+are compute-bound, give every link CPU and memory work, e.g.
+
+    python -m bench --lengths 3 --servers 1x1,1x4,4x1 \
+        --work '{"cpu": {"units": 20}, "alloc": {"bytes": "64KiB", "count": 8}}'
+"""
+
+import io
+import os
+import sys
+import json
+import asyncio
+import argparse
+import platform
+import itertools
+import subprocess
+from link.loadgen import LoadGenerator
+from .chain import REPO_DIR, LocalChain, ZipkinStub
+
+
+class Scenario:
+    """
+    One chain to start and measure
+    """
+
+    def __init__(
+        self, length, workers, threads, payload, server="sync", hedge=False, batch=None
+    ):
+        self.length = length
+        self.workers = workers
+        self.threads = threads
+        self.payload = payload
+        self.server = server
+        self.hedge = hedge
+        self.batch = batch
+
+    @property
+    def name(self):
+        """
+        The name results are matched to the baseline by
+        """
+        server = self.server if self.server != "sync" else f"{self.threads}t"
+        name = f"len{self.length}-{self.workers}w-{server}-{self.payload or 0}"
+        if self.batch:
+            name = f"{name}-batch{self.batch}"
+        return f"{name}-hedged" if self.hedge else name
+
+    def settings(self):
+        """
+        The scenario as a dict, for the results
+        """
+        return {
+            "length": self.length,
+            "workers": self.workers,
+            "threads": self.threads,
+            "server": self.server,
+            "payload": self.payload or 0,
+            "hedge": self.hedge,
+            "batch": self.batch or 1,
+        }
+
+
+def scenarios(lengths, servers, payloads, hedging=(False,), batches=(None,)):
+    """
+    Every combination of chain length, server, payload size, hedging and
+    batch size
+    """
+    for (
+        length,
+        (workers, threads, server),
+        payload,
+        hedge,
+        batch,
+    ) in itertools.product(lengths, servers, payloads, hedging, batches):
+        yield Scenario(length, workers, threads, payload, server, hedge, batch)
+
+
+def measure(url, concurrency, duration, batch=None):
+    """
+    Send requests with concurrency workers for duration seconds, in batches
+    if batch is set, and return the summary of the load generator
+    """
+    generator = LoadGenerator(
+        url,
+        concurrency=concurrency,
+        duration=duration,
+        report_interval=duration + 1,
+        output=io.StringIO(),
+        hops=True,
+        batch=batch,
+    )
+    return asyncio.run(generator.run())
+
+
+def run_scenario(scenario, concurrency, duration, warmup, latency=None, work=None):
+    """
+    Start the chain of the scenario, measure it and stop it
+    """
+    with ZipkinStub() as zipkin:
+        chain = LocalChain(
+            scenario.length,
+            workers=scenario.workers,
+            threads=scenario.threads,
+            # http2 is the async app talking HTTP/2 to the next hop
+            server="sync" if scenario.server == "sync" else "async",
+            transport="http2" if scenario.server == "http2" else "http1",
+            payload=scenario.payload,
+            latency=latency,
+            work=work,
+            env={
+                "CHAIN_LINK_TRACE_ENDPOINT": zipkin.endpoint,
+                # export often, so the cost of exporting is in the run
+                "OTEL_BSP_SCHEDULE_DELAY": "500",
+                "CHAIN_LINK_HEDGE": str(scenario.hedge).lower(),
+            },
+        )
+        with chain:
+            if warmup:
+                measure(chain.url, concurrency, warmup, scenario.batch)
+            summary = measure(chain.url, concurrency, duration, scenario.batch)
+        return dict(
+            name=scenario.name,
+            **scenario.settings(),
+            concurrency=concurrency,
+            duration=duration,
+            requests=summary["requests"],
+            requests_per_second=summary["requests_per_second"],
+            goodput_per_second=summary["goodput_per_second"],
+            errors=summary["errors"],
+            latency_ms=summary["latency_ms"],
+            hops=summary.get("hops", []),
+            span_batches=zipkin.requests,
+        )
+
+
+def environment():
+    """
+    What the benchmarks ran on, so results from different machines aren't
+    mistaken for a regression
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": len(os.sched_getaffinity(0)),
+    }
+
+
+def compare(results, baseline, tolerance=0.25, p99_tolerance=0.5):
+    """
+    The ways the results are worse than the baseline, for the scenarios
+    both have
+    """
+    regressions = []
+    baseline_results = {result["name"]: result for result in baseline["results"]}
+    for result in results["results"]:
+        name = result["name"]
+        base = baseline_results.get(name)
+        if base is None:
+            continue
+        if result["errors"]:
+            regressions.append(f"{name}: errors {result['errors']}")
+        floor = base["requests_per_second"] * (1 - tolerance)
+        if result["requests_per_second"] < floor:
+            regressions.append(
+                f"{name}: {result['requests_per_second']} requests/second, "
+                f"the baseline is {base['requests_per_second']}"
+            )
+        for percentile, allowed in (("p50", tolerance), ("p99", p99_tolerance)):
+            ceiling = base["latency_ms"][percentile] * (1 + allowed)
+            if result["latency_ms"][percentile] > ceiling:
+                regressions.append(
+                    f"{name}: {percentile} {result['latency_ms'][percentile]}ms, "
+                    f"the baseline is {base['latency_ms'][percentile]}ms"
+                )
+    return regressions
+
+
+def parse_servers(value):
+    """
+    Parse servers like "1x2,2x4,async,http2", workers x threads, async, or
+    async over HTTP/2
+    """
+    servers = []
+    for server in value.split(","):
+        if server in ("async", "http2"):
+            servers.append((1, 1, server))
+        else:
+            workers, threads = server.split("x")
+            servers.append((int(workers), int(threads), "sync"))
+    return servers
+
+
+def create_parser():
+    """
+    Create the argument parser for the benchmarks
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m bench",
+        description="Benchmark chains of chain-link processes on localhost",
+    )
+    parser.add_argument(
+        "--lengths",
+        type=lambda value: [int(length) for length in value.split(",")],
+        help="Chain lengths to run, e.g. 1,3,6",
+        dest="lengths",
+        default=[1, 3, 6],
+    )
+    parser.add_argument(
+        "--servers",
+        type=parse_servers,
+        help="gunicorn workers x threads, async, or async over HTTP/2, "
+        "e.g. 1x2,2x4,async,http2",
+        dest="servers",
+        default=parse_servers("1x2,2x4"),
+    )
+    parser.add_argument(
+        "--payloads",
+        type=lambda value: [p if p != "0" else None for p in value.split(",")],
+        help="Bytes sent down and back up the chain, e.g. 0,64KiB",
+        dest="payloads",
+        default=[None, "64KiB"],
+    )
+    parser.add_argument(
+        "--hedging",
+        type=lambda value: [hedge == "on" for hedge in value.split(",")],
+        help="Run each scenario without and with hedging, e.g. off,on",
+        dest="hedging",
+        default=[False],
+    )
+    parser.add_argument(
+        "--batches",
+        type=lambda value: [int(b) if b != "1" else None for b in value.split(",")],
+        help="Requests sent down the chain at a time, to /batch, e.g. 1,10,100",
+        dest="batches",
+        default=[None],
+    )
+    parser.add_argument(
+        "--latency",
+        type=json.loads,
+        help="The latency model of every link as JSON, none by default",
+        dest="latency",
+        default=None,
+    )
+    parser.add_argument(
+        "--work",
+        type=json.loads,
+        help="The CPU and memory work of every link as JSON, none by default",
+        dest="work",
+        default=None,
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Requests in flight at once",
+        dest="concurrency",
+        default=8,
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        help="Seconds each scenario is measured for",
+        dest="duration",
+        default=5.0,
+    )
+    parser.add_argument(
+        "--warmup",
+        type=float,
+        help="Seconds of requests sent to each scenario first, and not counted",
+        dest="warmup",
+        default=1.0,
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Where to write the results as JSON",
+        dest="output",
+        default=None,
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        help="Results to compare with, the run fails if it is worse",
+        dest="baseline",
+        default=None,
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        help="How much lower throughput, or higher p50 latency, is allowed",
+        dest="tolerance",
+        default=0.25,
+    )
+    parser.add_argument(
+        "--p99-tolerance",
+        type=float,
+        help="How much higher p99 latency is allowed",
+        dest="p99_tolerance",
+        default=0.5,
+    )
+    return parser
+
+
+def main():
+    args = create_parser().parse_args()
+
+    results = {
+        "environment": environment(),
+        "latency": args.latency,
+        "work": args.work,
+        "results": [],
+    }
+    for scenario in scenarios(
+        args.lengths, args.servers, args.payloads, args.hedging, args.batches
+    ):
+        result = run_scenario(
+            scenario,
+            args.concurrency,
+            args.duration,
+            args.warmup,
+            args.latency,
+            args.work,
+        )
+        results["results"].append(result)
+        latency = result["latency_ms"]
+        print(
+            f"{result['name']:<24} {result['requests_per_second']:>8} req/s  "
+            f"p50 {latency['p50']:.2f}ms  p99 {latency['p99']:.2f}ms  "
+            f"errors {sum(result['errors'].values())}",
+            flush=True,
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+            output.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        for key in ("python", "machine", "cpus"):
+            if baseline["environment"].get(key) != results["environment"][key]:
+                print(
+                    f"The baseline was run with {key} "
+                    f"{baseline['environment'].get(key)}, not "
+                    f"{results['environment'][key]}",
+                    file=sys.stderr,
+                )
+        if baseline.get("latency") != results["latency"]:
+            print(
+                f"The baseline was run with the latency model "
+                f"{baseline.get('latency')}, not {results['latency']}",
+                file=sys.stderr,
+            )
+        if baseline.get("work") != results["work"]:
+            print(
+                f"The baseline was run with the work {baseline.get('work')}, "
+                f"not {results['work']}",
+                file=sys.stderr,
+            )
+        regressions = compare(results, baseline, args.tolerance, args.p99_tolerance)
+        if regressions:
+            print("Slower than the baseline:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Running a chain as gunicorn processes on localhost, with a stub that takes
+the place of Zipkin
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from link.topology import Topology
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    """
+    A port on localhost that nothing is listening on
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ZipkinStub:
+    """
+    Accepts spans like Zipkin does, and only counts them
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub._lock:
+                    stub.requests += 1
+                    stub.bytes += len(body)
+                self.send_response(202)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.endpoint = f"http://127.0.0.1:{self.server.server_address[1]}/api/v2/spans"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def services_config(ports, fan_out=1, payload=None, latency=None, work=None):
+    """
+    The services config of a chain of links on the given ports, with the
+    latency model of every link, no injected latency by default, payload
+    bytes sent down and back up the chain, and the work every link does
+    """
+    services = [f"127.0.0.1:{port}" for port in ports]
+    config = Topology.tree(services, fan_out).to_config()
+    config["latency"] = {"default": latency or {"distribution": "fixed", "value": 0}}
+    if payload:
+        config["payload"] = {"default": {"request": payload, "response": payload}}
+    if work:
+        config["work"] = {"default": work}
+    return config
+
+
+class LocalChain:
+    """
+    A chain of length links, each a gunicorn with the given workers and
+    threads, or a uvicorn worker when the server is async, or hypercorn when
+    the links talk HTTP/2
+    """
+
+    def __init__(
+        self,
+        length,
+        workers=1,
+        threads=2,
+        server="sync",
+        transport="http1",
+        fan_out=1,
+        payload=None,
+        latency=None,
+        work=None,
+        env=None,
+    ):
+        self.length = length
+        self.workers = workers
+        self.threads = threads
+        self.server = server
+        self.transport = transport
+        self.ports = [free_port() for _ in range(length)]
+        self.config = services_config(self.ports, fan_out, payload, latency, work)
+        self.env = env or {}
+        self.url = f"http://127.0.0.1:{self.ports[0]}/"
+        self.processes = []
+        self.directory = None
+
+    def command(self, port):
+        """
+        The gunicorn command line of the link on port, with the settings of
+        a pod, sized by the workers and threads of the chain, or the hypercorn
+        one with HTTP/2
+        """
+        if self.transport == "http2":
+            return [
+                sys.executable,
+                "-m",
+                "hypercorn",
+                "--config",
+                f"file:{os.path.join(REPO_DIR, 'hypercorn.conf.py')}",
+                "--bind",
+                f"127.0.0.1:{port}",
+                "asgi:app",
+            ]
+        return [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--chdir",
+            REPO_DIR,
+            "-c",
+            os.path.join(REPO_DIR, "gunicorn.conf.py"),
+            "-b",
+            f"127.0.0.1:{port}",
+        ]
+
+    def start(self, timeout=30.0):
+        """
+        Start the links and wait until they are all ready
+        """
+        self.directory = tempfile.mkdtemp(prefix="chain-link-bench-")
+        services_file = os.path.join(self.directory, "services.json")
+        with open(services_file, "w", encoding="utf-8") as f:
+            json.dump(self.config, f)
+
+        for port in self.ports:
+            metrics_dir = os.path.join(self.directory, f"metrics-{port}")
+            os.makedirs(metrics_dir)
+            env = dict(
+                os.environ,
+                CHAIN_LINK_SERVICES_FILE=services_file,
+                CHAIN_LINK_SERVICE_NAME=f"127.0.0.1:{port}",
+                CHAIN_LINK_SERVER=self.server,
+                CHAIN_LINK_TRANSPORT=self.transport,
+                CHAIN_LINK_WORKERS=str(self.workers),
+                CHAIN_LINK_THREADS=str(self.threads),
+                PROMETHEUS_MULTIPROC_DIR=metrics_dir,
+                **self.env,
+            )
+            log = open(os.path.join(self.directory, f"link-{port}.log"), "wb")
+            self.processes.append(
+                subprocess.Popen(
+                    self.command(port),
+                    cwd=REPO_DIR,
+                    env=env,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                )
+            )
+            log.close()
+
+        deadline = time.monotonic() + timeout
+        for port, process in zip(self.ports, self.processes):
+            while not self._ready(port):
+                if process.poll() is not None or time.monotonic() > deadline:
+                    # stop removes the log along with the other files
+                    log = self.log(port)
+                    self.stop()
+                    raise RuntimeError(f"The link on port {port} didn't start:\n{log}")
+                time.sleep(0.1)
+        return self
+
+    def _ready(self, port):
+        try:
+            response = requests.get(f"http://127.0.0.1:{port}/readiness", timeout=1)
+        except requests.RequestException:
+            return False
+        return response.status_code == 200
+
+    def log(self, port):
+        """
+        The output of the link on port
+        """
+        with open(os.path.join(self.directory, f"link-{port}.log"), "rb") as log:
+            return log.read().decode("utf-8", "replace")[-4000:]
+
+    def stop(self):
+        """
+        Stop the links and remove their files
+        """
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        self.processes = []
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,7 +1,9 @@
 """
 This module contains the argument parser for the chain-link cli
 """
+import json
 import argparse
+from link.loadgen import add_arguments as add_load_arguments
 from .log_utils import setup_logger
 import logging
 
@@ -27,6 +29,12 @@ def create_parser():
     subparsers.add_parser(
         "dry-run", help="Dry run the chain-link deployment to Kubernetes"
     )
+    simulate_parser = subparsers.add_parser(
+        "simulate", help="Time the chain-link app in process, without Kubernetes"
+    )
+    load_parser = subparsers.add_parser(
+        "load", help="Send load to a chain link and report its latency"
+    )
 
     generate_parser.add_argument(
         "--output-directory",
@@ -37,6 +45,49 @@ def create_parser():
         default="~/.config/chain-link/manifests",
     )
 
+    simulate_parser.add_argument(
+        "--requests",
+        type=int,
+        help="Number of requests to send through the chain",
+        required=False,
+        dest="requests",
+        default=1000,
+    )
+    simulate_parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Number of requests in flight at once",
+        required=False,
+        dest="concurrency",
+        default=1,
+    )
+    simulate_parser.add_argument(
+        "--warmup",
+        type=int,
+        help="Number of requests to send, and not count, first",
+        required=False,
+        dest="warmup",
+        default=100,
+    )
+    simulate_parser.add_argument(
+        "--services-file",
+        type=str,
+        help="A services.json to simulate instead of a chain of --instances",
+        required=False,
+        dest="services_file",
+        default=None,
+    )
+    simulate_parser.add_argument(
+        "--json",
+        help="Print the report as JSON",
+        action="store_true",
+        dest="json",
+        default=False,
+    )
+
+    # the same options as the load generator in the loadgenerator pod
+    add_load_arguments(load_parser, url="http://localhost:8000/")
+
     parser.add_argument(
         "--instances",
         type=int,
@@ -64,11 +115,282 @@ def create_parser():
     parser.add_argument(
         "--sleep-time",
         type=int,
-        help="Time to sleep between loadgenerator requests",
+        help="Time between loadgenerator requests, unless --load-rate is set",
         required=False,
         dest="sleep_time",
         default=60,
     )
+    parser.add_argument(
+        "--load-rate",
+        type=float,
+        help="Requests per second the loadgenerator sends to the chain",
+        required=False,
+        dest="load_rate",
+        default=None,
+    )
+    parser.add_argument(
+        "--load-concurrency",
+        type=int,
+        help="Most requests the loadgenerator has in flight",
+        required=False,
+        dest="load_concurrency",
+        default=10,
+    )
+    parser.add_argument(
+        "--load-batch",
+        type=int,
+        help="Requests the loadgenerator sends at a time, to /batch",
+        required=False,
+        dest="load_batch",
+        default=None,
+    )
+    parser.add_argument(
+        "--fan-out",
+        type=int,
+        help="Number of services each chain link forwards requests to",
+        required=False,
+        dest="fan_out",
+        default=1,
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        help="Run the chain links as a sync (threaded Flask) or async (ASGI) app",
+        required=False,
+        dest="server",
+        choices=["sync", "async"],
+        default="sync",
+    )
+    parser.add_argument(
+        "--transport",
+        type=str,
+        help="Call the next chain link over HTTP/1.1, or multiplexed over one "
+        "HTTP/2 connection, which needs --server async",
+        required=False,
+        dest="transport",
+        choices=["http1", "http2"],
+        default="http1",
+    )
+    parser.add_argument(
+        "--stream",
+        help="Stream responses back through the chain instead of buffering them",
+        action="store_true",
+        dest="stream",
+        default=False,
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="gunicorn workers per chain link pod, sized to its CPU limit by "
+        "default",
+        required=False,
+        dest="workers",
+        default=None,
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="Threads per gunicorn worker of the sync server",
+        required=False,
+        dest="threads",
+        default=None,
+    )
+    parser.add_argument(
+        "--preload",
+        help="Import the app once and fork the gunicorn workers from it, on by "
+        "default with more than one worker",
+        action="store_true",
+        dest="preload",
+        default=False,
+    )
+    parser.add_argument(
+        "--cpu-limit",
+        type=str,
+        help="CPU limit of each chain link pod, e.g. 500m or 2",
+        required=False,
+        dest="cpu_limit",
+        default=None,
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=str,
+        help="Memory limit of each chain link pod, e.g. 512Mi",
+        required=False,
+        dest="memory_limit",
+        default=None,
+    )
+    parser.add_argument(
+        "--replicas",
+        type=int,
+        help="Number of pods behind each chain link service",
+        required=False,
+        dest="replicas",
+        default=1,
+    )
+    parser.add_argument(
+        "--hedge",
+        help="Send a slow request to the next chain link again, and use the "
+        "first response",
+        action="store_true",
+        dest="hedge",
+        default=False,
+    )
+    parser.add_argument(
+        "--hedge-budget",
+        type=float,
+        help="Fraction of requests to the next chain link that can be hedged",
+        required=False,
+        dest="hedge_budget",
+        default=None,
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        help="Requests each chain link handles at once before it sheds the rest "
+        "with a 503, 0 for no limit",
+        required=False,
+        dest="max_in_flight",
+        default=None,
+    )
+    parser.add_argument(
+        "--admission-limit",
+        type=str,
+        help="Keep the in-flight limit fixed, or adapt it to the latency",
+        required=False,
+        dest="admission_limit",
+        choices=["fixed", "aimd", "gradient"],
+        default=None,
+    )
+    parser.add_argument(
+        "--admission-queue",
+        type=int,
+        help="Requests over the in-flight limit that wait for a slot",
+        required=False,
+        dest="admission_queue",
+        default=None,
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help="Comma separated numbers of the chain links that cache their "
+        "responses, e.g. 2,4",
+        required=False,
+        dest="cache",
+        default=None,
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        help="Seconds the caching chain links keep a response",
+        required=False,
+        dest="cache_ttl",
+        default=5.0,
+    )
+    parser.add_argument(
+        "--work",
+        type=str,
+        help="Comma separated numbers of the chain links that use CPU and "
+        "memory on each request, e.g. 2,4",
+        required=False,
+        dest="work",
+        default=None,
+    )
+    parser.add_argument(
+        "--work-profile",
+        type=json.loads,
+        help="The work of those chain links as JSON, see link/work.py",
+        required=False,
+        dest="work_profile",
+        default={"cpu": {"units": 100}},
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        help="Seconds a request has to get through the whole chain",
+        required=False,
+        dest="deadline",
+        default=None,
+    )
+    parser.add_argument(
+        "--trace-sampler",
+        type=str,
+        help="Which traces the chain links send to Zipkin",
+        required=False,
+        dest="trace_sampler",
+        choices=[
+            "always_on",
+            "always_off",
+            "parentbased_ratio",
+            "rate_limited",
+            "keep_slow",
+        ],
+        default="always_on",
+    )
+    parser.add_argument(
+        "--trace-sampler-arg",
+        type=float,
+        help="The ratio of traces, or traces per second with rate_limited, to keep",
+        required=False,
+        dest="trace_sampler_arg",
+        default=None,
+    )
+    parser.add_argument(
+        "--trace-exporter",
+        type=str,
+        help="How the chain links send spans, Zipkin JSON or protobuf, or OTLP",
+        required=False,
+        dest="trace_exporter",
+        choices=["zipkin_json", "zipkin_proto", "otlp_http"],
+        default="zipkin_json",
+    )
+    parser.add_argument(
+        "--trace-queue-size",
+        type=int,
+        help="Spans a chain link queues for export before dropping them",
+        required=False,
+        dest="trace_queue_size",
+        default=None,
+    )
+    parser.add_argument(
+        "--trace-batch-size",
+        type=int,
+        help="Most spans a chain link exports at once",
+        required=False,
+        dest="trace_batch_size",
+        default=None,
+    )
+    parser.add_argument(
+        "--trace-schedule-delay",
+        type=int,
+        help="Milliseconds between span exports",
+        required=False,
+        dest="trace_schedule_delay",
+        default=None,
+    )
+    parser.add_argument(
+        "--trace-spool",
+        help="Spool spans to disk in the chain links while Zipkin is unreachable",
+        action="store_true",
+        dest="trace_spool",
+        default=False,
+    )
+    parser.add_argument(
+        "--log-format",
+        type=str,
+        help="Write the chain link logs as JSON with their trace IDs, or as text",
+        required=False,
+        dest="log_format",
+        choices=["json", "text"],
+        default=None,
+    )
+    parser.add_argument(
+        "--log-sample",
+        type=str,
+        help="Keep 1 in N of the chain link log records of a level, e.g. info=100",
+        required=False,
+        dest="log_sample",
+        default=None,
+    )
 
     parser.add_argument(
         "-d",
@@ -8,6 +8,7 @@ import yaml
 import logging
 from kubernetes import client, config
 from kubernetes.client import V1SecurityContext
+from link.topology import Topology, TopologyError
 from .log_utils import setup_logger
 
 setup_logger(loglevel="INFO")
@@ -38,7 +39,39 @@ class ChainLink:
         namespace,
         sleep_time=60,
         action="deploy",
+        load_rate=None,
+        load_concurrency=10,
+        load_batch=None,
         output_directory="manifests",
+        server="sync",
+        transport="http1",
+        fan_out=1,
+        stream=False,
+        workers=None,
+        threads=None,
+        preload=False,
+        cpu_limit=None,
+        memory_limit=None,
+        replicas=1,
+        hedge=False,
+        hedge_budget=None,
+        max_in_flight=None,
+        admission_limit=None,
+        admission_queue=None,
+        cache=None,
+        cache_ttl=5.0,
+        work=None,
+        work_profile=None,
+        deadline=None,
+        trace_sampler="always_on",
+        trace_sampler_arg=None,
+        trace_exporter="zipkin_json",
+        trace_queue_size=None,
+        trace_batch_size=None,
+        trace_schedule_delay=None,
+        trace_spool=False,
+        log_format=None,
+        log_sample=None,
     ):
         self.logger = logging.getLogger(__name__)
         self.name = name
@@ -48,8 +81,13 @@ class ChainLink:
         # gunicorn in the container listens on port 8000
         self.chain_link_target_port = 8000
         self.sleep_time = sleep_time
+        self.load_rate = load_rate
+        self.load_concurrency = load_concurrency
+        self.load_batch = load_batch
         self.configmap_name = f"{self.name}-services"
+        self.fan_out = fan_out
         self.services = self.get_service_urls()
+        self.topology = self.get_topology()
         self.loadgerator_pod = None
         self.zipkin_service = None
         self.zipkin_deployment = None
@@ -60,6 +98,36 @@ class ChainLink:
         self.namespace_object = None
         self.manifests = []
         self.output_directory = output_directory
+        self.server = server
+        if transport == "http2" and server != "async":
+            raise ChainLinkError("HTTP/2 between chain links needs --server async")
+        self.transport = transport
+        self.stream = stream
+        self.workers = workers
+        self.threads = threads
+        self.preload = preload
+        self.cpu_limit = cpu_limit
+        self.memory_limit = memory_limit
+        self.replicas = replicas
+        self.hedge = hedge
+        self.hedge_budget = hedge_budget
+        self.max_in_flight = max_in_flight
+        self.admission_limit = admission_limit
+        self.admission_queue = admission_queue
+        self.cache = self.get_links(cache, "cache")
+        self.cache_ttl = cache_ttl
+        self.work = self.get_links(work, "do work")
+        self.work_profile = work_profile or {"cpu": {"units": 100}}
+        self.deadline = deadline
+        self.trace_sampler = trace_sampler
+        self.trace_sampler_arg = trace_sampler_arg
+        self.trace_exporter = trace_exporter
+        self.trace_queue_size = trace_queue_size
+        self.trace_batch_size = trace_batch_size
+        self.trace_schedule_delay = trace_schedule_delay
+        self.trace_spool = trace_spool
+        self.log_format = log_format
+        self.log_sample = log_sample
 
         try:
             config.load_kube_config()
@@ -134,6 +202,32 @@ class ChainLink:
         """
         return [f"{self.name}-service-{i}" for i in range(self.num_instances)]
 
+    def get_topology(self):
+        """
+        Returns the topology of the chain-link services, a tree where each
+        service forwards requests to the next fan_out services
+        """
+        try:
+            return Topology.tree(self.services, self.fan_out)
+        except TopologyError as esc:
+            raise ChainLinkError(f"Invalid chain-link topology: {esc}") from esc
+
+    def get_links(self, links, purpose):
+        """
+        Returns the numbers of the chain links that cache their responses, or
+        do work, from a comma separated list like "2,4"
+        """
+        if not links:
+            return set()
+        try:
+            numbers = {int(link) for link in links.split(",")}
+        except ValueError as esc:
+            raise ChainLinkError(f"Invalid chain links to {purpose}: {links}") from esc
+        unknown = sorted(link for link in numbers if not 0 <= link < self.num_instances)
+        if unknown:
+            raise ChainLinkError(f"There are no chain links {unknown} to {purpose}")
+        return numbers
+
     def create_object(
         self, obj_type, obj_name, obj_namespace, obj_body, obj_api, obj_logger
     ):
@@ -200,7 +294,7 @@ class ChainLink:
         """
         Sets a configmap in the kubernetes cluster
         """
-        data = {"services.json": json.dumps(self.services)}
+        data = {"services.json": json.dumps(self.topology.to_config())}
         configmap = client.V1ConfigMap(
             api_version="v1",
             kind="ConfigMap",
@@ -219,13 +313,39 @@ class ChainLink:
         self.manifests.append(yaml.dump(sanitized_configmap, indent=2))
 
     def create_config_map(self):
-        self.create_object(
-            obj_type="ConfigMap",
-            obj_name=self.configmap_name,
-            obj_namespace=self.namespace,
-            obj_body=self.configmap,
-            obj_api=self.core_api,
-            obj_logger=self.logger,
+        """
+        Creates the configmap, or updates it if it already exists, which the
+        chain-link pods pick up without being restarted
+        """
+        try:
+            self.core_api.read_namespaced_config_map(
+                name=self.configmap_name, namespace=self.namespace
+            )
+        except client.ApiException as esc:
+            if esc.status != 404:
+                raise ObjectCreationError(
+                    f"Error reading ConfigMap '{self.configmap_name}': {esc}"
+                ) from esc
+            self.create_object(
+                obj_type="ConfigMap",
+                obj_name=self.configmap_name,
+                obj_namespace=self.namespace,
+                obj_body=self.configmap,
+                obj_api=self.core_api,
+                obj_logger=self.logger,
+            )
+            return
+
+        try:
+            self.core_api.patch_namespaced_config_map(
+                name=self.configmap_name, namespace=self.namespace, body=self.configmap
+            )
+        except client.ApiException as esc:
+            raise ObjectCreationError(
+                f"Error updating ConfigMap '{self.configmap_name}': {esc}"
+            ) from esc
+        self.logger.info(
+            f"Updated ConfigMap '{self.configmap_name}' in namespace '{self.namespace}'"
         )
 
     def set_chain_link_deployments(self):
@@ -248,17 +368,15 @@ class ChainLink:
                 name=self.name,
                 image=self.image_name,
                 image_pull_policy="Always",
-                env=[
-                    client.V1EnvVar(
-                        name="CHAIN_LINK_SERVICE_NAME", value=f"{self.name}-service-{i}"
-                    )
-                ],
+                env=self.get_chain_link_env(i),
+                resources=self.get_chain_link_resources(),
                 readiness_probe=client.V1Probe(
                     http_get=client.V1HTTPGetAction(
                         path="/readiness", port=8000, scheme="HTTP"
                     ),
-                    initial_delay_seconds=5,
-                    period_seconds=10,
+                    # the pod is ready as soon as its workers have warmed up
+                    initial_delay_seconds=1,
+                    period_seconds=2,
                 ),
             )
 
@@ -288,7 +406,9 @@ class ChainLink:
             )
             template.spec.containers[0].volume_mounts = [container_volume_mount]
             spec = client.V1DeploymentSpec(
-                replicas=1, template=template, selector={"matchLabels": labels}
+                replicas=self.replicas,
+                template=template,
+                selector={"matchLabels": labels},
             )
             # NOTE(curtis): I'm setting the api_version and kind here, it's not
             # necessary to deploy, but when I pring the deployment object it
@@ -308,6 +428,61 @@ class ChainLink:
             )
             self.manifests.append(yaml.dump(sanitized_deployment, indent=2))
 
+    def get_chain_link_env(self, i):
+        """
+        Returns the environment variables for the i-th chain-link container
+        """
+        env = {
+            "CHAIN_LINK_SERVICE_NAME": f"{self.name}-service-{i}",
+            "CHAIN_LINK_SERVER": self.server,
+            "CHAIN_LINK_TRANSPORT": self.transport,
+            "CHAIN_LINK_STREAM": str(self.stream).lower(),
+            "CHAIN_LINK_WORKERS": self.workers,
+            "CHAIN_LINK_THREADS": self.threads,
+            # left to the chain link, which preloads with more than one worker
+            "CHAIN_LINK_PRELOAD": "true" if self.preload else None,
+            "CHAIN_LINK_HEDGE": str(self.hedge).lower(),
+            "CHAIN_LINK_HEDGE_BUDGET": self.hedge_budget,
+            "CHAIN_LINK_MAX_IN_FLIGHT": self.max_in_flight,
+            "CHAIN_LINK_ADMISSION_LIMIT": self.admission_limit,
+            "CHAIN_LINK_ADMISSION_QUEUE": self.admission_queue,
+            # the links marked to cache their responses
+            "CHAIN_LINK_CACHE": json.dumps({"ttl": self.cache_ttl})
+            if i in self.cache
+            else None,
+            # the links marked to use CPU and memory on each request
+            "CHAIN_LINK_WORK": json.dumps(self.work_profile)
+            if i in self.work
+            else None,
+            "CHAIN_LINK_DEADLINE": self.deadline,
+            "CHAIN_LINK_TRACE_SAMPLER": self.trace_sampler,
+            "CHAIN_LINK_TRACE_SAMPLER_ARG": self.trace_sampler_arg,
+            "CHAIN_LINK_TRACE_EXPORTER": self.trace_exporter,
+            "OTEL_BSP_MAX_QUEUE_SIZE": self.trace_queue_size,
+            "OTEL_BSP_MAX_EXPORT_BATCH_SIZE": self.trace_batch_size,
+            "OTEL_BSP_SCHEDULE_DELAY": self.trace_schedule_delay,
+            "CHAIN_LINK_TRACE_SPOOL": str(self.trace_spool).lower(),
+            "CHAIN_LINK_LOG_FORMAT": self.log_format,
+            "CHAIN_LINK_LOG_SAMPLE": self.log_sample,
+        }
+        # settings that aren't set are left to the defaults of the chain link
+        return [
+            client.V1EnvVar(name=name, value=str(value))
+            for name, value in env.items()
+            if value is not None
+        ]
+
+    def get_chain_link_resources(self):
+        """
+        Returns the CPU and memory limits of a chain-link container, which
+        gunicorn sizes its workers to, or None to leave them unlimited
+        """
+        limits = {"cpu": self.cpu_limit, "memory": self.memory_limit}
+        limits = {name: value for name, value in limits.items() if value is not None}
+        if not limits:
+            return None
+        return client.V1ResourceRequirements(limits=limits, requests=limits)
+
     def create_chain_link_deployments(self):
         """
         Creates a chain-link deployment in the kubernetes cluster
@@ -475,16 +650,30 @@ class ChainLink:
         # Create labels for the pod
         labels = {"app": "chain-link", "service": "loadgenerator"}
 
-        # Define the container spec
-        st = self.sleep_time
+        # without a rate, send a request every sleep_time seconds, as the
+        # busybox loop that was here did
+        rate = self.load_rate or 1 / self.sleep_time
+        command = [
+            "python",
+            "-m",
+            "link.loadgen",
+            "--url",
+            f"http://{self.name}-service-0/",
+            "--rate",
+            str(rate),
+            "--concurrency",
+            str(self.load_concurrency),
+            "--report-interval",
+            "60",
+        ]
+        if self.load_batch:
+            command += ["--batch", str(self.load_batch)]
         container = client.V1Container(
-            name="busybox",
-            image="busybox",
-            command=[
-                "/bin/sh",
-                "-c",
-                f"while sleep {st}; do wget -qO- chain-link-service-0; done",
-            ],
+            name="loadgenerator",
+            image=self.image_name,
+            image_pull_policy="Always",
+            command=command,
+            working_dir="/app",
             security_context=V1SecurityContext(
                 run_as_user=65534
             ),  # Use user 'nobody' (usually has UID 65534)
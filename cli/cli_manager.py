@@ -1,3 +1,4 @@
+import json
 import logging
 import sys
 from .chainlink import ChainLink, ChainLinkError
@@ -5,10 +6,52 @@ from .log_utils import setup_logger
 from .utils import check_python_version, check_required_modules
 from .arg_parser import create_parser
 from .config import set_config
+from .simulate import simulate
+from link.loadgen import load
 
 NAME = "chain-link"
 
 
+def chain_link_options(args):
+    """
+    The ChainLink settings given on the command line, for deploy and generate
+    """
+    return {
+        "load_rate": args.load_rate,
+        "load_concurrency": args.load_concurrency,
+        "load_batch": args.load_batch,
+        "fan_out": args.fan_out,
+        "server": args.server,
+        "transport": args.transport,
+        "stream": args.stream,
+        "workers": args.workers,
+        "threads": args.threads,
+        "preload": args.preload,
+        "cpu_limit": args.cpu_limit,
+        "memory_limit": args.memory_limit,
+        "replicas": args.replicas,
+        "hedge": args.hedge,
+        "hedge_budget": args.hedge_budget,
+        "max_in_flight": args.max_in_flight,
+        "admission_limit": args.admission_limit,
+        "admission_queue": args.admission_queue,
+        "cache": args.cache,
+        "cache_ttl": args.cache_ttl,
+        "work": args.work,
+        "work_profile": args.work_profile,
+        "deadline": args.deadline,
+        "trace_sampler": args.trace_sampler,
+        "trace_sampler_arg": args.trace_sampler_arg,
+        "trace_exporter": args.trace_exporter,
+        "trace_queue_size": args.trace_queue_size,
+        "trace_batch_size": args.trace_batch_size,
+        "trace_schedule_delay": args.trace_schedule_delay,
+        "trace_spool": args.trace_spool,
+        "log_format": args.log_format,
+        "log_sample": args.log_sample,
+    }
+
+
 def run_cli():
     check_python_version()
     required_modules = ["argparse", "kubernetes", "json", "importlib"]
@@ -28,7 +71,65 @@ def run_cli():
         logger.info("Number of instances: %s", args.num_instances)
         logger.info("Namespace: %s", args.namespace)
         logger.info("ChainLink image: %s", args.image_name)
-        logger.info("Loadgenerator sleep time: %s", args.sleep_time)
+        logger.info(
+            "Loadgenerator rate: %s requests/second, %s at most in flight%s",
+            args.load_rate or 1 / args.sleep_time,
+            args.load_concurrency,
+            f", in batches of {args.load_batch}" if args.load_batch else "",
+        )
+        logger.info("ChainLink fan out: %s", args.fan_out)
+        logger.info("ChainLink server: %s", args.server)
+        logger.info("ChainLink transport: %s", args.transport)
+        logger.info("ChainLink streaming: %s", args.stream)
+        logger.info(
+            "ChainLink gunicorn: %s workers, %s threads%s",
+            args.workers or "auto",
+            args.threads or "auto",
+            ", preloaded" if args.preload else "",
+        )
+        logger.info(
+            "ChainLink limits: cpu %s, memory %s",
+            args.cpu_limit or "none",
+            args.memory_limit or "none",
+        )
+        logger.info("ChainLink replicas: %s", args.replicas)
+        logger.info(
+            "ChainLink hedging: %s",
+            f"budget {args.hedge_budget or 'default'}" if args.hedge else "off",
+        )
+        logger.info(
+            "ChainLink admission: %s",
+            f"{args.max_in_flight} in flight, {args.admission_limit or 'fixed'}, "
+            f"queue {args.admission_queue or 0}"
+            if args.max_in_flight
+            else "off",
+        )
+        logger.info(
+            "ChainLink cache: %s",
+            f"links {args.cache} for {args.cache_ttl}s" if args.cache else "off",
+        )
+        logger.info(
+            "ChainLink work: %s",
+            f"links {args.work}, {json.dumps(args.work_profile)}"
+            if args.work
+            else "off",
+        )
+        logger.info(
+            "ChainLink deadline: %s",
+            "default" if args.deadline is None else f"{args.deadline}s",
+        )
+        logger.info(
+            "ChainLink trace sampler: %s %s",
+            args.trace_sampler,
+            "" if args.trace_sampler_arg is None else args.trace_sampler_arg,
+        )
+        logger.info("ChainLink trace exporter: %s", args.trace_exporter)
+        logger.info("ChainLink trace spool: %s", args.trace_spool)
+        logger.info(
+            "ChainLink logs: %s, sample %s",
+            args.log_format or "json",
+            args.log_sample or "none",
+        )
 
     if args.command == "deploy":
         logger.info("Deploying chain-link to Kubernetes cluster...")
@@ -41,6 +142,7 @@ def run_cli():
                 args.namespace,
                 args.sleep_time,
                 action="deploy",
+                **chain_link_options(args),
             )
         except ChainLinkError as e:
             print(f"An error occurred: {e}")
@@ -69,6 +171,7 @@ def run_cli():
                 args.namespace,
                 args.sleep_time,
                 action="generate",
+                **chain_link_options(args),
                 output_directory=args.output_directory,
             )
         except ChainLinkError as e:
@@ -76,5 +179,19 @@ def run_cli():
             sys.exit(1)
     elif args.command == "dry-run":
         logger.warning("dry-run not implemented yet...")
+    elif args.command == "simulate":
+        logger.info("Simulating chain-link in process...")
+        try:
+            simulate(args)
+        except (OSError, ValueError, RuntimeError) as e:
+            print(f"An error occurred: {e}")
+            sys.exit(1)
+    elif args.command == "load":
+        logger.info("Sending load to %s...", args.url)
+        try:
+            load(args)
+        except ValueError as e:
+            print(f"An error occurred: {e}")
+            sys.exit(1)
     else:
         parser.print_help()
@@ -3,6 +3,7 @@ This module is responsible for managing the config file for the CLI
 """
 
 import os
+import json
 import configparser
 from .log_utils import setup_logger
 import logging
@@ -43,6 +44,81 @@ def set_config(args):
         args.sleep_time = config.getint(
             "DEFAULT", "sleep_time", fallback=args.sleep_time
         )
+        args.load_rate = get_optional(config, "load_rate", float, args.load_rate)
+        args.load_concurrency = config.getint(
+            "DEFAULT", "load_concurrency", fallback=args.load_concurrency
+        )
+        args.load_batch = get_optional(config, "load_batch", int, args.load_batch)
+        args.fan_out = config.getint("DEFAULT", "fan_out", fallback=args.fan_out)
+        args.server = config.get("DEFAULT", "server", fallback=args.server)
+        args.transport = config.get("DEFAULT", "transport", fallback=args.transport)
+        args.stream = config.getboolean("DEFAULT", "stream", fallback=args.stream)
+        args.workers = get_optional(config, "workers", int, args.workers)
+        args.threads = get_optional(config, "threads", int, args.threads)
+        args.preload = config.getboolean("DEFAULT", "preload", fallback=args.preload)
+        args.cpu_limit = get_optional(config, "cpu_limit", str, args.cpu_limit)
+        args.memory_limit = get_optional(config, "memory_limit", str, args.memory_limit)
+        args.replicas = config.getint("DEFAULT", "replicas", fallback=args.replicas)
+        args.hedge = config.getboolean("DEFAULT", "hedge", fallback=args.hedge)
+        args.hedge_budget = get_optional(
+            config, "hedge_budget", float, args.hedge_budget
+        )
+        args.max_in_flight = get_optional(
+            config, "max_in_flight", int, args.max_in_flight
+        )
+        args.admission_limit = get_optional(
+            config, "admission_limit", str, args.admission_limit
+        )
+        args.admission_queue = get_optional(
+            config, "admission_queue", int, args.admission_queue
+        )
+        args.cache = get_optional(config, "cache", str, args.cache)
+        args.cache_ttl = config.getfloat(
+            "DEFAULT", "cache_ttl", fallback=args.cache_ttl
+        )
+        args.work = get_optional(config, "work", str, args.work)
+        args.work_profile = get_optional(
+            config, "work_profile", json.loads, args.work_profile
+        )
+        args.deadline = get_optional(config, "deadline", float, args.deadline)
+        args.trace_sampler = config.get(
+            "DEFAULT", "trace_sampler", fallback=args.trace_sampler
+        )
+        args.trace_sampler_arg = get_optional(
+            config, "trace_sampler_arg", float, args.trace_sampler_arg
+        )
+        args.trace_exporter = config.get(
+            "DEFAULT", "trace_exporter", fallback=args.trace_exporter
+        )
+        args.trace_queue_size = get_optional(
+            config, "trace_queue_size", int, args.trace_queue_size
+        )
+        args.trace_batch_size = get_optional(
+            config, "trace_batch_size", int, args.trace_batch_size
+        )
+        args.trace_schedule_delay = get_optional(
+            config, "trace_schedule_delay", int, args.trace_schedule_delay
+        )
+        args.trace_spool = config.getboolean(
+            "DEFAULT", "trace_spool", fallback=args.trace_spool
+        )
+        args.log_format = get_optional(config, "log_format", str, args.log_format)
+        args.log_sample = get_optional(config, "log_sample", str, args.log_sample)
+
+
+def get_optional(config, key, convert, fallback):
+    """
+    Get a setting that can be left empty to use the default of the chain link
+    """
+    value = config.get("DEFAULT", key, fallback="")
+    return convert(value) if value else fallback
+
+
+def optional(value):
+    """
+    Write a setting that isn't set as an empty value
+    """
+    return "" if value is None else value
 
 
 def create_config_file(args):
@@ -56,6 +132,38 @@ def create_config_file(args):
         "namespace": args.namespace,
         "chain_link_image": args.image_name,
         "sleep_time": args.sleep_time,
+        "load_rate": optional(args.load_rate),
+        "load_concurrency": args.load_concurrency,
+        "load_batch": optional(args.load_batch),
+        "fan_out": args.fan_out,
+        "server": args.server,
+        "transport": args.transport,
+        "stream": args.stream,
+        "workers": optional(args.workers),
+        "threads": optional(args.threads),
+        "preload": args.preload,
+        "cpu_limit": optional(args.cpu_limit),
+        "memory_limit": optional(args.memory_limit),
+        "replicas": args.replicas,
+        "hedge": args.hedge,
+        "hedge_budget": optional(args.hedge_budget),
+        "max_in_flight": optional(args.max_in_flight),
+        "admission_limit": optional(args.admission_limit),
+        "admission_queue": optional(args.admission_queue),
+        "cache": optional(args.cache),
+        "cache_ttl": args.cache_ttl,
+        "work": optional(args.work),
+        "work_profile": json.dumps(args.work_profile),
+        "deadline": optional(args.deadline),
+        "trace_sampler": args.trace_sampler,
+        "trace_sampler_arg": optional(args.trace_sampler_arg),
+        "trace_exporter": args.trace_exporter,
+        "trace_queue_size": optional(args.trace_queue_size),
+        "trace_batch_size": optional(args.trace_batch_size),
+        "trace_schedule_delay": optional(args.trace_schedule_delay),
+        "trace_spool": args.trace_spool,
+        "log_format": optional(args.log_format),
+        "log_sample": optional(args.log_sample),
     }
 
     # if user specifies --config some.config then it won't have a directory
@@ -0,0 +1,40 @@
+"""
+This module runs the chain-link app in process to time it
+"""
+
+import os
+import json
+import logging
+from link.simulator import Simulator, chain_config, format_report
+from .log_utils import setup_logger
+
+setup_logger(loglevel="INFO")
+logger = logging.getLogger(__name__)
+
+
+def simulate(args):
+    """
+    Simulate a chain of args.num_instances services, or the services file,
+    with the link settings of the CLI, and print what a hop costs
+    """
+    if args.services_file:
+        with open(args.services_file, encoding="utf-8") as services_file:
+            services_config = json.load(services_file)
+    else:
+        services_config = chain_config(args.num_instances, args.fan_out)
+
+    # the settings a chain link would get from its deployment
+    os.environ["CHAIN_LINK_STREAM"] = str(args.stream).lower()
+    os.environ["CHAIN_LINK_TRACE_SAMPLER"] = args.trace_sampler
+    if args.trace_sampler_arg is not None:
+        os.environ["CHAIN_LINK_TRACE_SAMPLER_ARG"] = str(args.trace_sampler_arg)
+
+    simulator = Simulator(services_config)
+    logger.info(
+        "Sending %s requests through %s services, %s at a time",
+        args.requests,
+        len(simulator.topology),
+        args.concurrency,
+    )
+    report = simulator.run(args.requests, args.concurrency, args.warmup)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
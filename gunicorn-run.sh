@@ -1,4 +1,23 @@
 #!/bin/bash
 
 : ${PORT:=8000}
-gunicorn --chdir /app -w 1 --threads 2 -b 0.0.0.0:${PORT} app:app
+export PORT
+
+# the workers share their metrics through files in here, which have to be
+# cleared out before they start
+: ${PROMETHEUS_MULTIPROC_DIR:=/tmp/chain-link-metrics}
+export PROMETHEUS_MULTIPROC_DIR
+rm -rf "${PROMETHEUS_MULTIPROC_DIR}"
+mkdir -p "${PROMETHEUS_MULTIPROC_DIR}"
+
+# gunicorn only speaks HTTP/1.1, a link that talks HTTP/2 to the next hop is
+# run by hypercorn, see link/transport.py
+if [ "${CHAIN_LINK_TRANSPORT}" = "http2" ]; then
+    cd /app
+    exec hypercorn --config file:/app/hypercorn.conf.py asgi:app
+fi
+
+# the workers, threads and worker class of the sync or async app are sized to
+# the pod's CPU and memory limits in gunicorn.conf.py, unless they are set
+# with CHAIN_LINK_WORKERS and CHAIN_LINK_THREADS
+exec gunicorn --chdir /app -c /app/gunicorn.conf.py
@@ -0,0 +1,45 @@
+"""
+The gunicorn settings of a chain link, sized to the limits of its pod, see
+link/autosize.py
+"""
+
+import os
+import sys
+
+# gunicorn reads this before it changes to the app directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from prometheus_client import multiprocess  # noqa: E402
+from link.autosize import PRELOADING_ENV, ServerSizing  # noqa: E402
+
+sizing = ServerSizing.from_env()
+
+wsgi_app = sizing.app
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = sizing.workers
+threads = sizing.threads
+worker_class = sizing.worker_class
+preload_app = sizing.preload
+
+if preload_app:
+    # the master imports the app but doesn't serve it, so the app only warms
+    # up in the workers, in post_fork
+    os.environ[PRELOADING_ENV] = "true"
+
+
+def on_starting(server):
+    server.log.info("Chain link server: %s", sizing)
+
+
+def post_fork(server, worker):
+    # a preloaded app was imported by the master, its threads and
+    # connections have to be started again in the worker
+    module = sys.modules.get(sizing.app.split(":")[0])
+    if module is not None:
+        module.post_fork()
+
+
+def child_exit(server, worker):
+    # stop adding up the live gauges of a worker that is gone
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
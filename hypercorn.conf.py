@@ -0,0 +1,42 @@
+"""
+The hypercorn settings of a chain link that talks HTTP/2 to its next hop,
+sized to the limits of its pod like gunicorn.conf.py, see link/transport.py
+"""
+
+import os
+import sys
+import logging
+
+# hypercorn reads this before the app directory is on the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from link.autosize import ServerSizing  # noqa: E402
+from link.env import env_float  # noqa: E402
+from link.transport import TransportSettings  # noqa: E402
+
+sizing = ServerSizing.from_env()
+transport_settings = TransportSettings.from_env()
+
+bind = [f"0.0.0.0:{os.environ.get('PORT', '8000')}"]
+workers = sizing.workers
+worker_class = sizing.worker_class
+h2_max_concurrent_streams = transport_settings.max_streams
+# a little longer than callers keep an idle connection, so they close it first
+keep_alive_timeout = env_float("CHAIN_LINK_POOL_IDLE_TIMEOUT", 60.0) + 5
+errorlog = "-"
+
+# hypercorn only sets up its error log after reading this, and then replaces
+# its handlers, so the sizing goes to it through one in the same format, like
+# gunicorn.conf.py logs it to server.log
+logger = logging.getLogger("hypercorn.error")
+if not logger.handlers:
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(
+        logging.Formatter(
+            "%(asctime)s [%(process)d] [%(levelname)s] %(message)s",
+            "[%Y-%m-%d %H:%M:%S %z]",
+        )
+    )
+    logger.addHandler(handler)
+logger.setLevel(logging.INFO)
+logger.info("Chain link server: %s", sizing)
@@ -0,0 +1,371 @@
+"""
+Admission control, so a link that is overloaded answers the requests it
+can't take with a 503 straight away instead of letting them queue up unseen.
+
+With CHAIN_LINK_MAX_IN_FLIGHT above 0, a worker handles at most that many
+requests to / and /forward at once. Up to CHAIN_LINK_ADMISSION_QUEUE more
+wait for a slot for CHAIN_LINK_ADMISSION_QUEUE_TIMEOUT seconds, or until
+their deadline, and the rest are answered at once with a 503 and a
+Retry-After of CHAIN_LINK_RETRY_AFTER seconds. /readiness, /metrics and
+/stats are never held up.
+
+The limit is fixed at CHAIN_LINK_MAX_IN_FLIGHT by default.
+CHAIN_LINK_ADMISSION_LIMIT can make it adapt to how the link is doing
+instead, between 1 and that maximum:
+
+    aimd      grows by one for every request that is answered while the link
+              is busy, and is cut by a tenth for every request that fails
+              or takes longer than CHAIN_LINK_ADMISSION_TARGET seconds
+    gradient  follows the ratio of the long-run average latency to the
+              recent one, so it shrinks as requests start to queue and
+              grows back once they don't
+
+Requests that wait in gunicorn's backlog, or for one of its threads, can't
+be seen by the app, so unless CHAIN_LINK_THREADS is set, autosize.py gives
+the sync app enough threads for the admitted and queued requests and a few
+more to turn the rest away.
+"""
+
+import math
+import time
+import json
+import asyncio
+import threading
+from collections import deque
+from .deadline import DEADLINE_HEADER
+from .env import env_float, env_int, env_str
+from .metrics import ADMISSION_LIMIT, REQUESTS_SHED
+
+SHED_STATUS = 503
+
+SHED_MESSAGE = "{service} is overloaded, try again later"
+
+# the routes that are admitted, the probes and stats always get through
+ADMITTED_ROUTES = ("/", "/forward", "/batch")
+
+
+class AdmissionSettings:
+    """
+    How many requests a worker handles at once, how the limit adapts, and how
+    many requests wait for a slot and for how long
+    """
+
+    LIMITS = ("fixed", "aimd", "gradient")
+
+    def __init__(
+        self,
+        max_in_flight=0,
+        limit="fixed",
+        queue=0,
+        queue_timeout=1.0,
+        retry_after=1,
+        target=None,
+    ):
+        if limit not in self.LIMITS:
+            raise ValueError(
+                f"The admission limit has to be one of {', '.join(self.LIMITS)}, "
+                f"not {limit}"
+            )
+        self.max_in_flight = max_in_flight
+        self.limit = limit
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.target = target
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the settings from CHAIN_LINK_MAX_IN_FLIGHT,
+        CHAIN_LINK_ADMISSION_LIMIT, CHAIN_LINK_ADMISSION_QUEUE,
+        CHAIN_LINK_ADMISSION_QUEUE_TIMEOUT, CHAIN_LINK_RETRY_AFTER and
+        CHAIN_LINK_ADMISSION_TARGET
+        """
+        return cls(
+            max_in_flight=env_int("CHAIN_LINK_MAX_IN_FLIGHT", 0),
+            limit=env_str("CHAIN_LINK_ADMISSION_LIMIT", "fixed"),
+            queue=env_int("CHAIN_LINK_ADMISSION_QUEUE", 0),
+            queue_timeout=env_float("CHAIN_LINK_ADMISSION_QUEUE_TIMEOUT", 1.0),
+            retry_after=env_int("CHAIN_LINK_RETRY_AFTER", 1),
+            target=env_float("CHAIN_LINK_ADMISSION_TARGET", None),
+        )
+
+    @property
+    def enabled(self):
+        """
+        Whether requests are limited at all
+        """
+        return self.max_in_flight > 0
+
+
+class FixedLimit:
+    """
+    A limit that stays where it is set
+    """
+
+    def __init__(self, maximum):
+        self.value = maximum
+
+    def update(self, elapsed, failed, in_flight):
+        """
+        Adjust the limit after a request that took elapsed seconds
+        """
+
+
+class AIMDLimit:
+    """
+    Additive increase, multiplicative decrease: one more while the requests
+    that fill the limit go well, a tenth less when one doesn't
+    """
+
+    def __init__(self, maximum, target=None, backoff=0.9):
+        self.maximum = maximum
+        self.target = target
+        self.backoff = backoff
+        self.value = float(maximum)
+
+    def update(self, elapsed, failed, in_flight):
+        """
+        Adjust the limit after a request that took elapsed seconds
+        """
+        if failed or (self.target is not None and elapsed > self.target):
+            self.value = max(1.0, self.value * self.backoff)
+        # only grow while the limit is being used, or it drifts up when idle
+        elif in_flight * 2 >= self.value:
+            self.value = min(float(self.maximum), self.value + 1)
+
+
+class GradientLimit:
+    """
+    Scales the limit by how much longer requests take now than they usually
+    do, plus room for a few more to queue so it can grow back
+    """
+
+    def __init__(self, maximum, smoothing=0.2, long_window=600, short_window=10):
+        self.maximum = maximum
+        self.smoothing = smoothing
+        self.value = float(maximum)
+        self._long_alpha = 2 / (long_window + 1)
+        self._short_alpha = 2 / (short_window + 1)
+        self._long = None
+        self._short = None
+
+    def update(self, elapsed, failed, in_flight):
+        """
+        Adjust the limit after a request that took elapsed seconds
+        """
+        if self._long is None:
+            self._long = self._short = elapsed
+            return
+        self._long += (elapsed - self._long) * self._long_alpha
+        self._short += (elapsed - self._short) * self._short_alpha
+        # a failed request is as bad as requests taking twice as long
+        gradient = 0.5 if failed else max(0.5, min(1.0, self._long / self._short))
+        # recover faster when the latency has settled at a new level
+        if self._long > self._short * 2:
+            self._long *= 0.95
+        target = self.value * gradient + math.sqrt(self.value)
+        value = self.value * (1 - self.smoothing) + target * self.smoothing
+        self.value = max(1.0, min(float(self.maximum), value))
+
+
+def create_limit(settings):
+    """
+    The limit named by the settings
+    """
+    if settings.limit == "aimd":
+        return AIMDLimit(settings.max_in_flight, settings.target)
+    elif settings.limit == "gradient":
+        return GradientLimit(settings.max_in_flight)
+    return FixedLimit(settings.max_in_flight)
+
+
+class Ticket:
+    """
+    A request that was let in, and how it went
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.status = None
+
+    def respond(self, status):
+        """
+        Record the status of the response
+        """
+        if self.status is None:
+            self.status = status
+
+    @property
+    def failed(self):
+        """
+        Whether the request failed, or timed out, which a limit backs off on
+        """
+        return self.status is None or self.status >= 500
+
+
+class AdmissionController:
+    """
+    Lets in the requests of a worker up to its limit, holds a few more in a
+    queue, and sheds the rest
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.limit = create_limit(settings)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        self._waiting = 0
+        # the requests of the async app waiting for a slot, oldest first
+        self._waiters = deque()
+        ADMISSION_LIMIT.set(self.limit.value)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create an AdmissionController with the settings from the env vars
+        """
+        return cls(AdmissionSettings.from_env())
+
+    def _has_room(self):
+        return self.in_flight < int(self.limit.value)
+
+    def _queue_timeout(self, remaining):
+        timeout = self.settings.queue_timeout
+        return timeout if remaining is None else min(timeout, remaining)
+
+    def acquire(self, remaining=None):
+        """
+        Let a request in, waiting in the queue for up to the queue timeout or
+        the remaining seconds of its deadline, and return its Ticket, or None
+        if it has to be shed
+        """
+        with self._cond:
+            if self._has_room():
+                self.in_flight += 1
+                return Ticket()
+            if self._waiting >= self.settings.queue:
+                REQUESTS_SHED.labels("queue_full").inc()
+                return None
+            self._waiting += 1
+            try:
+                admitted = self._cond.wait_for(
+                    self._has_room, self._queue_timeout(remaining)
+                )
+            finally:
+                self._waiting -= 1
+            if not admitted:
+                REQUESTS_SHED.labels("queue_timeout").inc()
+                return None
+            self.in_flight += 1
+            return Ticket()
+
+    async def acquire_async(self, remaining=None):
+        """
+        Let a request of the async app in, like acquire does
+        """
+        if self._has_room() and not self._waiters:
+            self.in_flight += 1
+            return Ticket()
+        if len(self._waiters) >= self.settings.queue:
+            REQUESTS_SHED.labels("queue_full").inc()
+            return None
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self._queue_timeout(remaining))
+        except asyncio.TimeoutError:
+            # the slot may have been handed over just as the wait timed out
+            if not waiter.done() or waiter.cancelled():
+                REQUESTS_SHED.labels("queue_timeout").inc()
+                return None
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        return Ticket()
+
+    def release(self, ticket):
+        """
+        Let go of the slot of a request once it has been answered, and let
+        the next ones waiting in
+        """
+        elapsed = time.perf_counter() - ticket.start
+        with self._cond:
+            self.limit.update(elapsed, ticket.failed, self.in_flight)
+            self.in_flight -= 1
+            # a slot is handed straight to the request of the async app that
+            # has waited longest, and it counts as in flight from then on
+            while self._waiters and self._has_room():
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(True)
+                    self.in_flight += 1
+            self._cond.notify(max(1, int(self.limit.value) - self.in_flight))
+        ADMISSION_LIMIT.set(self.limit.value)
+
+    def rejection(self, service):
+        """
+        The body, status and headers to shed a request with
+        """
+        return (
+            {"message": SHED_MESSAGE.format(service=service)},
+            SHED_STATUS,
+            {"Retry-After": str(self.settings.retry_after)},
+        )
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits the requests of the async app
+    """
+
+    def __init__(self, app, controller, service, deadline_settings, routes=None):
+        self.app = app
+        self.controller = controller
+        self.service = service
+        self.deadline_settings = deadline_settings
+        self.routes = set(routes or ADMITTED_ROUTES)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not self.controller.settings.enabled
+            or scope["path"] not in self.routes
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        deadline = self.deadline_settings.deadline(
+            headers.get(DEADLINE_HEADER.lower().encode(), b"").decode("latin-1")
+        )
+        ticket = await self.controller.acquire_async(deadline.remaining())
+        if ticket is None:
+            await self._shed(send)
+            return
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                ticket.respond(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            self.controller.release(ticket)
+
+    async def _shed(self, send):
+        message, status, headers = self.controller.rejection(self.service)
+        body = json.dumps(message).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    *((k.lower().encode(), v.encode()) for k, v in headers.items()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,186 @@
+"""
+Sizing gunicorn to the limits of the pod, instead of one worker with two
+threads whatever the pod has been given.
+
+The CPU quota and memory limit are read from cgroup v2 (cpu.max and
+memory.max), falling back to the CPUs the process can run on and no memory
+limit. There is a worker for every whole CPU, at least one, and no more than
+fit in the memory limit at CHAIN_LINK_WORKER_MEMORY each.
+
+The sync app gets CHAIN_LINK_THREADS threads per worker, 2 by default, and
+with admission control on enough to hold the admitted and queued requests and
+turn the rest away, see admission.py. It runs in gthread workers, or sync
+workers with a single thread. The async app runs in uvicorn workers, or
+hypercorn workers when it talks HTTP/2, see transport.py.
+
+CHAIN_LINK_WORKERS and CHAIN_LINK_THREADS override the sizing. With
+CHAIN_LINK_PRELOAD, on by default when there is more than one worker, the app
+is imported once before the workers are forked, so they share its memory
+copy-on-write, and gunicorn.conf.py restarts in each worker what doesn't
+survive the fork.
+"""
+
+import os
+from .env import env_bool, env_int, env_str
+from .payload import parse_size
+
+CGROUP_DIR = "/sys/fs/cgroup"
+
+# about what a sync worker with tracing uses once it is warmed up
+WORKER_MEMORY = "128MiB"
+
+# set by gunicorn.conf.py in the master before it imports the app to fork the
+# workers from, so the app leaves what each worker does once to post_fork
+PRELOADING_ENV = "CHAIN_LINK_PRELOADING"
+
+WORKER_CLASSES = {
+    "async": "uvicorn.workers.UvicornWorker",
+    # hypercorn's own workers, run by hypercorn.conf.py instead of gunicorn
+    "http2": "asyncio",
+    "gthread": "gthread",
+    "sync": "sync",
+}
+
+
+def preloading():
+    """
+    Whether the app is being imported by the gunicorn master to fork the
+    workers from, rather than by a worker that serves requests
+    """
+    return env_bool(PRELOADING_ENV, False)
+
+
+def read_cgroup(name, directory=CGROUP_DIR):
+    """
+    The fields of a cgroup v2 file, or None if it can't be read
+    """
+    try:
+        with open(os.path.join(directory, name), encoding="utf-8") as cgroup_file:
+            return cgroup_file.read().split()
+    except OSError:
+        return None
+
+
+def cgroup_cpus(directory=CGROUP_DIR):
+    """
+    The CPU quota of the cgroup in CPUs, e.g. 1.5 for "150000 100000", or
+    None if there isn't one
+    """
+    fields = read_cgroup("cpu.max", directory)
+    if not fields or fields[0] == "max":
+        return None
+    period = int(fields[1]) if len(fields) > 1 else 100000
+    return int(fields[0]) / period
+
+
+def cgroup_memory(directory=CGROUP_DIR):
+    """
+    The memory limit of the cgroup in bytes, or None if there isn't one
+    """
+    fields = read_cgroup("memory.max", directory)
+    if not fields or fields[0] == "max":
+        return None
+    return int(fields[0])
+
+
+def available_cpus():
+    """
+    The CPUs this process is allowed to run on
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class ServerSizing:
+    """
+    The workers, threads and worker class gunicorn runs a chain link with
+    """
+
+    def __init__(
+        self,
+        server="sync",
+        cpus=1.0,
+        memory=None,
+        worker_memory=parse_size(WORKER_MEMORY),
+        workers=None,
+        threads=None,
+        preload=None,
+        max_in_flight=0,
+        admission_queue=0,
+        transport="http1",
+    ):
+        if server not in ("sync", "async"):
+            raise ValueError(f"The server has to be sync or async, not {server}")
+        if transport == "http2" and server != "async":
+            raise ValueError("HTTP/2 between chain links needs the async server")
+        self.server = server
+        self.transport = transport
+        self.cpus = cpus
+        self.memory = memory
+
+        if workers is None:
+            workers = max(1, int(cpus))
+            if memory is not None:
+                workers = max(1, min(workers, memory // worker_memory))
+        self.workers = workers
+
+        if server == "async":
+            # a single event loop holds all the in-flight requests
+            threads = 1
+        elif threads is None:
+            threads = max_in_flight + admission_queue + 2 if max_in_flight else 2
+        self.threads = threads
+
+        self.preload = workers > 1 if preload is None else preload
+
+    @classmethod
+    def from_env(cls, directory=CGROUP_DIR):
+        """
+        Size the server from the cgroup limits and CHAIN_LINK_SERVER,
+        CHAIN_LINK_WORKERS, CHAIN_LINK_THREADS, CHAIN_LINK_PRELOAD,
+        CHAIN_LINK_WORKER_MEMORY, CHAIN_LINK_MAX_IN_FLIGHT,
+        CHAIN_LINK_ADMISSION_QUEUE and CHAIN_LINK_TRANSPORT
+        """
+        cpus = cgroup_cpus(directory)
+        return cls(
+            server=env_str("CHAIN_LINK_SERVER", "sync"),
+            cpus=cpus if cpus is not None else available_cpus(),
+            memory=cgroup_memory(directory),
+            worker_memory=parse_size(
+                env_str("CHAIN_LINK_WORKER_MEMORY", WORKER_MEMORY)
+            ),
+            workers=env_int("CHAIN_LINK_WORKERS", None),
+            threads=env_int("CHAIN_LINK_THREADS", None),
+            preload=env_bool("CHAIN_LINK_PRELOAD", None),
+            max_in_flight=env_int("CHAIN_LINK_MAX_IN_FLIGHT", 0),
+            admission_queue=env_int("CHAIN_LINK_ADMISSION_QUEUE", 0),
+            transport=env_str("CHAIN_LINK_TRANSPORT", "http1"),
+        )
+
+    @property
+    def worker_class(self):
+        """
+        The gunicorn worker class, or hypercorn's with HTTP/2
+        """
+        if self.transport == "http2":
+            return WORKER_CLASSES["http2"]
+        if self.server == "async":
+            return WORKER_CLASSES["async"]
+        return WORKER_CLASSES["gthread" if self.threads > 1 else "sync"]
+
+    @property
+    def app(self):
+        """
+        The module and name of the app gunicorn runs
+        """
+        return "asgi:app" if self.server == "async" else "app:app"
+
+    def __str__(self):
+        memory = "no" if self.memory is None else f"{self.memory // 2**20}MiB"
+        return (
+            f"{self.workers} {self.worker_class} workers x {self.threads} threads "
+            f"for {self.cpus:g} CPUs and {memory} memory limit, "
+            f"preload {'on' if self.preload else 'off'}"
+        )
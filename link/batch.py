@@ -0,0 +1,248 @@
+"""
+Batches of requests, to see how much of a long chain's cost is the HTTP
+round trip and the span of every request at every hop.
+
+POST /batch takes many logical requests, the items, in one body
+
+    {"items": [{"id": "0", "trace_id": "4bf92f3577b34da6a3ce929d0e0e4736"},
+               {"id": "1"}]}
+
+and each hop forwards them to each of its next services in one request to
+/batch. A hop draws the injected latency of every item from the item's own
+trace ID, as if it were a request of its own, and sleeps for the longest of
+them once, since the items wait out their latency at the same time. An item
+whose latency runs past the deadline of the batch is answered with a 504 at
+that hop and isn't forwarded. An item carries the request payload of the
+service that sent it, and the final link answers it with its response
+payload, or echoes the item's payload back.
+
+The response lists each item with its status and the service that answered
+it, in the order they were sent
+
+    {"service": "chain-link-service-0",
+     "items": [{"id": "0", "status": 200, "service": "chain-link-service-5"},
+               {"id": "1", "status": 504, "service": "chain-link-service-2",
+                "message": "The deadline passed while ..."}]}
+
+The batch is answered with a 200 unless it can't be read. When the request
+to a next service fails as a whole, e.g. it is shed with a 503, the items in
+it get its status. With several next services an item gets the worst status
+it was answered with. A batch isn't hedged or cached, and
+CHAIN_LINK_BATCH_MAX_ITEMS caps how many items it can have.
+
+When keeping slow traces, the first hop adds the injected latency of each
+item's whole trace to it as "trace_delay", like the X-Chain-Link-Trace-Delay
+header of a single request.
+"""
+
+import json
+from .deadline import deadline_exceeded
+from .env import env_int
+
+BATCH_ROUTE = "/batch"
+
+# the span attribute with the number of items in a batch
+BATCH_SIZE_ATTRIBUTE = "chain_link.batch.size"
+
+
+class BatchError(ValueError):
+    """
+    Raised for a batch that can't be read
+    """
+
+
+class BatchSettings:
+    """
+    How many items a batch can have
+    """
+
+    def __init__(self, max_items=1000):
+        if max_items < 1:
+            raise ValueError(f"A batch has to allow at least 1 item, not {max_items}")
+        self.max_items = max_items
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the settings from CHAIN_LINK_BATCH_MAX_ITEMS
+        """
+        return cls(max_items=env_int("CHAIN_LINK_BATCH_MAX_ITEMS", 1000))
+
+
+def parse_item(item):
+    """
+    Read one item of a batch, with its trace ID as a number, 0 without one
+    """
+    if not isinstance(item, dict) or "id" not in item:
+        raise BatchError("Every item of a batch needs an id")
+    try:
+        trace_id = int(item.get("trace_id") or "0", 16)
+    except (TypeError, ValueError) as esc:
+        raise BatchError(f"Item {item['id']} has an invalid trace_id") from esc
+    trace_delay = item.get("trace_delay")
+    if trace_delay is not None:
+        try:
+            trace_delay = float(trace_delay)
+        except (TypeError, ValueError) as esc:
+            raise BatchError(f"Item {item['id']} has an invalid trace_delay") from esc
+    return {
+        "id": str(item["id"]),
+        "trace_id": trace_id,
+        "trace_delay": trace_delay,
+        "payload": str(item.get("payload", "")),
+    }
+
+
+def read_answers(result):
+    """
+    The answers to the items in the response of a next service by their id,
+    and the answer to give the items it didn't answer
+    """
+    try:
+        body = json.loads(result.body)
+    except ValueError:
+        body = None
+    if result.status == 200 and isinstance(body, dict) and "items" in body:
+        answers = {answer["id"]: answer for answer in body["items"]}
+        return answers, {
+            "service": result.service,
+            "status": 502,
+            "message": f"{result.service} didn't answer the item",
+        }
+    # the request failed as a whole, so every item failed with it
+    message = body.get("message") if isinstance(body, dict) else None
+    return {}, {
+        "service": result.service,
+        "status": result.status if result.status != 200 else 502,
+        "message": message or f"{result.service} answered with {result.status}",
+    }
+
+
+class Batch:
+    """
+    The items of a batch at one hop, and what each of them was answered with
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.answers = [None] * len(items)
+
+    @classmethod
+    def parse(cls, body, max_items=1000):
+        """
+        Read a batch from the body of a request
+        """
+        try:
+            items = json.loads(body)["items"]
+        except (ValueError, TypeError, KeyError) as esc:
+            raise BatchError('A batch is a JSON object with a list of "items"') from esc
+        if not isinstance(items, list):
+            raise BatchError('A batch is a JSON object with a list of "items"')
+        if len(items) > max_items:
+            raise BatchError(f"A batch can have at most {max_items} items")
+        return cls([parse_item(item) for item in items])
+
+    def pending(self):
+        """
+        The indexes of the items that haven't been answered
+        """
+        return [i for i, answer in enumerate(self.answers) if answer is None]
+
+    def answer(self, index, service, status=200, **fields):
+        """
+        Answer an item, unless it has been already
+        """
+        if self.answers[index] is None:
+            self.answers[index] = dict(service=service, status=status, **fields)
+
+    def delays(self, service, latency_injector, attempt=0):
+        """
+        The injected latency of each item at service, drawn from its trace ID
+        """
+        return [
+            latency_injector.delay(service, item["trace_id"], attempt)
+            for item in self.items
+        ]
+
+    def trace_delays(self, latency_injector):
+        """
+        Work out the injected latency of the whole trace of each item that
+        wasn't sent one by the hop before
+        """
+        for item in self.items:
+            if item["trace_delay"] is None:
+                item["trace_delay"] = latency_injector.trace_delay(item["trace_id"])
+
+    def expire(self, service, delays, slept, expired=False):
+        """
+        Answer with a 504 the items whose latency was longer than the hop
+        could sleep before the deadline, or all of them once it has passed
+        """
+        for i, delay in enumerate(delays):
+            if (expired or delay > slept) and self.answers[i] is None:
+                message, status = deadline_exceeded(service, "delay")
+                self.answer(i, service, status, message=message["message"])
+
+    def forward_body(self, payload=None):
+        """
+        The body of the batch of pending items for the next hop, each with
+        the payload text if there is one, see PayloadBuffer.text
+        """
+        items = []
+        for i in self.pending():
+            item = self.items[i]
+            forwarded = {"id": item["id"]}
+            if item["trace_id"]:
+                forwarded["trace_id"] = f"{item['trace_id']:032x}"
+            if item["trace_delay"] is not None:
+                forwarded["trace_delay"] = item["trace_delay"]
+            if payload:
+                forwarded["payload"] = payload
+            items.append(forwarded)
+        return json.dumps({"items": items}).encode()
+
+    def merge(self, results):
+        """
+        Answer the pending items from the responses of the next services, a
+        HopResult for each, with the worst status each item got
+        """
+        pending = self.pending()
+        worst = {}
+        for result in results:
+            answers, failure = read_answers(result)
+            for i in pending:
+                answer = answers.get(self.items[i]["id"], failure)
+                if i not in worst or answer["status"] > worst[i]["status"]:
+                    worst[i] = answer
+        for i, answer in worst.items():
+            fields = {
+                name: value
+                for name, value in answer.items()
+                if name not in ("id", "service", "status")
+            }
+            self.answer(i, answer["service"], answer["status"], **fields)
+
+    def finish(self, service, payload=None, echo=False):
+        """
+        Answer the pending items at the final link of the chain, with the
+        response payload text, or their own payload when it is echoed
+        """
+        for i in self.pending():
+            if echo:
+                self.answer(i, service, payload=self.items[i]["payload"])
+            elif payload is not None:
+                self.answer(i, service, payload=payload)
+            else:
+                self.answer(i, service)
+
+    def response(self, service):
+        """
+        The body of the response to the batch
+        """
+        return {
+            "service": service,
+            "items": [
+                dict(id=item["id"], **answer)
+                for item, answer in zip(self.items, self.answers)
+            ],
+        }
@@ -0,0 +1,293 @@
+"""
+Caching the responses of a link, to model a cache tier in the service graph.
+
+A link with a cache answers a GET it has answered before without sleeping
+or calling its next services. The cache is set per service in the "cache"
+section of the services.json, e.g.
+
+    "cache": {
+        "chain-link-service-2": {"ttl": 5, "max_entries": 1000},
+        "chain-link-service-4": {"ttl": 30, "max_bytes": "16MiB", "vary": ["X-User"]}
+    }
+
+or with CHAIN_LINK_CACHE for the pod's own service. Responses are kept for
+"ttl" seconds, and the least recently used are evicted past "max_entries"
+responses or "max_bytes" of bodies. A request is looked up by its path and
+query, and the values of the headers in "vary". Only 200 responses are
+kept, and a link with a cache buffers its responses instead of streaming
+them.
+
+Requests that miss on the same key at the same time are coalesced: the first
+one goes down the chain and the others wait for its response, or for as long
+as their deadline allows.
+
+Whether a request was a hit, a miss or coalesced with another miss is sent
+back in the X-Chain-Link-Cache header, and counted by service in
+chain_link_cache_requests_total.
+"""
+
+import time
+import asyncio
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from .env import get_service_specs
+from .metrics import CACHE_REQUESTS
+from .payload import parse_size
+
+# tells the caller whether a response was a "hit", a "miss" or "coalesced"
+CACHE_HEADER = "X-Chain-Link-Cache"
+
+# a response as the cache keeps it
+CachedResponse = namedtuple("CachedResponse", ["body", "status", "content_type"])
+
+
+class CacheTimeout(Exception):
+    """
+    Raised when the response a request is waiting on from another request
+    doesn't come in time
+    """
+
+
+class CachePolicy:
+    """
+    How long the responses of a service are kept, and how many of them
+    """
+
+    def __init__(self, ttl=0.0, max_entries=1000, max_bytes="64MiB", vary=()):
+        if ttl < 0:
+            raise ValueError(f"The cache ttl can't be below 0, not {ttl}")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = parse_size(max_bytes)
+        self.vary = tuple(header.lower() for header in vary)
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Create a policy from a cache config block
+        """
+        return cls(
+            ttl=float(spec.get("ttl", 0.0)),
+            max_entries=int(spec.get("max_entries", 1000)),
+            max_bytes=spec.get("max_bytes", "64MiB"),
+            vary=spec.get("vary", ()),
+        )
+
+    @property
+    def enabled(self):
+        """
+        Whether the service caches its responses
+        """
+        return self.ttl > 0
+
+    def _fields(self):
+        return (self.ttl, self.max_entries, self.max_bytes, self.vary)
+
+    def __eq__(self, other):
+        return isinstance(other, CachePolicy) and self._fields() == other._fields()
+
+
+class CachePolicies:
+    """
+    Looks up the CachePolicy of a service
+    """
+
+    def __init__(self, policies, default_policy):
+        self.policies = policies
+        self.default_policy = default_policy
+
+    @classmethod
+    def from_config(cls, services_config, service_name):
+        """
+        Build the policies from the "cache" section of the services config,
+        with CHAIN_LINK_CACHE overriding the policy of this pod's service
+        """
+        section = get_service_specs(
+            services_config, "cache", "CHAIN_LINK_CACHE", service_name
+        )
+        default_policy = CachePolicy.from_spec(section.pop("default", {}))
+        policies = {name: CachePolicy.from_spec(spec) for name, spec in section.items()}
+        return cls(policies, default_policy)
+
+    def policy(self, service):
+        """
+        Get the policy for a service
+        """
+        return self.policies.get(service, self.default_policy)
+
+
+class ResponseCache:
+    """
+    The least recently used responses of one service, for ttl seconds each,
+    and the misses on their way to being answered
+    """
+
+    def __init__(self, service, policy, clock=time.monotonic):
+        self.service = service
+        self.policy = policy
+        self.clock = clock
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def key(self, method, path, headers):
+        """
+        The key of a request, or None if it can't be cached
+        """
+        if method != "GET":
+            return None
+        return (path,) + tuple(headers.get(header) for header in self.policy.vary)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        response, expires = entry
+        if expires <= self.clock():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    def _remove(self, key):
+        response, _ = self._entries.pop(key)
+        self.bytes -= len(response.body)
+
+    def _store(self, key, response):
+        if response.status != 200 or len(response.body) > self.policy.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (response, self.clock() + self.policy.ttl)
+        self.bytes += len(response.body)
+        while (
+            len(self._entries) > self.policy.max_entries
+            or self.bytes > self.policy.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+
+    def _count(self, response, result):
+        CACHE_REQUESTS.labels(self.service, result).inc()
+        return response, result
+
+    def _join(self, key, create_future):
+        # the cached response, or the future of the miss to wait on and
+        # whether this request is the one to answer it
+        with self._lock:
+            response = self._lookup(key)
+            if response is not None:
+                return response, None, False
+            pending = self._pending.get(key)
+            if pending is not None:
+                return None, pending, False
+            pending = self._pending[key] = create_future()
+            return None, pending, True
+
+    def _settle(self, key, response=None):
+        with self._lock:
+            if response is not None:
+                self._store(key, response)
+            return self._pending.pop(key)
+
+    def fetch(self, key, load, timeout=None):
+        """
+        The response to the request with key, from the cache or from load(),
+        which is called once for all the requests that miss on key at the
+        same time. Returns the response and whether it was a "hit", a "miss"
+        or "coalesced", and raises CacheTimeout if the response of another
+        request doesn't come within timeout seconds.
+        """
+        response, pending, first = self._join(key, Future)
+        if response is not None:
+            return self._count(response, "hit")
+        if not first:
+            try:
+                return self._count(pending.result(timeout), "coalesced")
+            except FutureTimeoutError as esc:
+                raise CacheTimeout(f"{self.service} waited too long") from esc
+
+        try:
+            response = load()
+        except BaseException as exc:
+            self._settle(key).set_exception(exc)
+            raise
+        self._settle(key, response).set_result(response)
+        return self._count(response, "miss")
+
+    async def fetch_async(self, key, load, timeout=None):
+        """
+        Like fetch, awaiting load()
+        """
+        loop = asyncio.get_running_loop()
+        response, pending, first = self._join(key, loop.create_future)
+        if response is not None:
+            return self._count(response, "hit")
+        if not first:
+            try:
+                response = await asyncio.wait_for(asyncio.shield(pending), timeout)
+            except asyncio.TimeoutError as esc:
+                raise CacheTimeout(f"{self.service} waited too long") from esc
+            except asyncio.CancelledError:
+                # the request answering the miss went away, not this one
+                if not pending.cancelled():
+                    raise
+                return await self.fetch_async(key, load, timeout)
+            return self._count(response, "coalesced")
+
+        try:
+            response = await load()
+        except asyncio.CancelledError:
+            self._settle(key).cancel()
+            raise
+        except BaseException as exc:
+            pending = self._settle(key)
+            pending.set_exception(exc)
+            # the requests waiting on it get the exception, and if there
+            # are none asyncio shouldn't complain it was never retrieved
+            pending.exception()
+            raise
+        self._settle(key, response).set_result(response)
+        return self._count(response, "miss")
+
+    def stats(self):
+        """
+        How full the cache is
+        """
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "pending": len(self._pending),
+        }
+
+
+class ResponseCaches:
+    """
+    The response caches of a worker, one for each service with a cache,
+    kept when the services config is reloaded unless their policy changed
+    """
+
+    def __init__(self):
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def cache(self, service, policy):
+        """
+        The cache of a service, or None if the policy doesn't cache
+        """
+        if not policy.enabled:
+            return None
+        cache = self._caches.get(service)
+        if cache is None or cache.policy != policy:
+            with self._lock:
+                cache = self._caches.get(service)
+                if cache is None or cache.policy != policy:
+                    cache = self._caches[service] = ResponseCache(service, policy)
+        return cache
+
+    def stats(self):
+        """
+        How full the cache of each service is
+        """
+        return {service: cache.stats() for service, cache in self._caches.items()}
@@ -0,0 +1,138 @@
+"""
+Loading the chain-link services configuration that is mounted into the pod,
+and reloading it when the configmap changes
+"""
+
+import os
+import json
+import logging
+import threading
+from .cache import CachePolicies
+from .env import env_float, env_str
+from .latency import LatencyInjector
+from .payload import PayloadSizes
+from .topology import Topology
+from .work import WorkProfiles
+
+# the services.json will be mounted from a configmap
+SERVICES_FILE = "/etc/chain-link.conf.d/services.json"
+
+logger = logging.getLogger(__name__)
+
+
+def get_services_file():
+    """
+    The path of the services.json, which can be moved with
+    CHAIN_LINK_SERVICES_FILE
+    """
+    return env_str("CHAIN_LINK_SERVICES_FILE", SERVICES_FILE)
+
+
+def get_service_urls(path=None):
+    """
+    Get the list of services from the configmap which is mounted into the pod
+    """
+    with open(path or get_services_file(), encoding="utf-8") as services_file:
+        services_json = services_file.read()
+    return json.loads(services_json)
+
+
+class LinkConfig:
+    """
+    Everything a chain link works out from the services config.
+
+    A new LinkConfig is built when the config changes, and a request holds on
+    to the one it started with, so it never sees half of an update.
+    """
+
+    def __init__(self, services_config, service_name):
+        self.services_config = services_config
+        self.topology = Topology.from_config(services_config)
+        self.latency_injector = LatencyInjector.from_config(
+            services_config, self.topology.services, service_name
+        )
+        self.payload_sizes = PayloadSizes.from_config(services_config, service_name)
+        self.cache_policies = CachePolicies.from_config(services_config, service_name)
+        self.work_profiles = WorkProfiles.from_config(services_config, service_name)
+
+
+class ServicesWatcher:
+    """
+    Polls the services.json and swaps in a new LinkConfig when it changes.
+
+    Kubernetes updates a configmap volume by pointing the ..data symlink at a
+    new directory, so a change shows up as a new resolved path, inode or
+    mtime, and that takes one stat() to notice.
+    """
+
+    def __init__(self, service_name, path=None, interval=None):
+        self.service_name = service_name
+        self.path = path or get_services_file()
+        if interval is None:
+            interval = env_float("CHAIN_LINK_RELOAD_INTERVAL", 2.0)
+        self.interval = interval
+        self._signature = self._stat()
+        self._pid = None
+        self._stop = threading.Event()
+        self.reloads = 0
+        self.current = LinkConfig(get_service_urls(self.path), service_name)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (os.path.realpath(self.path), stat.st_ino, stat.st_mtime_ns)
+
+    def check(self):
+        """
+        Reload the config if the file has changed, returns True if it did
+        """
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+
+        # only remember the new signature once it has been looked at, and
+        # don't keep retrying a broken file, wait for the next change
+        self._signature = signature
+        try:
+            link_config = LinkConfig(get_service_urls(self.path), self.service_name)
+        except (OSError, ValueError) as esc:
+            logger.warning(
+                "Keeping the current services, %s is invalid: %s", self.path, esc
+            )
+            return False
+
+        # swapping the reference is atomic, requests in flight keep the
+        # LinkConfig they already have
+        self.current = link_config
+        self.reloads += 1
+        logger.info("Reloaded services: %s", link_config.topology.services)
+        return True
+
+    def start(self):
+        """
+        Start polling in a background thread, once per worker process
+        """
+        if not self.interval or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        thread = threading.Thread(
+            target=self._run, name="chain-link-services-watcher", daemon=True
+        )
+        thread.start()
+
+    def stop(self):
+        """
+        Stop polling
+        """
+        self._stop.set()
+        self._pid = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Unable to check %s for changes", self.path)
@@ -0,0 +1,115 @@
+"""
+Passing the time a request has left down the chain, instead of giving every
+hop the same fixed timeout.
+
+The first hop sets an absolute deadline, CHAIN_LINK_DEADLINE seconds from
+when the request arrived, unless the caller sent one, and each hop passes it
+on in the X-Chain-Link-Deadline header, as milliseconds since the epoch. A
+hop waits on the next one only for the time that is left, and gives up with
+a 504 as soon as the deadline has passed: when the request arrives, after
+the injected latency, which is cut short, or before calling the next hop.
+
+The deadline is passed on CHAIN_LINK_DEADLINE_RESERVE seconds early, so the
+next hop gives up before this one does and the 504 of the hop that ran out
+of time makes it back up the chain. The deadline is absolute, so the clocks
+of the pods have to agree, as NTP keeps them.
+"""
+
+import time
+from .env import env_float
+from .metrics import DEADLINE_EXCEEDED
+
+DEADLINE_HEADER = "X-Chain-Link-Deadline"
+
+DEADLINE_EXCEEDED_STATUS = 504
+
+# what ran out of time, by the stage of the hop it happened at
+EXCEEDED_MESSAGES = {
+    "arrival": "The deadline had passed when the request reached {service}",
+    "delay": "The deadline passed while {service} was delayed",
+    "next_hop": "The deadline passed before {service} answered",
+    "cache": "The deadline passed while {service} waited for a cached response",
+}
+
+
+class DeadlineSettings:
+    """
+    The time given to a request that arrives without a deadline, and how much
+    earlier the next hop's deadline is
+    """
+
+    def __init__(self, budget=10.0, reserve=0.005):
+        if budget <= 0:
+            raise ValueError(f"The deadline has to be above 0, not {budget}")
+        self.budget = budget
+        self.reserve = reserve
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the settings from CHAIN_LINK_DEADLINE and
+        CHAIN_LINK_DEADLINE_RESERVE
+        """
+        return cls(
+            budget=env_float("CHAIN_LINK_DEADLINE", 10.0),
+            reserve=env_float("CHAIN_LINK_DEADLINE_RESERVE", 0.005),
+        )
+
+    def deadline(self, header=None):
+        """
+        The deadline of a request from its deadline header, or the budget
+        from now if it doesn't have a valid one
+        """
+        if header:
+            try:
+                return Deadline(int(header) / 1000, self.reserve)
+            except ValueError:
+                pass
+        return Deadline(time.time() + self.budget, self.reserve)
+
+
+class Deadline:
+    """
+    When a request has to be answered by, in seconds since the epoch
+    """
+
+    def __init__(self, expires, reserve=0.0):
+        self.expires = expires
+        self.reserve = reserve
+
+    def remaining(self):
+        """
+        Seconds left until the deadline, negative once it has passed
+        """
+        return self.expires - time.time()
+
+    @property
+    def expired(self):
+        """
+        Whether the deadline has passed
+        """
+        return self.remaining() <= 0
+
+    def next_hop(self):
+        """
+        The deadline header for the next hop, and the seconds to wait for it,
+        or None if there isn't time to call it
+        """
+        timeout = self.remaining()
+        if timeout - self.reserve <= 0:
+            return None
+        expires = self.expires - self.reserve
+        return {DEADLINE_HEADER: str(int(expires * 1000))}, timeout
+
+
+def deadline_exceeded(service, stage):
+    """
+    Count a request that ran out of time at a stage of this hop, "arrival",
+    "delay", "next_hop" with the next service or "cache" waiting for another
+    request's response, and return the body and status to answer with
+    """
+    DEADLINE_EXCEEDED.labels(stage).inc()
+    return {
+        "message": EXCEEDED_MESSAGES[stage].format(service=service),
+        "stage": stage,
+    }, DEADLINE_EXCEEDED_STATUS
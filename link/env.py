@@ -0,0 +1,63 @@
+"""
+Helpers for reading the chain-link settings out of the environment
+"""
+
+import os
+import json
+
+
+def env_str(name, default=None):
+    """
+    Get a string from the environment, treating an empty value as unset
+    """
+    value = os.environ.get(name, "")
+    return value if value else default
+
+
+def env_int(name, default):
+    """
+    Get an integer from the environment
+    """
+    value = env_str(name)
+    return int(value) if value is not None else default
+
+
+def env_float(name, default):
+    """
+    Get a float from the environment
+    """
+    value = env_str(name)
+    return float(value) if value is not None else default
+
+
+def env_bool(name, default):
+    """
+    Get a boolean from the environment, e.g. 1/0, true/false, yes/no, on/off
+    """
+    value = env_str(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_json(name, default=None):
+    """
+    Get a JSON document from the environment
+    """
+    value = env_str(name)
+    return json.loads(value) if value is not None else default
+
+
+def get_service_specs(services_config, section, env_name, service_name):
+    """
+    Get a per-service section of the services config, e.g. "latency", as a
+    dict of service name (or "default") to settings. The settings for this
+    pod's own service can be overridden with JSON in the env_name env var.
+    """
+    specs = {}
+    if isinstance(services_config, dict):
+        specs = dict(services_config.get(section, {}))
+    env_spec = env_json(env_name)
+    if env_spec is not None:
+        specs[service_name] = env_spec
+    return specs
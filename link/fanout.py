@@ -0,0 +1,116 @@
+"""
+Calling all the children of a service at the same time, and putting their
+responses together
+"""
+
+import os
+import json
+import threading
+import contextvars
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .env import env_int
+
+# the response of one child of a service, elapsed is in seconds and
+# server_timing the breakdown of the hops it called, see timing.py
+HopResult = namedtuple(
+    "HopResult",
+    ["service", "status", "body", "elapsed", "server_timing"],
+    defaults=[None],
+)
+
+
+class FanOut:
+    """
+    A bounded pool of threads, per worker, to call the children of a service
+    concurrently
+    """
+
+    def __init__(self, max_workers=16):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pool = None
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a FanOut sized by CHAIN_LINK_FANOUT_WORKERS
+        """
+        return cls(max_workers=env_int("CHAIN_LINK_FANOUT_WORKERS", 16))
+
+    def _executor(self):
+        # threads don't survive a fork, so each worker creates its own pool
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="chain-link-fanout",
+                    )
+                    self._pid = os.getpid()
+        return self._pool
+
+    def submit(self, fn, *args):
+        """
+        Call fn in a thread of the pool and return its future. The call runs
+        in a copy of the caller's context, so the current span is the parent
+        of the spans created by fn.
+        """
+        return self._executor().submit(contextvars.copy_context().run, fn, *args)
+
+    def map(self, fn, items):
+        """
+        Call fn on every item concurrently and return the results in order
+        """
+        futures = [self.submit(fn, item) for item in items]
+        return [future.result() for future in futures]
+
+
+def aggregate(service, results):
+    """
+    Combine the responses of the children of a service into one response, and
+    return it with the worst status of the children
+    """
+    children = []
+    slowest = None
+    for result in results:
+        child = {
+            "service": result.service,
+            "status": result.status,
+            "elapsed_ms": round(result.elapsed * 1000, 3),
+        }
+        # a payload is summed up by its size rather than copied in
+        try:
+            body = child["body"] = json.loads(result.body)
+        except ValueError:
+            body = None
+            child["bytes"] = len(result.body)
+        children.append(child)
+        if slowest is None or result.elapsed > slowest[0].elapsed:
+            slowest = (result, body)
+
+    # the critical path is the slowest child and, if it or a service below it
+    # fanned out, the slowest path from there
+    critical_path = [service]
+    if slowest is not None:
+        result, body = slowest
+        critical_path.append(result.service)
+        if isinstance(body, dict) and "critical_path" in body:
+            below = body["critical_path"]
+            # a child that fanned out starts its own path, one that forwarded
+            # to a single service passes on the path of a service below it
+            if below and below[0] == result.service:
+                below = below[1:]
+            critical_path.extend(below)
+
+    message = {
+        "message": f"{service} forwarded the request to {len(children)} services",
+        "children": children,
+        "critical_path": critical_path,
+        "critical_path_ms": max(
+            (child["elapsed_ms"] for child in children), default=0.0
+        ),
+    }
+    status = max((result.status for result in results), default=200)
+    return message, status
@@ -0,0 +1,332 @@
+"""
+Hedging the call to the next hop, so one slow pod doesn't set the tail of the
+whole chain.
+
+When hedging is on, and the next hop hasn't answered after the hedge delay,
+the same request is sent to it again, and whichever response arrives first is
+used. The delay is CHAIN_LINK_HEDGE_DELAY seconds, or by default the observed
+p95 (CHAIN_LINK_HEDGE_PERCENTILE) of the last few hundred calls to that next
+service, so only about the slowest 5% of calls are hedged. No call is hedged
+until there are enough of them to tell what slow is.
+
+Hedges are paid for out of a retry budget: every call to a next service adds
+CHAIN_LINK_HEDGE_BUDGET of a token to its budget, up to MAX_TOKENS, and every
+hedge takes a whole token, so when the next service slows down for everyone
+hedging adds at most that fraction of load rather than doubling it.
+
+The second request carries an X-Chain-Link-Attempt header, and the next hop
+draws its injected latency for it separately from the first, as if it had
+been sent to another replica. The async app cancels the request that lost,
+which closes its connection. The sync app makes both requests on a pool of
+CHAIN_LINK_HEDGE_WORKERS threads and waits for whichever answers first. A
+thread blocked on a socket can't be cancelled, so the request that lost is cut
+short by shutting its connection down, see SessionPool.interrupt, or else left
+to finish on its own. A call that finds every thread of the pool busy isn't
+hedged and is made on the request's own thread, so the pool doesn't limit the
+calls a worker makes at once.
+"""
+
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from .env import env_bool, env_float, env_int
+from .fanout import FanOut
+from .latency import parse_percentile
+from .metrics import HEDGES, HEDGES_DENIED
+
+ATTEMPT_HEADER = "X-Chain-Link-Attempt"
+
+# the latencies kept per next service to take the percentile of, and how
+# often it is worked out again
+WINDOW = 256
+RECOMPUTE_EVERY = 16
+
+# the fewest calls to a next service before any of them are hedged
+MIN_SAMPLES = 20
+
+# the most hedges saved up, so a quiet service can't bank a burst of them
+MAX_TOKENS = 10.0
+
+
+def parse_attempt(value):
+    """
+    The attempt of a request from its attempt header, 0 if it isn't a hedge
+    """
+    try:
+        return max(int(value or 0), 0)
+    except ValueError:
+        return 0
+
+
+class HedgeSettings:
+    """
+    Whether calls to the next hop are hedged, after how long, and how many of
+    them can be
+    """
+
+    def __init__(
+        self, enabled=False, delay=None, percentile=0.95, budget=0.1, workers=32
+    ):
+        if not 0 <= budget <= 1:
+            raise ValueError(f"The hedge budget has to be from 0 to 1, not {budget}")
+        self.enabled = enabled
+        self.delay = delay
+        self.percentile = percentile
+        self.budget = budget
+        self.workers = workers
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the settings from CHAIN_LINK_HEDGE, CHAIN_LINK_HEDGE_DELAY,
+        CHAIN_LINK_HEDGE_PERCENTILE, CHAIN_LINK_HEDGE_BUDGET and
+        CHAIN_LINK_HEDGE_WORKERS
+        """
+        return cls(
+            enabled=env_bool("CHAIN_LINK_HEDGE", False),
+            delay=env_float("CHAIN_LINK_HEDGE_DELAY", None),
+            percentile=parse_percentile(env_float("CHAIN_LINK_HEDGE_PERCENTILE", 95.0)),
+            budget=env_float("CHAIN_LINK_HEDGE_BUDGET", 0.1),
+            workers=env_int("CHAIN_LINK_HEDGE_WORKERS", 32),
+        )
+
+
+class LatencyWindow:
+    """
+    The latencies of the last calls to a next service, and a percentile of
+    them that is worked out again every so often
+    """
+
+    def __init__(self, percentile, size=WINDOW):
+        self.percentile = percentile
+        self.latencies = deque(maxlen=size)
+        self.value = None
+        self._since_update = 0
+
+    def observe(self, elapsed):
+        """
+        Add the latency of a call, in seconds
+        """
+        self.latencies.append(elapsed)
+        self._since_update += 1
+        if len(self.latencies) >= MIN_SAMPLES and (
+            self.value is None or self._since_update >= RECOMPUTE_EVERY
+        ):
+            ordered = sorted(self.latencies)
+            self.value = ordered[
+                min(int(len(ordered) * self.percentile), len(ordered) - 1)
+            ]
+            self._since_update = 0
+
+
+class HedgeRace:
+    """
+    The calls of a hedged request to a next service, and the threads of the
+    pool they are running on, so the one that loses can be cut short
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.threads = {}
+        self.finished = False
+
+    def finish(self, interrupt):
+        """
+        Stop the calls that haven't started, and cut the ones still going
+        short with interrupt(thread_id)
+        """
+        with self.lock:
+            self.finished = True
+            if interrupt:
+                for thread_id in self.threads.values():
+                    interrupt(thread_id)
+
+
+class Hedger:
+    """
+    Hedges the calls of a worker to its next services, keeping their latency
+    windows and retry budgets
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.pool = FanOut(max_workers=settings.workers)
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._tokens = {}
+        # the calls running on the pool
+        self._running = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a Hedger with the settings from the CHAIN_LINK_HEDGE* env vars
+        """
+        return cls(HedgeSettings.from_env())
+
+    def delay(self, service):
+        """
+        How long to wait for a call to service before hedging it, or None if
+        it isn't known yet
+        """
+        if self.settings.delay is not None:
+            return self.settings.delay
+        window = self._windows.get(service)
+        return window.value if window is not None else None
+
+    def observe(self, service, elapsed):
+        """
+        Add the latency of a call to service to its window
+        """
+        with self._lock:
+            window = self._windows.get(service)
+            if window is None:
+                window = self._windows[service] = LatencyWindow(
+                    self.settings.percentile
+                )
+            window.observe(elapsed)
+
+    def deposit(self, service):
+        """
+        Add to the budget of service for a call to it
+        """
+        with self._lock:
+            tokens = self._tokens.get(service, 0.0) + self.settings.budget
+            self._tokens[service] = min(tokens, MAX_TOKENS)
+
+    def withdraw(self, service):
+        """
+        Take a hedge out of the budget of service, or return False if there
+        isn't one left
+        """
+        with self._lock:
+            tokens = self._tokens.get(service, 0.0)
+            if tokens < 1:
+                HEDGES_DENIED.labels(service).inc()
+                return False
+            self._tokens[service] = tokens - 1
+            return True
+
+    def _can_hedge(self, service, deadline):
+        # a hedge that would give up at once can't answer before the first
+        if deadline is not None and deadline.next_hop() is None:
+            return False
+        return self.withdraw(service)
+
+    def _observed(self, service, send, attempt):
+        result = send(attempt)
+        self.observe(service, result.elapsed)
+        return result
+
+    async def _observed_async(self, service, send, attempt):
+        result = await send(attempt)
+        self.observe(service, result.elapsed)
+        return result
+
+    def _reserve(self):
+        # take a thread of the pool for a call, unless they are all busy
+        with self._lock:
+            if self._running >= self.settings.workers:
+                return False
+            self._running += 1
+            return True
+
+    def _release(self):
+        with self._lock:
+            self._running -= 1
+
+    def _attempt(self, race, service, send, attempt):
+        try:
+            with race.lock:
+                if race.finished:
+                    return None
+                race.threads[attempt] = threading.get_ident()
+            try:
+                return self._observed(service, send, attempt)
+            finally:
+                with race.lock:
+                    del race.threads[attempt]
+        finally:
+            self._release()
+
+    def call(self, service, send, deadline=None, interrupt=None):
+        """
+        Call send(attempt), which returns a HopResult, on a thread of the
+        pool, and call it again with attempt 1 if it hasn't returned after the
+        hedge delay and there is time left before the deadline. The result
+        that is returned first is used, with the time since the first call,
+        and interrupt(thread_id) cuts the other one short.
+        """
+        if not self.settings.enabled:
+            return send(0)
+        self.deposit(service)
+        delay = self.delay(service)
+        if delay is None or not self._reserve():
+            return self._observed(service, send, 0)
+
+        start = time.perf_counter()
+        race = HedgeRace()
+        try:
+            first = self.pool.submit(self._attempt, race, service, send, 0)
+            done, _ = wait([first], timeout=delay)
+            if done or not self._reserve():
+                return first.result()
+            if not self._can_hedge(service, deadline):
+                self._release()
+                return first.result()
+
+            second = self.pool.submit(self._attempt, race, service, send, 1)
+            pending = [first, second]
+            while True:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                # the first call wins a tie, and a call that failed loses to
+                # one that is still going
+                winner = first if first in done else second
+                if winner.exception() is None or len(pending) == 1:
+                    break
+                pending.remove(winner)
+            result = winner.result()
+            HEDGES.labels(service, "hedge" if winner is second else "first").inc()
+            return result._replace(elapsed=time.perf_counter() - start)
+        finally:
+            race.finish(interrupt)
+
+    async def call_async(self, service, send, deadline=None):
+        """
+        Await send(attempt), like call does in the sync app, and cancel the
+        call that loses
+        """
+        if not self.settings.enabled:
+            return await send(0)
+        self.deposit(service)
+        delay = self.delay(service)
+        if delay is None:
+            return await self._observed_async(service, send, 0)
+
+        start = time.perf_counter()
+        first = asyncio.ensure_future(self._observed_async(service, send, 0))
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done or not self._can_hedge(service, deadline):
+                return await first
+
+            second = asyncio.ensure_future(self._observed_async(service, send, 1))
+            pending.add(second)
+            while True:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                winner = first if first in done else second
+                if winner.exception() is None or len(pending) == 1:
+                    break
+                pending.remove(winner)
+            pending.discard(winner)
+            result = winner.result()
+            HEDGES.labels(service, "hedge" if winner is second else "first").inc()
+            return result._replace(elapsed=time.perf_counter() - start)
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,346 @@
+"""
+Latency injection for the chain links.
+
+Each service can be given a latency model in the "latency" section of the
+services.json, e.g.
+
+    {
+        "services": ["chain-link-service-0", "chain-link-service-1"],
+        "latency": {
+            "default": {"distribution": "fixed", "value": 0.01},
+            "chain-link-service-1": {
+                "distribution": "lognormal",
+                "percentiles": {"p50": 0.05, "p99": 0.8},
+                "probability": 0.5
+            }
+        }
+    }
+
+or in the CHAIN_LINK_LATENCY env var, as JSON, for the pod's own service.
+Whether a node is slow for a request, and how slow, is decided by a random
+number generator seeded with the trace ID, so a trace can be replayed with
+the same latency shape.
+"""
+
+import math
+import random
+from statistics import NormalDist
+from .env import env_str, get_service_specs
+
+# how long a node sleeps, and how often, when nothing is configured, which is
+# how the chain always behaved: one of the nodes sleeps for 2 seconds
+LEGACY_DELAY = 2.0
+
+
+class LatencyModelError(ValueError):
+    """
+    Raised for latency model settings that can't be used
+    """
+
+
+def parse_percentile(name):
+    """
+    Turn a percentile name like p99, p99.9 or 99 into a fraction
+    """
+    value = float(str(name).lstrip("pP")) / 100
+    if not 0 < value < 1:
+        raise LatencyModelError(f"Percentile {name} must be between 0 and 100")
+    return value
+
+
+class LatencyModel:
+    """
+    Base class for the latency distributions, in seconds
+    """
+
+    name = None
+
+    def sample(self, rng):
+        """
+        Draw a delay using the given random.Random
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Create the model from its parameters in the config
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def from_percentiles(cls, p1, x1, p2, x2):
+        """
+        Create the model so its p1 quantile is x1 and its p2 quantile is x2
+        """
+        raise NotImplementedError
+
+
+class Fixed(LatencyModel):
+    """
+    Always the same delay
+    """
+
+    name = "fixed"
+
+    def __init__(self, value):
+        self.value = value
+
+    def sample(self, rng):
+        return self.value
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(float(spec["value"]))
+
+    @classmethod
+    def from_percentiles(cls, p1, x1, p2, x2):
+        return cls(x1)
+
+
+class Uniform(LatencyModel):
+    """
+    A delay anywhere between low and high
+    """
+
+    name = "uniform"
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def sample(self, rng):
+        return rng.uniform(self.low, self.high)
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(float(spec["low"]), float(spec["high"]))
+
+    @classmethod
+    def from_percentiles(cls, p1, x1, p2, x2):
+        width = (x2 - x1) / (p2 - p1)
+        return cls(x1 - p1 * width, x1 - p1 * width + width)
+
+
+class Normal(LatencyModel):
+    """
+    A normally distributed delay
+    """
+
+    name = "normal"
+
+    def __init__(self, mean, stddev):
+        self.mean = mean
+        self.stddev = stddev
+
+    def sample(self, rng):
+        return rng.gauss(self.mean, self.stddev)
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(float(spec["mean"]), float(spec["stddev"]))
+
+    @classmethod
+    def from_percentiles(cls, p1, x1, p2, x2):
+        z1, z2 = NormalDist().inv_cdf(p1), NormalDist().inv_cdf(p2)
+        stddev = (x2 - x1) / (z2 - z1)
+        return cls(x1 - stddev * z1, stddev)
+
+
+class LogNormal(LatencyModel):
+    """
+    A log-normally distributed delay, the usual shape of service latency
+    """
+
+    name = "lognormal"
+
+    def __init__(self, mu, sigma):
+        self.mu = mu
+        self.sigma = sigma
+
+    def sample(self, rng):
+        return rng.lognormvariate(self.mu, self.sigma)
+
+    @classmethod
+    def from_spec(cls, spec):
+        # either the parameters of the underlying normal or the median
+        if "median" in spec:
+            return cls(math.log(float(spec["median"])), float(spec["sigma"]))
+        return cls(float(spec["mu"]), float(spec["sigma"]))
+
+    @classmethod
+    def from_percentiles(cls, p1, x1, p2, x2):
+        z1, z2 = NormalDist().inv_cdf(p1), NormalDist().inv_cdf(p2)
+        sigma = (math.log(x2) - math.log(x1)) / (z2 - z1)
+        return cls(math.log(x1) - sigma * z1, sigma)
+
+
+class Pareto(LatencyModel):
+    """
+    A Pareto distributed delay, for heavy tails
+    """
+
+    name = "pareto"
+
+    def __init__(self, scale, alpha):
+        self.scale = scale
+        self.alpha = alpha
+
+    def sample(self, rng):
+        return self.scale * rng.paretovariate(self.alpha)
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(float(spec["scale"]), float(spec["alpha"]))
+
+    @classmethod
+    def from_percentiles(cls, p1, x1, p2, x2):
+        # the quantile function is scale * (1 - p) ** (-1 / alpha)
+        inverse_alpha = (math.log(x2) - math.log(x1)) / (
+            math.log(1 - p1) - math.log(1 - p2)
+        )
+        scale = x1 * (1 - p1) ** inverse_alpha
+        return cls(scale, 1 / inverse_alpha)
+
+
+MODELS = {model.name: model for model in (Fixed, Uniform, Normal, LogNormal, Pareto)}
+
+
+def build_model(spec):
+    """
+    Create a LatencyModel from its config, e.g. {"distribution": "pareto",
+    "scale": 0.01, "alpha": 1.5} or {"distribution": "lognormal",
+    "percentiles": {"p50": 0.05, "p99": 0.8}}
+    """
+    distribution = spec.get("distribution", "fixed")
+    try:
+        model = MODELS[distribution]
+    except KeyError as esc:
+        raise LatencyModelError(f"Unknown distribution {distribution}") from esc
+
+    percentiles = spec.get("percentiles")
+    if not percentiles:
+        try:
+            return model.from_spec(spec)
+        except KeyError as esc:
+            raise LatencyModelError(
+                f"Missing {esc} for the {distribution} distribution"
+            ) from esc
+
+    targets = sorted(
+        (parse_percentile(name), float(value)) for name, value in percentiles.items()
+    )
+    if len(targets) == 1 and model is Fixed:
+        targets.append(targets[0])
+    if len(targets) != 2 or targets[0][1] > targets[1][1]:
+        raise LatencyModelError(
+            "Percentile targets need two increasing percentiles, e.g. p50 and p99"
+        )
+    (p1, x1), (p2, x2) = targets
+    return model.from_percentiles(p1, x1, p2, x2)
+
+
+class LatencyPolicy:
+    """
+    When, and how long, a service sleeps before it handles a request
+    """
+
+    def __init__(self, model, probability=1.0, max_delay=None):
+        self.model = model
+        self.probability = probability
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_spec(cls, spec, default_probability=1.0):
+        """
+        Create a policy from a latency config block
+        """
+        return cls(
+            build_model(spec),
+            probability=float(spec.get("probability", default_probability)),
+            max_delay=float(spec["max"]) if "max" in spec else None,
+        )
+
+    def delay(self, rng):
+        """
+        The delay for one request, 0 if this node isn't slow for it
+        """
+        if self.probability < 1 and rng.random() >= self.probability:
+            return 0.0
+        delay = max(self.model.sample(rng), 0.0)
+        if self.max_delay is not None:
+            delay = min(delay, self.max_delay)
+        return delay
+
+
+class LatencyInjector:
+    """
+    Looks up the LatencyPolicy of a service and draws its delay for a trace
+    """
+
+    def __init__(self, policies, default_policy, seed="", services=()):
+        self.policies = policies
+        self.default_policy = default_policy
+        self.seed = seed
+        self.services = services
+
+    @classmethod
+    def from_config(cls, services_config, services, service_name):
+        """
+        Build the policies from the "latency" section of the services config,
+        with CHAIN_LINK_LATENCY overriding the policy of this pod's service
+        """
+        section = get_service_specs(
+            services_config, "latency", "CHAIN_LINK_LATENCY", service_name
+        )
+        if "default" in section:
+            default_policy = LatencyPolicy.from_spec(section.pop("default"))
+        else:
+            # one of the nodes should take longer to respond, so on average
+            # one node in the chain sleeps for 2 seconds
+            default_policy = LatencyPolicy(
+                Fixed(LEGACY_DELAY), probability=1 / max(len(services), 1)
+            )
+
+        policies = {
+            name: LatencyPolicy.from_spec(spec) for name, spec in section.items()
+        }
+        return cls(
+            policies,
+            default_policy,
+            seed=env_str("CHAIN_LINK_LATENCY_SEED", ""),
+            services=services,
+        )
+
+    def policy(self, service):
+        """
+        Get the policy for a service
+        """
+        return self.policies.get(service, self.default_policy)
+
+    def rng(self, service, trace_id, attempt=0):
+        """
+        A random number generator that is the same for every run of a trace
+        through a service, or just random without a trace ID. A hedged
+        request, attempt 1, gets a different one than the first attempt.
+        """
+        if not trace_id:
+            return random.Random()
+        seed = f"{self.seed}:{trace_id:032x}:{service}"
+        if attempt:
+            seed = f"{seed}:{attempt}"
+        return random.Random(seed)
+
+    def delay(self, service, trace_id=0, attempt=0):
+        """
+        The delay, in seconds, for this service to inject for the trace
+        """
+        return self.policy(service).delay(self.rng(service, trace_id, attempt))
+
+    def trace_delay(self, trace_id):
+        """
+        The delay injected into a trace by all the services together. It is
+        the same on every hop, so each of them can tell a slow trace from its
+        first span.
+        """
+        return sum(self.delay(service, trace_id) for service in self.services)
@@ -0,0 +1,593 @@
+"""
+A load generator for the chain, run in the loadgenerator pod with
+
+    python -m link.loadgen --url http://chain-link-service-0/ --rate 100
+
+or from a workstation with chain-link-cli load.
+
+With --rate it is open loop: requests are started on a fixed schedule
+whether or not the earlier ones have answered, up to --concurrency
+connections, and each request is timed from when it was meant to start. A
+chain that stalls therefore shows up as latency instead of as fewer
+requests, the coordinated omission of a closed loop. When as many requests
+are in flight as the rate starts in a --timeout, the next one is dropped and
+counted as an error that took the whole timeout, so a generator that falls
+behind doesn't queue requests without end. Without --rate, --concurrency
+workers send requests back to back, and --expected-interval fills in the
+requests a worker would have sent while it was stuck.
+
+Latencies go into log-linear histograms like HdrHistogram's, and the
+percentiles of each --report-interval and of the whole run are printed. Each
+request carries a deadline of --timeout after its intended start, so the
+chain stops working on it when the load generator gives up. With
+--hops the Server-Timing breakdown of every response is added up as well, to
+show the time each hop spent on its own, sleeping and waiting on the next.
+
+With --batch N each request is a POST to /batch with N requests in it, see
+link/batch.py, and every item counts as a request, with the latency of the
+whole batch and the status it was answered with, so the rates and
+percentiles compare with a run without batches. --rate counts the items too.
+"""
+
+import sys
+import json
+import math
+import time
+import random
+import signal
+import asyncio
+import argparse
+from collections import Counter
+import httpx
+from .batch import BATCH_ROUTE
+from .deadline import DEADLINE_HEADER
+from .timing import SERVER_TIMING, parse_server_timing
+
+# the times of a hop in its Server-Timing entry
+HOP_TIMES = ("dur", "proc", "delay", "wait")
+
+
+class Histogram:
+    """
+    Counts of integer values in log-linear buckets, keeping the given number
+    of significant figures, like HdrHistogram
+    """
+
+    def __init__(self, significant_figures=3):
+        # the first bucket counts every value up to sub_bucket_count, each
+        # bucket after it covers twice the range at half the resolution
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10**significant_figures))
+        self.sub_bucket_count = 1 << self.sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count // 2
+        self.reset()
+
+    def reset(self):
+        """
+        Forget every value
+        """
+        self.counts = Counter()
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def _index(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return (
+            self.sub_bucket_count
+            + (shift - 1) * self.sub_bucket_half
+            + (value >> shift)
+            - self.sub_bucket_half
+        )
+
+    def _highest_equivalent(self, index):
+        if index < self.sub_bucket_count:
+            return index
+        shift, sub_bucket = divmod(index - self.sub_bucket_count, self.sub_bucket_half)
+        shift += 1
+        return ((sub_bucket + self.sub_bucket_half) << shift) + (1 << shift) - 1
+
+    def record(self, value, count=1):
+        """
+        Count a value, which is rounded down to an integer
+        """
+        value = max(0, int(value))
+        self.counts[self._index(value)] += count
+        self.total += count
+        self.sum += value * count
+        self.max = max(self.max, value)
+
+    def record_corrected(self, value, expected_interval, count=1):
+        """
+        Count a value, and the values of the requests that would have been
+        sent every expected_interval while waiting for it
+        """
+        self.record(value, count)
+        if not expected_interval:
+            return
+        missing = value - expected_interval
+        while missing >= expected_interval:
+            self.record(missing, count)
+            missing -= expected_interval
+
+    def merge(self, other):
+        """
+        Add the values of another histogram with the same precision
+        """
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self):
+        """
+        The mean of the values, 0 without any
+        """
+        return self.sum / self.total if self.total else 0.0
+
+    def percentile(self, p):
+        """
+        The value that p percent of the values are at or below, 0 to 100, to
+        within the precision of the histogram
+        """
+        if not self.total:
+            return 0
+        target = max(1, math.ceil(self.total * p / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max)
+        return self.max
+
+
+class Report:
+    """
+    What was sent and how long it took, over one interval or the whole run
+    """
+
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self):
+        self.histogram = Histogram()
+        self.errors = Counter()
+        # service to a histogram of each of its times, in the order the
+        # hops were first seen
+        self.hops = {}
+
+    def reset(self):
+        """
+        Start the next interval
+        """
+        self.histogram.reset()
+        self.errors.clear()
+        self.hops = {}
+
+    def _hop(self, service):
+        if service not in self.hops:
+            self.hops[service] = {name: Histogram() for name in HOP_TIMES}
+        return self.hops[service]
+
+    def record_hops(self, hops):
+        """
+        Count the times of the hops of one response, in milliseconds
+        """
+        for hop in hops:
+            histograms = self._hop(hop["service"])
+            for name in HOP_TIMES:
+                histograms[name].record(hop.get(name, 0.0) * 1000)
+
+    def merge(self, other):
+        """
+        Add another report to this one
+        """
+        self.histogram.merge(other.histogram)
+        self.errors.update(other.errors)
+        for service, histograms in other.hops.items():
+            for name, histogram in self._hop(service).items():
+                histogram.merge(histograms[name])
+
+    def summary(self, elapsed):
+        """
+        The report as a dict, latencies in milliseconds
+        """
+        histogram = self.histogram
+        # the requests that got a successful response, per second
+        good = histogram.total - sum(self.errors.values())
+        latency = {"mean": round(histogram.mean / 1000, 3)}
+        for p in self.PERCENTILES:
+            latency[f"p{p:g}"] = round(histogram.percentile(p) / 1000, 3)
+        latency["max"] = round(histogram.max / 1000, 3)
+        summary = {
+            "elapsed": round(elapsed, 3),
+            "requests": histogram.total,
+            "requests_per_second": round(histogram.total / elapsed, 1)
+            if elapsed
+            else 0.0,
+            "goodput_per_second": round(good / elapsed, 1) if elapsed else 0.0,
+            "errors": dict(self.errors),
+            "latency_ms": latency,
+        }
+        if self.hops:
+            summary["hops"] = [
+                dict(
+                    service=service,
+                    requests=histograms["dur"].total,
+                    **{
+                        f"{name}_ms": {
+                            "mean": round(histograms[name].mean / 1000, 3),
+                            "p99": round(histograms[name].percentile(99) / 1000, 3),
+                        }
+                        for name in HOP_TIMES
+                    },
+                )
+                for service, histograms in self.hops.items()
+            ]
+        return summary
+
+
+def format_summary(summary, total=False):
+    """
+    A summary as a line of text
+    """
+    latency = summary["latency_ms"]
+    errors = sum(summary["errors"].values())
+    percentiles = "  ".join(
+        f"{name} {value:.2f}"
+        for name, value in latency.items()
+        if name not in ("mean", "max")
+    )
+    line = (
+        f"{'total' if total else ''}{summary['elapsed']:>7.1f}s  "
+        f"requests {summary['requests']}  rps {summary['requests_per_second']}  "
+        f"goodput {summary['goodput_per_second']}  errors {errors}  "
+        f"ms: mean {latency['mean']:.2f}  {percentiles}  "
+        f"max {latency['max']:.2f}"
+    )
+    if not total or "hops" not in summary:
+        return line
+    # the breakdown of the hops, mean and p99 of each time, with the whole run
+    lines = [line]
+    for hop in summary["hops"]:
+        times = "  ".join(
+            f"{name} {hop[f'{name}_ms']['mean']:.2f}/{hop[f'{name}_ms']['p99']:.2f}"
+            for name in HOP_TIMES
+        )
+        lines.append(f"  {hop['service']:<32} {hop['requests']:>8}  ms: {times}")
+    return "\n".join(lines)
+
+
+class LoadGenerator:
+    """
+    Sends requests to a URL at a fixed rate, or with a fixed number of
+    workers, and reports their latency
+    """
+
+    def __init__(
+        self,
+        url,
+        rate=None,
+        concurrency=10,
+        duration=0.0,
+        timeout=10.0,
+        expected_interval=None,
+        report_interval=10.0,
+        json_output=False,
+        output=sys.stdout,
+        hops=False,
+        batch=None,
+    ):
+        if rate is not None and rate <= 0:
+            raise ValueError(f"The rate has to be above 0, not {rate}")
+        if concurrency < 1:
+            raise ValueError(f"The concurrency has to be at least 1, not {concurrency}")
+        if batch is not None and batch < 1:
+            raise ValueError(f"A batch has to have at least 1 request, not {batch}")
+        self.url = url
+        self.rate = rate
+        self.concurrency = concurrency
+        self.duration = duration
+        self.timeout = timeout
+        # in microseconds, like the histograms
+        self.expected_interval = (
+            expected_interval * 1e6 if expected_interval is not None else None
+        )
+        self.report_interval = report_interval
+        self.json_output = json_output
+        self.output = output
+        self.hops = hops
+        self.batch = batch
+        self.batch_url = str(httpx.URL(url).join(BATCH_ROUTE))
+        # the requests each request to the chain stands for
+        self.items = batch or 1
+        self.interval = Report()
+        self.total = Report()
+        self._stop = None
+
+    def stop(self):
+        """
+        Stop sending requests, the run reports the requests still in flight
+        and returns
+        """
+        self._stop.set()
+
+    def _finished(self, start):
+        return self._stop.is_set() or (
+            self.duration and time.perf_counter() - start >= self.duration
+        )
+
+    async def _wait(self, delay):
+        # returns whether the generator was stopped while waiting
+        try:
+            await asyncio.wait_for(self._stop.wait(), delay)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _batch_body(self):
+        # each item has a trace ID of its own, for its injected latency
+        items = [
+            {"id": str(i), "trace_id": f"{random.getrandbits(128):032x}"}
+            for i in range(self.batch)
+        ]
+        return json.dumps({"items": items}).encode()
+
+    def _count_items(self, response):
+        # the errors of a batch are the items that failed in it
+        try:
+            items = response.json()["items"]
+        except (ValueError, KeyError, TypeError):
+            self.interval.errors["invalid_batch"] += self.items
+            return
+        for item in items:
+            if not 200 <= item.get("status", 0) < 300:
+                self.interval.errors[str(item.get("status"))] += 1
+
+    async def _send(self, client, intended):
+        # the chain gives up when this does, timed from the intended start
+        deadline = time.time() - (time.perf_counter() - intended) + self.timeout
+        headers = {DEADLINE_HEADER: str(int(deadline * 1000))}
+        try:
+            if self.batch:
+                response = await client.post(
+                    self.batch_url, headers=headers, content=self._batch_body()
+                )
+            else:
+                response = await client.get(self.url, headers=headers)
+            # the latency includes reading the whole body
+            await response.aread()
+            if not response.is_success:
+                self.interval.errors[str(response.status_code)] += self.items
+            elif self.batch:
+                self._count_items(response)
+            if self.hops:
+                self.interval.record_hops(
+                    parse_server_timing(response.headers.get(SERVER_TIMING))
+                )
+        except httpx.HTTPError as exc:
+            self.interval.errors[type(exc).__name__] += self.items
+        return (time.perf_counter() - intended) * 1e6
+
+    async def _open_loop(self, client, start):
+        pending = set()
+        # the requests that can be started in a timeout, past which the ones
+        # in flight are sure to have given up on their deadline
+        max_pending = max(
+            self.concurrency, math.ceil(self.rate * self.timeout / self.items)
+        )
+
+        async def send(intended):
+            self.interval.histogram.record(
+                await self._send(client, intended), self.items
+            )
+
+        sent = 0
+        while not self._stop.is_set():
+            offset = sent * self.items / self.rate
+            if self.duration and offset >= self.duration:
+                break
+            intended = start + offset
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                if await self._wait(delay):
+                    break
+            else:
+                # behind schedule, let the requests in flight and a stop run
+                await asyncio.sleep(0)
+            if len(pending) >= max_pending:
+                self.interval.errors["dropped"] += self.items
+                self.interval.histogram.record(self.timeout * 1e6, self.items)
+            else:
+                # the request waits for a connection if they are all in use,
+                # which counts against its latency and its timeout
+                task = asyncio.ensure_future(send(intended))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            sent += 1
+        if pending:
+            await asyncio.wait(pending)
+
+    async def _closed_loop(self, client, start):
+        async def worker():
+            while not self._finished(start):
+                latency = await self._send(client, time.perf_counter())
+                self.interval.histogram.record_corrected(
+                    latency, self.expected_interval, self.items
+                )
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    def _report(self, elapsed, total=False):
+        report = self.total if total else self.interval
+        summary = report.summary(elapsed)
+        if self.json_output:
+            summary["total"] = total
+            line = json.dumps(summary)
+        else:
+            line = format_summary(summary, total)
+        print(line, file=self.output, flush=True)
+        return summary
+
+    async def _reporter(self):
+        last = time.perf_counter()
+        while not self._stop.is_set():
+            await self._wait(self.report_interval)
+            now = time.perf_counter()
+            self._flush_interval(now - last)
+            last = now
+
+    def _flush_interval(self, elapsed):
+        if self.interval.histogram.total or self.interval.errors:
+            self._report(elapsed)
+        self.total.merge(self.interval)
+        self.interval.reset()
+
+    async def run(self):
+        """
+        Send requests until the duration is up, or until stopped, and return
+        the summary of the whole run
+        """
+        self._stop = asyncio.Event()
+        limits = httpx.Limits(
+            max_connections=self.concurrency,
+            max_keepalive_connections=self.concurrency,
+        )
+        # trust_env=False skips looking up proxies for every request
+        async with httpx.AsyncClient(
+            limits=limits, timeout=self.timeout, trust_env=False
+        ) as client:
+            reporter = asyncio.ensure_future(self._reporter())
+            start = time.perf_counter()
+            if self.rate is None:
+                await self._closed_loop(client, start)
+            else:
+                await self._open_loop(client, start)
+            elapsed = time.perf_counter() - start
+            self._stop.set()
+            # the reporter reports the last interval once stopped
+            await reporter
+        return self._report(elapsed, total=True)
+
+
+def add_arguments(parser, url=None):
+    """
+    Add the load generator's options to an argument parser
+    """
+    parser.add_argument(
+        "--url",
+        type=str,
+        help="URL to send requests to",
+        required=url is None,
+        dest="url",
+        default=url,
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help="Requests to start per second, open loop, instead of workers",
+        required=False,
+        dest="rate",
+        default=None,
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Most connections, or the number of workers without --rate",
+        required=False,
+        dest="concurrency",
+        default=10,
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        help="Seconds to send requests for, 0 to send them until stopped",
+        required=False,
+        dest="duration",
+        default=0.0,
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="Seconds a request can take, waiting for a connection included",
+        required=False,
+        dest="timeout",
+        default=10.0,
+    )
+    parser.add_argument(
+        "--expected-interval",
+        type=float,
+        help="Seconds between the requests of a worker, to correct for "
+        "coordinated omission without --rate",
+        required=False,
+        dest="expected_interval",
+        default=None,
+    )
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        help="Seconds between reports",
+        required=False,
+        dest="report_interval",
+        default=10.0,
+    )
+    parser.add_argument(
+        "--hops",
+        help="Add up the Server-Timing breakdown of the hops of each response",
+        action="store_true",
+        dest="hops",
+        default=False,
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        help="Send the requests this many at a time, to /batch",
+        required=False,
+        dest="batch",
+        default=None,
+    )
+    parser.add_argument(
+        "--json",
+        help="Print the reports as JSON lines",
+        action="store_true",
+        dest="json",
+        default=False,
+    )
+
+
+def load(args):
+    """
+    Run a load generator with the parsed options
+    """
+    generator = LoadGenerator(
+        args.url,
+        rate=args.rate,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        timeout=args.timeout,
+        expected_interval=args.expected_interval,
+        report_interval=args.report_interval,
+        json_output=args.json,
+        hops=args.hops,
+        batch=args.batch,
+    )
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        # print the report of the whole run when the pod is stopped
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, generator.stop)
+        return await generator.run()
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send load to a chain link")
+    add_arguments(parser)
+    load(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Logging off the request thread, so a hop doesn't wait on log I/O.
+
+The records of a worker are put on a bounded queue, CHAIN_LINK_LOG_QUEUE
+records long, and written out by a background thread. When the queue is full
+a record is dropped instead of waited for. CHAIN_LINK_LOG_QUEUE=0 writes the
+records on the thread that logged them.
+
+With CHAIN_LINK_LOG_FORMAT=json, the default, each record is a line of JSON
+with the trace and span IDs of the request it was logged in. text writes
+them with the handlers and format of the gunicorn or uvicorn logger.
+
+CHAIN_LINK_LOG_SAMPLE keeps 1 in N of the records of a level, e.g. info=100
+keeps one info record in a hundred. A record logged in a trace is kept if its
+trace ID is, so a trace that is kept has its records kept on every hop.
+
+Records that are sampled out or don't fit in the queue are counted in
+chain_link_log_records_dropped_total, by reason.
+"""
+
+import os
+import sys
+import copy
+import json
+import queue
+import logging
+import itertools
+import threading
+from datetime import datetime, timezone
+from opentelemetry import trace
+from .env import env_int, env_str
+from .metrics import LOG_RECORDS_DROPPED
+
+FORMATS = ("json", "text")
+
+# seconds to wait for the queued records to be written when logging shuts down
+CLOSE_TIMEOUT = 5.0
+
+# renders the traceback of a record before it is queued
+TRACEBACK_FORMATTER = logging.Formatter()
+
+
+def parse_sample(value):
+    """
+    Parse the levels to sample, e.g. "info=100,debug=1000", into a dict of
+    level to the 1 in N records of it that are kept
+    """
+    sample = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        name, _, every = item.partition("=")
+        level = logging.getLevelName(name.strip().upper())
+        if not isinstance(level, int):
+            raise ValueError(f"Unknown log level {name.strip()}")
+        every = int(every)
+        if every < 1:
+            raise ValueError(f"The sample of {name.strip()} has to be 1 or more")
+        sample[level] = every
+    return sample
+
+
+class LogSettings:
+    """
+    How records are formatted, how many can wait to be written, and which
+    levels are sampled
+    """
+
+    def __init__(self, format="json", queue_size=10000, sample=None):
+        if format not in FORMATS:
+            raise ValueError(f"The log format has to be json or text, not {format}")
+        self.format = format
+        self.queue_size = queue_size
+        self.sample = dict(sample or {})
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the settings from CHAIN_LINK_LOG_FORMAT, CHAIN_LINK_LOG_QUEUE
+        and CHAIN_LINK_LOG_SAMPLE
+        """
+        return cls(
+            format=env_str("CHAIN_LINK_LOG_FORMAT", "json"),
+            queue_size=env_int("CHAIN_LINK_LOG_QUEUE", 10000),
+            sample=parse_sample(env_str("CHAIN_LINK_LOG_SAMPLE")),
+        )
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a line of JSON
+    """
+
+    def __init__(self, service_name=None):
+        super().__init__()
+        self.service_name = service_name
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "service": self.service_name,
+            "message": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+            entry["span_id"] = record.span_id
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+class LogPipeline(logging.Handler):
+    """
+    A handler that samples records and queues them for a background thread,
+    once per worker, to write
+    """
+
+    def __init__(self, settings, target, service_name=None):
+        super().__init__()
+        self.settings = settings
+        # the logger whose handlers write the text format
+        self.target = target
+        self.output = None
+        if settings.format == "json":
+            self.output = logging.StreamHandler(sys.stderr)
+            self.output.setFormatter(JsonFormatter(service_name))
+        self._counts = {level: itertools.count() for level in settings.sample}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, target, service_name=None):
+        """
+        Create a LogPipeline with the settings from the CHAIN_LINK_LOG_* env
+        vars, writing the text format with the handlers of target
+        """
+        return cls(LogSettings.from_env(), target, service_name)
+
+    def install(self, logger):
+        """
+        Send the records of logger through the pipeline instead of its own
+        handlers
+        """
+        logger.handlers = [self]
+        logger.propagate = False
+
+    def _sampled(self, record, trace_id):
+        every = self.settings.sample.get(record.levelno, 1)
+        if every == 1:
+            return True
+        if trace_id:
+            return trace_id % every == 0
+        return next(self._counts[record.levelno]) % every == 0
+
+    def _records(self):
+        # threads don't survive a fork, so each worker starts its own writer
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(self.settings.queue_size)
+                    self._thread = threading.Thread(
+                        target=self._listen,
+                        args=(self._queue,),
+                        name="chain-link-logs",
+                        daemon=True,
+                    )
+                    self._thread.start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def emit(self, record):
+        # the current span is only known on the thread that logged the record
+        span_context = trace.get_current_span().get_span_context()
+        if span_context.is_valid:
+            record.trace_id = format(span_context.trace_id, "032x")
+            record.span_id = format(span_context.span_id, "016x")
+        if not self._sampled(record, span_context.trace_id):
+            LOG_RECORDS_DROPPED.labels("sampled").inc()
+            return
+        if not self.settings.queue_size:
+            self._write(record)
+            return
+        try:
+            self._records().put_nowait(self._prepare(record))
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels("queue_full").inc()
+
+    def _prepare(self, record):
+        # render the message and traceback on the thread that logged the
+        # record, like QueueHandler.prepare, as its args could change before
+        # the writer gets to it and its traceback would keep frames alive
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = TRACEBACK_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def _write(self, record):
+        try:
+            if self.output is not None:
+                self.output.handle(record)
+            else:
+                self.target.handle(record)
+        except Exception:
+            self.handleError(record)
+
+    def _listen(self, records):
+        while True:
+            record = records.get()
+            if record is None:
+                return
+            self._write(record)
+
+    def close(self):
+        """
+        Write out the records still queued in this worker, when logging shuts
+        down
+        """
+        if self._pid == os.getpid() and self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=CLOSE_TIMEOUT)
+                self._thread.join(CLOSE_TIMEOUT)
+            except queue.Full:
+                pass
+            self._pid = None
+        super().close()
@@ -0,0 +1,222 @@
+"""
+Prometheus metrics of a chain link, served on /metrics.
+
+Gunicorn runs the app in one or more worker processes. With
+PROMETHEUS_MULTIPROC_DIR set, which gunicorn-run.sh does, every worker writes
+its metrics to mmap-backed files in that directory and /metrics adds up the
+files of all the workers, so it doesn't matter which worker is scraped.
+Without it, as in the tests, the metrics are those of the one process.
+"""
+
+import os
+import time
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# a dozen buckets keep an observation cheap and cover a fast hop up to the
+# next hop timeout
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# the route label of a request that didn't match any route, so a scan of
+# random paths can't blow up the number of series
+UNMATCHED_ROUTE = "unmatched"
+
+REQUESTS = Counter("chain_link_requests", "Requests handled", ["route"])
+REQUESTS_IN_FLIGHT = Gauge(
+    "chain_link_requests_in_flight",
+    "Requests being handled",
+    ["route"],
+    multiprocess_mode="livesum",
+)
+REQUEST_ERRORS = Counter(
+    "chain_link_request_errors",
+    "Requests answered with a 5xx status",
+    ["route", "status"],
+)
+REQUEST_DURATION = Histogram(
+    "chain_link_request_duration_seconds",
+    "Time from receiving a request to starting the response",
+    ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+NEXT_HOP_DURATION = Histogram(
+    "chain_link_next_hop_duration_seconds",
+    "Time to get the response of a next service",
+    ["next_service"],
+    buckets=LATENCY_BUCKETS,
+)
+INJECTED_SLEEP = Histogram(
+    "chain_link_injected_sleep_seconds",
+    "Latency injected into a request, zero when the service wasn't slow",
+    ["service"],
+    buckets=LATENCY_BUCKETS,
+)
+DEADLINE_EXCEEDED = Counter(
+    "chain_link_deadline_exceeded",
+    "Requests given up on because their deadline passed, by where it passed",
+    ["stage"],
+)
+REQUESTS_SHED = Counter(
+    "chain_link_requests_shed",
+    "Requests answered with a 503 because the link was at its limit, by why",
+    ["reason"],
+)
+ADMISSION_LIMIT = Gauge(
+    "chain_link_admission_limit",
+    "Requests the workers let in at once",
+    multiprocess_mode="livesum",
+)
+HEDGES = Counter(
+    "chain_link_hedges",
+    "Calls to a next service that were sent again, by the one that answered",
+    ["next_service", "winner"],
+)
+HEDGES_DENIED = Counter(
+    "chain_link_hedges_denied",
+    "Calls to a next service not sent again because the budget was spent",
+    ["next_service"],
+)
+STARTUP_SECONDS = Gauge(
+    "chain_link_startup_seconds",
+    "Time the slowest worker took to start, by phase",
+    ["phase"],
+    multiprocess_mode="max",
+)
+CACHE_REQUESTS = Counter(
+    "chain_link_cache_requests",
+    "Requests looked up in a response cache, by whether they were a hit, a miss, "
+    "or coalesced with another miss",
+    ["service", "result"],
+)
+LOG_RECORDS_DROPPED = Counter(
+    "chain_link_log_records_dropped",
+    "Log records not written because they were sampled out or the queue was full",
+    ["reason"],
+)
+WORK_DURATION = Histogram(
+    "chain_link_work_seconds",
+    "Time spent on the CPU and memory work of a request",
+    ["service"],
+    buckets=LATENCY_BUCKETS,
+)
+WORK_BALLAST_BYTES = Gauge(
+    "chain_link_work_ballast_bytes",
+    "Memory the workers keep resident as ballast",
+    multiprocess_mode="livesum",
+)
+SPANS_EXPORTED = Counter(
+    "chain_link_spans_exported", "Spans the exporter sent to the collector"
+)
+SPANS_DROPPED = Counter(
+    "chain_link_spans_dropped",
+    "Spans lost because the export queue was full or the export failed",
+    ["reason"],
+)
+SPAN_QUEUE_DEPTH = Gauge(
+    "chain_link_span_queue_depth",
+    "Spans waiting in the export queue",
+    multiprocess_mode="livesum",
+)
+SPAN_SPOOL_BYTES = Gauge(
+    "chain_link_span_spool_bytes",
+    "Bytes of spans spooled to disk waiting to be sent",
+    multiprocess_mode="livesum",
+)
+
+
+class RequestMetrics:
+    """
+    Records one request, from when it is received until it is finished
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.start = time.perf_counter()
+        self.status = None
+        REQUESTS_IN_FLIGHT.labels(route).inc()
+
+    def respond(self, status):
+        """
+        Record the status of the response, once its headers are ready
+        """
+        if self.status is not None:
+            return
+        self.status = status
+        REQUESTS.labels(self.route).inc()
+        REQUEST_DURATION.labels(self.route).observe(time.perf_counter() - self.start)
+        if status >= 500:
+            REQUEST_ERRORS.labels(self.route, str(status)).inc()
+
+    def finish(self):
+        """
+        Stop counting the request as in flight, a request that never got to
+        respond failed
+        """
+        self.respond(500)
+        REQUESTS_IN_FLIGHT.labels(self.route).dec()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records the requests of the async app
+    """
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = set(routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        request_metrics = RequestMetrics(
+            path if path in self.routes else UNMATCHED_ROUTE
+        )
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                request_metrics.respond(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            request_metrics.finish()
+
+
+def render(path=None):
+    """
+    Get the metrics of all the workers, or of this process if they aren't
+    shared, and their content type
+    """
+    path = path or os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=path)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
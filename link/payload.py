@@ -0,0 +1,207 @@
+"""
+Synthetic request and response bodies, so a chain can be made to move data
+and not just wait.
+
+The sizes are set per service in the "payload" section of the services.json,
+e.g.
+
+    "payload": {
+        "default": {"request": "1KB"},
+        "chain-link-service-4": {"response": "20MB"},
+        "chain-link-service-5": {"response": "echo"}
+    }
+
+or with CHAIN_LINK_PAYLOAD for the pod's own service. "request" is the body
+sent to each of the next services, "response" the body the final link of the
+chain returns, or "echo" to send back what it was sent.
+
+Bodies are made out of one preallocated chunk, which is handed out again and
+again rather than copied, so making a body costs nothing per request.
+"""
+
+import re
+import string
+import random
+import threading
+from .env import env_str, get_service_specs
+
+SIZE_UNITS = {
+    "": 1,
+    "b": 1,
+    "kb": 1000,
+    "mb": 1000**2,
+    "gb": 1000**3,
+    "kib": 1024,
+    "mib": 1024**2,
+    "gib": 1024**3,
+}
+
+
+class PayloadError(ValueError):
+    """
+    Raised for payload settings that can't be used
+    """
+
+
+def parse_size(size):
+    """
+    Turn a size like 512, "64KiB" or "10MB" into a number of bytes
+    """
+    if isinstance(size, int):
+        return size
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*", str(size))
+    if not match or match.group(2).lower() not in SIZE_UNITS:
+        raise PayloadError(f"Unknown size {size}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+class Payload:
+    """
+    A body of size bytes that iterates over the shared chunk. It has a length
+    so it is sent with a Content-Length rather than chunked.
+    """
+
+    def __init__(self, size, chunk, tail):
+        self.size = size
+        self.chunk = chunk
+        self.tail = tail
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for _ in range(self.size // len(self.chunk)):
+            yield self.chunk
+        if self.tail:
+            yield self.tail
+
+    async def __aiter__(self):
+        for part in self:
+            yield part
+
+
+class PayloadBuffer:
+    """
+    The preallocated chunk that every body is made of, per worker. The chunk
+    is immutable bytes, which is what WSGI servers want to write, and the
+    tails for the few sizes in the config are cut from it once and kept, as
+    are the bodies of those sizes as text.
+    """
+
+    def __init__(self, chunk_size=256 * 1024, max_tails=64):
+        # printable so it survives being passed through as text
+        alphabet = (string.ascii_letters + string.digits).encode()
+        printable = bytes(alphabet[i % len(alphabet)] for i in range(256))
+        self.chunk = (
+            random.Random(chunk_size).randbytes(chunk_size).translate(printable)
+        )
+        self.max_tails = max_tails
+        self._tails = {}
+        self._texts = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a PayloadBuffer sized by CHAIN_LINK_PAYLOAD_CHUNK_BYTES
+        """
+        return cls(
+            chunk_size=parse_size(env_str("CHAIN_LINK_PAYLOAD_CHUNK_BYTES", "256KiB"))
+        )
+
+    def _tail(self, length):
+        tail = self._tails.get(length)
+        if tail is None:
+            tail = self.chunk[:length]
+            with self._lock:
+                if len(self._tails) < self.max_tails:
+                    self._tails[length] = tail
+        return tail
+
+    def payload(self, size):
+        """
+        Get a body of size bytes
+        """
+        return Payload(size, self.chunk, self._tail(size % len(self.chunk)))
+
+    def text(self, size):
+        """
+        Get a body of size bytes as a str, to put in a JSON document such as
+        a batch
+        """
+        text = self._texts.get(size)
+        if text is None:
+            text = b"".join(self.payload(size)).decode("ascii")
+            with self._lock:
+                if len(self._texts) < self.max_tails:
+                    self._texts[size] = text
+        return text
+
+
+def drain(stream, chunk_size=256 * 1024):
+    """
+    Read and throw away a request body, returning its size. A body has to be
+    read before the response is sent, or a client still sending a large body
+    and a server sending a large response can block each other.
+    """
+    size = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return size
+        size += len(chunk)
+
+
+class PayloadPolicy:
+    """
+    The body sizes of one service
+    """
+
+    def __init__(self, request_bytes=0, response_bytes=None, echo=False):
+        self.request_bytes = request_bytes
+        self.response_bytes = response_bytes
+        self.echo = echo
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Create a policy from a payload config block
+        """
+        response = spec.get("response")
+        echo = response == "echo"
+        return cls(
+            request_bytes=parse_size(spec.get("request", 0)),
+            response_bytes=None if response is None or echo else parse_size(response),
+            echo=echo,
+        )
+
+
+class PayloadSizes:
+    """
+    Looks up the PayloadPolicy of a service
+    """
+
+    def __init__(self, policies, default_policy):
+        self.policies = policies
+        self.default_policy = default_policy
+
+    @classmethod
+    def from_config(cls, services_config, service_name):
+        """
+        Build the policies from the "payload" section of the services config,
+        with CHAIN_LINK_PAYLOAD overriding the policy of this pod's service
+        """
+        section = get_service_specs(
+            services_config, "payload", "CHAIN_LINK_PAYLOAD", service_name
+        )
+        default_policy = PayloadPolicy.from_spec(section.pop("default", {}))
+        policies = {
+            name: PayloadPolicy.from_spec(spec) for name, spec in section.items()
+        }
+        return cls(policies, default_policy)
+
+    def policy(self, service):
+        """
+        Get the policy for a service
+        """
+        return self.policies.get(service, self.default_policy)
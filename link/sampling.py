@@ -0,0 +1,242 @@
+"""
+Choosing which traces are exported, so a heavy load test doesn't have to
+send every span of every hop to Zipkin.
+
+The sampler is set with CHAIN_LINK_TRACE_SAMPLER and its argument with
+CHAIN_LINK_TRACE_SAMPLER_ARG:
+
+    always_on          every trace, the default
+    always_off         no traces
+    parentbased_ratio  the given fraction of traces, e.g. 0.01
+    rate_limited       at most the given number of traces per second
+    keep_slow          every trace that has injected latency or an error,
+                       and the given fraction of the others, 0 by default
+
+All but keep_slow decide at the start of a trace, and the hops after the
+first follow the decision of the hop that called them. keep_slow can only
+decide once a hop has answered, so every span is recorded and the spans of a
+trace are held back until the hop's own root span ends. The first hop works
+out the injected latency of the whole trace and passes it down the chain in
+the X-Chain-Link-Trace-Delay header, so the others don't go through every
+service again.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from opentelemetry.sdk.trace import SpanProcessor
+from opentelemetry.sdk.trace.sampling import (
+    ALWAYS_OFF,
+    ALWAYS_ON,
+    Decision,
+    ParentBased,
+    Sampler,
+    SamplingResult,
+    TraceIdRatioBased,
+)
+from opentelemetry.trace import StatusCode
+from .env import env_float, env_str
+
+SAMPLERS = ("always_on", "always_off", "parentbased_ratio", "rate_limited", "keep_slow")
+
+# set on a span to keep its trace when keeping slow traces
+KEEP_ATTRIBUTE = "chain_link.keep"
+
+# the injected latency of the whole trace, passed on to the next hop
+TRACE_DELAY_HEADER = "X-Chain-Link-Trace-Delay"
+
+
+class SamplingError(ValueError):
+    """
+    Raised for a sampler that can't be used
+    """
+
+
+class RateLimitingSampler(Sampler):
+    """
+    Samples at most rate traces per second, with a token bucket that can
+    hold a second's worth of traces so a short burst isn't cut off, and at
+    least one so a rate below 1 still samples
+    """
+
+    def __init__(self, rate):
+        if rate <= 0:
+            raise SamplingError(f"The rate has to be above 0, not {rate}")
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def should_sample(
+        self,
+        parent_context,
+        trace_id,
+        name,
+        kind=None,
+        attributes=None,
+        links=None,
+        trace_state=None,
+    ):
+        decision = Decision.RECORD_AND_SAMPLE if self._take() else Decision.DROP
+        return SamplingResult(decision, attributes)
+
+    def get_description(self):
+        return f"RateLimitingSampler{{{self.rate}}}"
+
+
+class TailSamplingSpanProcessor(SpanProcessor):
+    """
+    Holds back the spans of a trace until the local root span of this hop
+    ends, then passes them all on to the next processor if any of them has
+    the keep attribute or an error, or if the trace is one of the fraction
+    of the others that are kept.
+
+    Every hop decides the same way for the same trace: the injected latency
+    of a trace is worked out from its ID by the first hop and passed down the
+    chain, and an error is passed back up the chain as the status of the
+    response. The children of a
+    service that fanned out and didn't fail are dropped though, even when
+    their sibling failed.
+    """
+
+    def __init__(self, span_processor, ratio=0.0, max_traces=10000):
+        self.span_processor = span_processor
+        self.ratio = TraceIdRatioBased(ratio)
+        self.max_traces = max_traces
+        self._pending = OrderedDict()
+        # spans that end after the decision, like those of a streamed body
+        self._decided = OrderedDict()
+        self._lock = threading.Lock()
+
+    def on_start(self, span, parent_context=None):
+        self.span_processor.on_start(span, parent_context=parent_context)
+
+    def on_end(self, span):
+        trace_id = span.context.trace_id
+        local_root = span.parent is None or span.parent.is_remote
+        with self._lock:
+            keep = self._decided.get(trace_id)
+            if keep is None:
+                spans = self._pending.pop(trace_id, [])
+                spans.append(span)
+                if not local_root:
+                    self._pending[trace_id] = spans
+                    if len(self._pending) > self.max_traces:
+                        # too many traces are open, drop the oldest
+                        self._pending.popitem(last=False)
+                    return
+                keep = self._keep(trace_id, spans)
+                self._decided[trace_id] = keep
+                if len(self._decided) > self.max_traces:
+                    self._decided.popitem(last=False)
+            else:
+                spans = [span]
+
+        if keep:
+            for kept in spans:
+                self.span_processor.on_end(kept)
+
+    def _keep(self, trace_id, spans):
+        for span in spans:
+            if span.status.status_code is StatusCode.ERROR:
+                return True
+            attributes = span.attributes or {}
+            if attributes.get(KEEP_ATTRIBUTE):
+                return True
+            if attributes.get("http.status_code", 0) >= 500:
+                return True
+        return trace_id & TraceIdRatioBased.TRACE_ID_LIMIT < self.ratio.bound
+
+    def shutdown(self):
+        self.span_processor.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+        return self.span_processor.force_flush(timeout_millis)
+
+
+class SamplingSettings:
+    """
+    Which sampler is used, with its argument
+    """
+
+    def __init__(self, sampler="always_on", arg=None, slow_threshold=0.0):
+        if sampler not in SAMPLERS:
+            raise SamplingError(
+                f"Unknown sampler {sampler}, use one of {', '.join(SAMPLERS)}"
+            )
+        self.sampler = sampler
+        self.arg = arg
+        self.slow_threshold = slow_threshold
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the settings from CHAIN_LINK_TRACE_SAMPLER,
+        CHAIN_LINK_TRACE_SAMPLER_ARG and CHAIN_LINK_TRACE_SLOW_THRESHOLD
+        """
+        return cls(
+            sampler=env_str("CHAIN_LINK_TRACE_SAMPLER", "always_on"),
+            arg=env_float("CHAIN_LINK_TRACE_SAMPLER_ARG", None),
+            slow_threshold=env_float("CHAIN_LINK_TRACE_SLOW_THRESHOLD", 0.0),
+        )
+
+    @property
+    def keep_slow(self):
+        """
+        Whether slow traces are picked out after they have run
+        """
+        return self.sampler == "keep_slow"
+
+    def is_slow(self, injected_latency):
+        """
+        Whether a trace with this much injected latency is kept
+        """
+        return injected_latency > self.slow_threshold
+
+    def trace_delay(self, header, latency_injector, trace_id):
+        """
+        The injected latency of the whole trace, from the header the hop
+        before sent, or worked out from the trace ID by the first hop
+        """
+        try:
+            return float(header)
+        except (TypeError, ValueError):
+            return latency_injector.trace_delay(trace_id)
+
+    def get_sampler(self):
+        """
+        The sampler for the TracerProvider
+        """
+        if self.sampler == "always_off":
+            return ALWAYS_OFF
+        if self.sampler == "parentbased_ratio":
+            return ParentBased(TraceIdRatioBased(1.0 if self.arg is None else self.arg))
+        if self.sampler == "rate_limited":
+            return ParentBased(
+                RateLimitingSampler(100.0 if self.arg is None else self.arg)
+            )
+        # keep_slow has to record everything to decide later
+        return ParentBased(ALWAYS_ON)
+
+    def wrap_span_processor(self, span_processor):
+        """
+        Put the tail sampling in front of the span processor, if it is used
+        """
+        if not self.keep_slow:
+            return span_processor
+        return TailSamplingSpanProcessor(
+            span_processor, ratio=0.0 if self.arg is None else self.arg
+        )
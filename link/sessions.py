@@ -0,0 +1,258 @@
+"""
+Pooled keep-alive HTTP sessions used to forward requests to the next hop
+"""
+
+import os
+import socket
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from .env import env_bool, env_float, env_int
+
+# the connections threads are waiting on for a response, by thread, so another
+# thread can cut a call short, see SessionPool.interrupt
+_waiting = {}
+_waiting_lock = threading.Lock()
+
+
+def keepalive_socket_options():
+    """
+    Socket options that turn on TCP keep-alive probes for pooled connections
+    """
+    options = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    ]
+    # these are linux only, but that is what runs in the pods
+    for name, value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+class WaitingConnection(HTTPConnection):
+    """
+    A connection that records the thread waiting on it for a response, until
+    it goes back to its pool
+    """
+
+    waiter = None
+
+    def getresponse(self, *args, **kwargs):
+        with _waiting_lock:
+            self.waiter = threading.get_ident()
+            _waiting[self.waiter] = self
+        return super().getresponse(*args, **kwargs)
+
+
+class WaitingConnectionPool(HTTPConnectionPool):
+    """
+    A urllib3 pool of WaitingConnections, which forgets the thread waiting on
+    a connection once it is put back
+    """
+
+    ConnectionCls = WaitingConnection
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            with _waiting_lock:
+                if conn.waiter is not None and _waiting.get(conn.waiter) is conn:
+                    del _waiting[conn.waiter]
+                conn.waiter = None
+        super()._put_conn(conn)
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    A HTTPAdapter that passes socket options down to its urllib3 pools, and
+    whose http:// connections can be interrupted
+    """
+
+    def __init__(self, socket_options=None, **kwargs):
+        self.socket_options = socket_options
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options is not None:
+            kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(
+            self.poolmanager.pool_classes_by_scheme, http=WaitingConnectionPool
+        )
+
+
+class SessionPool:
+    """
+    Keep-alive connections to the downstream services, shared by every thread
+    in a worker.
+
+    There is one HTTPAdapter (and so one thread-safe urllib3 PoolManager) per
+    worker process, and each thread gets its own requests.Session mounted on
+    that adapter, as a Session is not itself thread-safe. Connections to hosts
+    that have not been used for idle_timeout seconds are closed.
+    """
+
+    def __init__(self, pool_size=10, keepalive=True, idle_timeout=60.0):
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a SessionPool configured from CHAIN_LINK_POOL_* env vars
+        """
+        return cls(
+            pool_size=env_int("CHAIN_LINK_POOL_SIZE", 10),
+            keepalive=env_bool("CHAIN_LINK_POOL_KEEPALIVE", True),
+            idle_timeout=env_float("CHAIN_LINK_POOL_IDLE_TIMEOUT", 60.0),
+        )
+
+    def _reset(self):
+        # a forked worker must not share sockets with its parent, so all of
+        # this is recreated when the pid changes
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._last_used = {}
+        # the requests each host has going, its pool isn't evicted until
+        # they are done
+        self._in_use = {}
+        self._last_sweep = time.monotonic()
+        self._evicted_pools = 0
+        self._evicted_requests = 0
+        self._evicted_connections = 0
+        self.adapter = PooledAdapter(
+            socket_options=keepalive_socket_options() if self.keepalive else None,
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+        )
+
+    def session(self):
+        """
+        Get the requests.Session for the calling thread
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self.adapter)
+            session.mount("https://", self.adapter)
+            if not self.keepalive:
+                session.headers["Connection"] = "close"
+            self._local.session = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the pool
+        """
+        session = self.session()
+        netloc = requests.utils.urlparse(url).netloc
+        self._touch(netloc)
+        try:
+            return session.request(method, url, **kwargs)
+        finally:
+            self._done(netloc)
+
+    def interrupt(self, thread_id):
+        """
+        Shut down the connection the thread is waiting on for a response, if
+        it is, so its request fails at once instead of running on
+        """
+        with _waiting_lock:
+            conn = _waiting.pop(thread_id, None)
+            if conn is None or conn.sock is None:
+                return
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def get(self, url, **kwargs):
+        """
+        Send a GET request through the pool
+        """
+        return self.request("GET", url, **kwargs)
+
+    def _touch(self, netloc):
+        now = time.monotonic()
+        with self._lock:
+            self._last_used[netloc] = now
+            self._in_use[netloc] = self._in_use.get(netloc, 0) + 1
+            if now - self._last_sweep >= min(self.idle_timeout, 1.0):
+                self._last_sweep = now
+                self._evict_idle(now)
+
+    def _done(self, netloc):
+        with self._lock:
+            in_use = self._in_use.get(netloc, 0) - 1
+            if in_use > 0:
+                self._in_use[netloc] = in_use
+            else:
+                self._in_use.pop(netloc, None)
+
+    def _evict_idle(self, now):
+        # called with self._lock held. A pool with requests going isn't
+        # evicted, a request could otherwise take it from the pool manager
+        # and find it closed. A streamed response holds on to its connection
+        # past the request, which a closed pool then closes instead of
+        # keeping.
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            netloc = f"{key.key_host}:{key.key_port}"
+            if netloc in self._in_use or key.key_host in self._in_use:
+                continue
+            last_used = self._last_used.get(netloc, self._last_used.get(key.key_host))
+            if last_used is not None and now - last_used < self.idle_timeout:
+                continue
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue
+            self._evicted_requests += pool.num_requests
+            self._evicted_connections += pool.num_connections
+            self._evicted_pools += 1
+            del pools[key]
+        self._last_used = {
+            netloc: last_used
+            for netloc, last_used in self._last_used.items()
+            if now - last_used < self.idle_timeout
+        }
+
+    def stats(self):
+        """
+        Connection reuse counters for this worker
+        """
+        with self._lock:
+            pools = self.adapter.poolmanager.pools
+            open_pools = [pools[key] for key in pools.keys()]
+            num_requests = self._evicted_requests + sum(
+                pool.num_requests for pool in open_pools
+            )
+            num_connections = self._evicted_connections + sum(
+                pool.num_connections for pool in open_pools
+            )
+            # urllib3 fills its queue with None placeholders, skip those
+            idle_connections = sum(
+                sum(1 for conn in list(pool.pool.queue) if conn is not None)
+                for pool in open_pools
+                if pool.pool is not None
+            )
+            return {
+                "pool_size": self.pool_size,
+                "keepalive": self.keepalive,
+                "open_pools": len(open_pools),
+                "evicted_pools": self._evicted_pools,
+                "idle_connections": idle_connections,
+                "requests": num_requests,
+                "connections_created": num_connections,
+                "connections_reused": max(num_requests - num_connections, 0),
+            }
@@ -0,0 +1,302 @@
+"""
+Running a whole chain inside one process, to measure what a hop costs without
+Kubernetes or sockets in the way.
+
+The Flask app is loaded with a services config written for the simulation,
+and every request it makes to http://{next_service}/forward is handed
+straight to the app again by a requests adapter, so the routing, the
+OpenTelemetry instrumentation, the headers and process_request all run as
+they do in a pod. Spans are made and batched, but thrown away.
+
+A hop that fans out calls its children on threads of its own rather than the
+app's bounded pool. Every hop runs on the thread of the hop that called it,
+so with a shared pool the threads would all wait on children queued behind
+them.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import importlib
+import threading
+import contextvars
+from urllib.parse import unquote, urlsplit
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+from .config import LinkConfig
+from .fanout import FanOut
+from .sessions import SessionPool
+from .topology import Topology
+
+# every hop nests the next one on the stack of the request's thread
+STACK_SIZE = 64 * 1024 * 1024
+RECURSION_LIMIT = 100000
+
+
+class WSGIAdapter(HTTPAdapter):
+    """
+    A requests adapter that sends requests into a WSGI app in this process
+    """
+
+    def __init__(self, app, **kwargs):
+        self.app = app
+        super().__init__(**kwargs)
+
+    def environ(self, request):
+        """
+        The WSGI environ for a prepared request
+        """
+        url = urlsplit(request.url)
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        elif not isinstance(body, bytes):
+            body = b"".join(body)
+        environ = {
+            "REQUEST_METHOD": request.method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote(url.path) or "/",
+            "QUERY_STRING": url.query,
+            "SERVER_NAME": url.hostname,
+            "SERVER_PORT": str(url.port or 80),
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "REMOTE_ADDR": "127.0.0.1",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": url.scheme,
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in request.headers.items():
+            key = name.upper().replace("-", "_")
+            if key == "CONTENT_TYPE":
+                environ[key] = value
+            elif key != "CONTENT_LENGTH":
+                environ[f"HTTP_{key}"] = value
+        return environ
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+
+        app_iter = self.app(self.environ(request), start_response)
+        try:
+            body = b"".join(app_iter)
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+
+        status, headers = started
+        raw = HTTPResponse(
+            body=io.BytesIO(body),
+            headers=headers,
+            status=int(status.split(" ", 1)[0]),
+            reason=status.split(" ", 1)[-1],
+            preload_content=False,
+            decode_content=False,
+        )
+        return self.build_response(request, raw)
+
+
+class InProcessSessionPool(SessionPool):
+    """
+    A SessionPool whose requests go to a WSGI app in this process
+    """
+
+    def __init__(self, app):
+        self.app = app
+        super().__init__()
+
+    def _reset(self):
+        super()._reset()
+        self.adapter = WSGIAdapter(self.app)
+
+
+class InProcessFanOut(FanOut):
+    """
+    A FanOut that calls the children of a service on a pool of their own,
+    since in process the children run on the threads they are called on
+    """
+
+    def map(self, fn, items):
+        """
+        Call fn on every item concurrently and return the results in order
+        """
+        with ThreadPoolExecutor(
+            max_workers=max(1, len(items)), thread_name_prefix="chain-link-fanout"
+        ) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, fn, item)
+                for item in items
+            ]
+            return [future.result() for future in futures]
+
+
+def chain_config(length, fan_out=1):
+    """
+    The services config of a chain of length services, or a tree of them
+    when they fan out, with no injected latency
+    """
+    services = [f"chain-link-service-{i}" for i in range(length)]
+    config = Topology.tree(services, fan_out).to_config()
+    config["latency"] = {"default": {"distribution": "fixed", "value": 0}}
+    return config
+
+
+def load_app(services_config):
+    """
+    Import the Flask app with the services config, and with its requests to
+    the next hop dispatched in process
+    """
+    topology = Topology.from_config(services_config)
+    with tempfile.NamedTemporaryFile(
+        "w", suffix=".json", prefix="chain-link-", delete=False
+    ) as services_file:
+        json.dump(services_config, services_file)
+
+    os.environ["CHAIN_LINK_SERVICES_FILE"] = services_file.name
+    os.environ["CHAIN_LINK_SERVICE_NAME"] = topology.entry
+    os.environ["CHAIN_LINK_RELOAD_INTERVAL"] = "0"
+    os.environ.setdefault("CHAIN_LINK_TRACE_EXPORTER", "none")
+    # the links aren't listening, there is nothing to connect to ahead of time
+    os.environ["CHAIN_LINK_WARMUP"] = "false"
+    try:
+        chain_link_app = importlib.import_module("app")
+    finally:
+        os.unlink(services_file.name)
+
+    # the app may have been imported already, with another config
+    chain_link_app.service_name = topology.entry
+    chain_link_app.services_watcher.current = LinkConfig(
+        services_config, topology.entry
+    )
+
+    # the app logs every hop at info, which would measure the terminal
+    logging.getLogger().setLevel(logging.WARNING)
+    chain_link_app.session_pool = InProcessSessionPool(chain_link_app.app)
+    chain_link_app.fan_out = InProcessFanOut()
+    return chain_link_app
+
+
+def percentile(sorted_values, p):
+    """
+    The p-th percentile, 0 to 100, of already sorted values
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))
+    return sorted_values[index]
+
+
+class Simulator:
+    """
+    Sends requests through a chain loaded in this process and times them
+    """
+
+    def __init__(self, services_config):
+        self.services_config = services_config
+        self.topology = Topology.from_config(services_config)
+        self.chain_link_app = load_app(services_config)
+        self.url = f"http://{self.topology.entry}/"
+        self._local = threading.local()
+
+    def session(self):
+        """
+        The session of the calling thread, which plays the load generator
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.mount("http://", WSGIAdapter(self.chain_link_app.app))
+        return session
+
+    def request(self):
+        """
+        Send one request through the chain, returns how long it took
+        """
+        start = time.perf_counter()
+        response = self.session().get(self.url)
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise RuntimeError(
+                f"The chain answered {response.status_code}: {response.text}"
+            )
+        return elapsed
+
+    def _run(self, count, concurrency):
+        # each hop adds frames to the stack of the thread that started the
+        # request, so the threads get more room than usual
+        stack_size = threading.stack_size(STACK_SIZE)
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(recursion_limit, RECURSION_LIMIT))
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                return list(
+                    executor.map(lambda _: self.request(), range(count)),
+                )
+        finally:
+            threading.stack_size(stack_size)
+            sys.setrecursionlimit(recursion_limit)
+
+    def run(self, count=1000, concurrency=1, warmup=100):
+        """
+        Send count requests, concurrency at a time, after warmup requests
+        that aren't counted, and report what they cost
+        """
+        self._run(warmup, concurrency)
+
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        timings = sorted(self._run(count, concurrency))
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+
+        hops = self.topology.calls()
+        mean = sum(timings) / len(timings)
+        return {
+            "services": len(self.topology),
+            "hops_per_request": hops,
+            "requests": count,
+            "concurrency": concurrency,
+            "requests_per_second": round(count / elapsed, 1),
+            "latency_us": {
+                "mean": round(mean * 1e6, 1),
+                "p50": round(percentile(timings, 50) * 1e6, 1),
+                "p90": round(percentile(timings, 90) * 1e6, 1),
+                "p99": round(percentile(timings, 99) * 1e6, 1),
+                "max": round(timings[-1] * 1e6, 1),
+            },
+            "per_hop_us": round(mean / hops * 1e6, 1),
+            "cpu_per_hop_us": round(cpu / (count * hops) * 1e6, 1),
+        }
+
+
+def format_report(report):
+    """
+    The report of a simulation as text
+    """
+    latency = report["latency_us"]
+    return "\n".join(
+        [
+            f"services:        {report['services']}",
+            f"hops/request:    {report['hops_per_request']}",
+            f"requests:        {report['requests']} "
+            f"({report['concurrency']} at a time)",
+            f"requests/second: {report['requests_per_second']}",
+            f"latency (us):    mean {latency['mean']}  p50 {latency['p50']}  "
+            f"p90 {latency['p90']}  p99 {latency['p99']}  max {latency['max']}",
+            f"per hop (us):    {report['per_hop_us']} wall, "
+            f"{report['cpu_per_hop_us']} cpu",
+        ]
+    )
@@ -0,0 +1,277 @@
+"""
+Spooling spans to disk while the collector is down or slow.
+
+Instead of sending each batch of spans from the export thread, the batch is
+encoded and appended to a ring of records in a memory-mapped file, and a
+drainer thread sends the records on in order. When the collector fails, the
+drainer backs off and the spans wait in the file. When the file is full the
+oldest spans are dropped, so the pod never uses more than the size of the
+file, however long the collector is gone.
+
+Each worker has its own file, spans-<n>.spool, kept locked while it is in
+use, so a restarted worker picks up a file that was left behind.
+"""
+
+import os
+import mmap
+import fcntl
+import random
+import struct
+import logging
+import itertools
+import threading
+from collections import namedtuple
+import requests
+from opentelemetry.context import _SUPPRESS_INSTRUMENTATION_KEY, attach, set_value
+from opentelemetry.sdk.resources import SERVICE_NAME
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+from .env import env_float, env_str
+from .metrics import SPAN_SPOOL_BYTES, SPANS_DROPPED, SPANS_EXPORTED
+from .payload import parse_size
+
+# magic, capacity, head and tail, the offsets are logical and only grow, the
+# position in the ring is the offset modulo the capacity
+HEADER = struct.Struct("<8sQQQ")
+MAGIC = b"CLSPOOL1"
+
+# the length of the encoded batch and the number of spans in it
+RECORD = struct.Struct("<II")
+
+# a spooled batch, offset is where it starts in the ring
+SpoolRecord = namedtuple("SpoolRecord", ["offset", "data", "spans"])
+
+logger = logging.getLogger(__name__)
+
+
+class SpanSpool:
+    """
+    A bounded ring of encoded span batches in a memory-mapped file
+    """
+
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # raises BlockingIOError if another worker has the file
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if os.fstat(self._fd).st_size != HEADER.size + capacity:
+                os.ftruncate(self._fd, HEADER.size + capacity)
+            self._map = mmap.mmap(self._fd, HEADER.size + capacity)
+        except OSError:
+            os.close(self._fd)
+            raise
+        self._lock = threading.Lock()
+
+        # carry on from a spool that was left behind, unless it was made for
+        # a different size
+        magic, spooled_capacity, head, tail = HEADER.unpack_from(self._map)
+        if magic == MAGIC and spooled_capacity == capacity and tail <= head:
+            self.head, self.tail = head, tail
+        else:
+            self.head = self.tail = 0
+            self._store_header()
+
+    @classmethod
+    def open(cls, directory, capacity):
+        """
+        Open the first spool file in the directory that isn't in use
+        """
+        os.makedirs(directory, exist_ok=True)
+        for index in itertools.count():
+            try:
+                return cls(os.path.join(directory, f"spans-{index}.spool"), capacity)
+            except BlockingIOError:
+                continue
+
+    @property
+    def used(self):
+        """
+        Bytes of the ring that hold spooled records
+        """
+        return self.head - self.tail
+
+    def _store_header(self):
+        HEADER.pack_into(self._map, 0, MAGIC, self.capacity, self.head, self.tail)
+
+    def _write(self, offset, data):
+        position = offset % self.capacity
+        first = min(len(data), self.capacity - position)
+        start = HEADER.size + position
+        self._map[start : start + first] = data[:first]
+        if first < len(data):
+            self._map[HEADER.size : HEADER.size + len(data) - first] = data[first:]
+
+    def _read(self, offset, length):
+        position = offset % self.capacity
+        first = min(length, self.capacity - position)
+        start = HEADER.size + position
+        data = self._map[start : start + first]
+        if first < length:
+            data += self._map[HEADER.size : HEADER.size + length - first]
+        return data
+
+    def append(self, data, spans):
+        """
+        Add a batch of encoded spans to the spool, returns the number of spans
+        dropped to make room for it
+        """
+        size = RECORD.size + len(data)
+        if size > self.capacity:
+            return spans
+        dropped = 0
+        with self._lock:
+            while self.capacity - self.used < size:
+                length, count = RECORD.unpack(self._read(self.tail, RECORD.size))
+                self.tail += RECORD.size + length
+                dropped += count
+            self._write(self.head, RECORD.pack(len(data), spans) + data)
+            # the header is only moved on once the record is in place
+            self.head += size
+            self._store_header()
+        return dropped
+
+    def peek(self):
+        """
+        Get the oldest record, or None if the spool is empty
+        """
+        with self._lock:
+            if self.head == self.tail:
+                return None
+            length, spans = RECORD.unpack(self._read(self.tail, RECORD.size))
+            data = self._read(self.tail + RECORD.size, length)
+            return SpoolRecord(self.tail, data, spans)
+
+    def pop(self, record):
+        """
+        Remove a record that has been sent, unless it was already dropped to
+        make room
+        """
+        with self._lock:
+            if self.tail == record.offset:
+                self.tail += RECORD.size + len(record.data)
+                self._store_header()
+
+    def close(self):
+        """
+        Unmap and unlock the file
+        """
+        self._map.close()
+        os.close(self._fd)
+
+
+class SpoolingSpanExporter(SpanExporter):
+    """
+    Wraps a Zipkin exporter to spool the batches it is given, and sends them
+    on from a drainer thread with the exporter's encoder, session and
+    endpoint
+    """
+
+    def __init__(self, span_exporter, directory, capacity, max_backoff=30.0):
+        self.span_exporter = span_exporter
+        self.directory = directory
+        self.capacity = capacity
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._pid = None
+        self._spool = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_env(cls, span_exporter):
+        """
+        Create a SpoolingSpanExporter from CHAIN_LINK_TRACE_SPOOL_DIR,
+        CHAIN_LINK_TRACE_SPOOL_BYTES and CHAIN_LINK_TRACE_SPOOL_MAX_BACKOFF
+        """
+        return cls(
+            span_exporter,
+            directory=env_str("CHAIN_LINK_TRACE_SPOOL_DIR", "/tmp/chain-link-spool"),
+            capacity=parse_size(env_str("CHAIN_LINK_TRACE_SPOOL_BYTES", "64MiB")),
+            max_backoff=env_float("CHAIN_LINK_TRACE_SPOOL_MAX_BACKOFF", 30.0),
+        )
+
+    def spool(self):
+        """
+        The spool of this worker, opened along with its drainer the first time
+        it is used, since neither survives a fork
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._spool = SpanSpool.open(self.directory, self.capacity)
+                    self._stop.clear()
+                    threading.Thread(
+                        target=self._drain,
+                        args=(self._spool,),
+                        name="chain-link-span-spool",
+                        daemon=True,
+                    ).start()
+                    self._pid = os.getpid()
+        return self._spool
+
+    def export(self, spans):
+        if not spans:
+            return SpanExportResult.SUCCESS
+        spool = self.spool()
+        exporter = self.span_exporter
+        service_name = spans[0].resource.attributes.get(SERVICE_NAME)
+        if service_name:
+            exporter.local_node.service_name = service_name
+        data = exporter.encoder.serialize(spans, exporter.local_node)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        dropped = spool.append(data, len(spans))
+        if dropped:
+            SPANS_DROPPED.labels("spool_full").inc(dropped)
+        SPAN_SPOOL_BYTES.set(spool.used)
+        self._wake.set()
+        return SpanExportResult.SUCCESS
+
+    def _send(self, record):
+        exporter = self.span_exporter
+        try:
+            response = exporter.session.post(
+                url=exporter.endpoint, data=record.data, timeout=exporter.timeout
+            )
+        except requests.RequestException as esc:
+            return esc
+        if response.status_code not in (200, 202):
+            return f"status code {response.status_code}"
+        return None
+
+    def _drain(self, spool):
+        # the posts to the collector must not be traced themselves
+        attach(set_value(_SUPPRESS_INSTRUMENTATION_KEY, True))
+        backoff = 0.0
+        while not self._stop.is_set():
+            record = spool.peek()
+            if record is None:
+                self._wake.wait(1.0)
+                self._wake.clear()
+                continue
+
+            error = self._send(record)
+            if error is None:
+                spool.pop(record)
+                SPANS_EXPORTED.inc(record.spans)
+                SPAN_SPOOL_BYTES.set(spool.used)
+                if backoff:
+                    logger.info("Sending spooled spans again")
+                backoff = 0.0
+                continue
+
+            if not backoff:
+                logger.warning("Spooling spans, unable to send them: %s", error)
+            backoff = min(self.max_backoff, backoff * 2 or 0.5)
+            # jitter keeps the workers of all the links from retrying at once
+            self._stop.wait(random.uniform(backoff / 2, backoff))
+
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
+        self.span_exporter.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+        return True
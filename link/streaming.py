@@ -0,0 +1,67 @@
+"""
+Passing the response of the next hop straight back to the caller, a chunk at
+a time, instead of reading and decoding all of it first
+"""
+
+from .env import env_bool, env_str
+from .payload import parse_size
+
+# headers that are about one connection and must not be passed along
+# https://www.rfc-editor.org/rfc/rfc9110#section-7.6.1
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "proxy-connection",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+
+# headers the server of this hop sets itself
+SERVER_HEADERS = {"date", "server"}
+
+
+class StreamSettings:
+    """
+    Whether responses are streamed through, and in what size chunks
+    """
+
+    def __init__(self, enabled=False, chunk_size=64 * 1024):
+        self.enabled = enabled
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the settings from CHAIN_LINK_STREAM and
+        CHAIN_LINK_STREAM_CHUNK_BYTES
+        """
+        return cls(
+            enabled=env_bool("CHAIN_LINK_STREAM", False),
+            chunk_size=parse_size(env_str("CHAIN_LINK_STREAM_CHUNK_BYTES", "64KiB")),
+        )
+
+
+def pass_through_headers(headers):
+    """
+    The headers of the next hop's response that can be sent on to the caller
+    """
+    return [
+        (name, value)
+        for name, value in headers.items()
+        if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() not in SERVER_HEADERS
+    ]
+
+
+def iter_raw(response, chunk_size):
+    """
+    Iterate over the undecoded body of a streamed requests response, then give
+    its connection back to the pool
+    """
+    try:
+        yield from response.raw.stream(chunk_size, decode_content=False)
+    finally:
+        response.close()
@@ -0,0 +1,184 @@
+"""
+A breakdown of where each hop spent a request, sent back up the chain in
+Server-Timing headers so the caller sees every hop without a tracing backend.
+
+Each hop adds one entry in front of the entries of the hops it called:
+
+    Server-Timing: hop;desc="chain-link-service-0";dur=3.1;proc=0.9;delay=0;wait=2.2,
+                   hop;desc="chain-link-service-1";dur=2.0;...
+
+in milliseconds, where dur is the time from receiving the request to starting
+the response, delay the injected latency, wait the time spent waiting on the
+next services and proc the rest. When a response is streamed through, the
+hop's entry is sent before the body, so dur and wait end at the next hop's
+response headers.
+"""
+
+import time
+from contextlib import contextmanager
+from .env import env_bool, env_int
+
+SERVER_TIMING = "Server-Timing"
+
+# the most entries passed back up, each is about 80 bytes and some clients
+# won't read more than 16KB of headers
+MAX_HOPS = 100
+
+# the key the timing of a request is kept under in the ASGI scope state
+STATE_KEY = "hop_timing"
+
+
+class ServerTimingSettings:
+    """
+    Whether the breakdown is sent, and of how many hops at most
+    """
+
+    def __init__(self, enabled=True, max_hops=MAX_HOPS):
+        self.enabled = enabled
+        self.max_hops = max_hops
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the settings from CHAIN_LINK_SERVER_TIMING and
+        CHAIN_LINK_SERVER_TIMING_MAX_HOPS
+        """
+        return cls(
+            enabled=env_bool("CHAIN_LINK_SERVER_TIMING", True),
+            max_hops=env_int("CHAIN_LINK_SERVER_TIMING_MAX_HOPS", MAX_HOPS),
+        )
+
+
+class HopTiming:
+    """
+    Times one request at this hop, and collects the entries of the next hops
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.service = None
+        self.delay = 0.0
+        self.wait = 0.0
+        self.downstream = []
+
+    @contextmanager
+    def delaying(self):
+        """
+        Count the time in the block as injected latency
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.delay += time.perf_counter() - start
+
+    @contextmanager
+    def waiting(self):
+        """
+        Count the time in the block as waiting on the next services
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.wait += time.perf_counter() - start
+
+    def add_downstream(self, value):
+        """
+        Add the Server-Timing header of a next service's response
+        """
+        if value:
+            self.downstream.append(value)
+
+    def header(self, max_hops=MAX_HOPS):
+        """
+        The Server-Timing value of this hop and the hops after it, or None if
+        the request wasn't handled by a service
+        """
+        if self.service is None:
+            return None
+        duration = time.perf_counter() - self.start
+        processing = max(0.0, duration - self.delay - self.wait)
+        entries = [
+            f'hop;desc="{self.service}";dur={duration * 1000:.3f};'
+            f"proc={processing * 1000:.3f};delay={self.delay * 1000:.3f};"
+            f"wait={self.wait * 1000:.3f}"
+        ]
+        omitted = 0
+        for value in self.downstream:
+            for entry in value.split(","):
+                entry = entry.strip()
+                if entry.startswith("omitted;"):
+                    omitted += int(parse_entry(entry).get("count", 0))
+                elif len(entries) < max_hops:
+                    entries.append(entry)
+                else:
+                    omitted += 1
+        if omitted:
+            entries.append(f"omitted;count={omitted}")
+        return ", ".join(entries)
+
+
+def parse_entry(entry):
+    """
+    The parameters of one Server-Timing entry, e.g. {"desc": ..., "dur": ...}
+    """
+    params = {}
+    for param in entry.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        params[name] = value.strip('"')
+    return params
+
+
+def parse_server_timing(value):
+    """
+    The hops in a Server-Timing header, as dicts of the service and its
+    times in milliseconds, in the order the request reached them
+    """
+    hops = []
+    for entry in (value or "").split(","):
+        entry = entry.strip()
+        if not entry.startswith("hop;"):
+            continue
+        params = parse_entry(entry)
+        hop = {"service": params.pop("desc", "")}
+        for name, time_ms in params.items():
+            try:
+                hop[name] = float(time_ms)
+            except ValueError:
+                continue
+        hops.append(hop)
+    return hops
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that times each request of the async app and sends the
+    breakdown of its hops with the response
+    """
+
+    def __init__(self, app, settings):
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.settings.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        timing = scope.setdefault("state", {})[STATE_KEY] = HopTiming()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                value = timing.header(self.settings.max_hops)
+                if value is not None:
+                    headers = [
+                        (name, header_value)
+                        for name, header_value in message.get("headers", [])
+                        if name.lower() != b"server-timing"
+                    ]
+                    headers.append((b"server-timing", value.encode("latin-1")))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
@@ -0,0 +1,158 @@
+"""
+The shape of the chain: which services each service forwards requests to.
+
+The services config is either a plain list of services, which is a linear
+chain, or an object with a "graph" of each service's children, e.g.
+
+    {
+        "services": ["svc-0", "svc-1", "svc-2", "svc-3"],
+        "graph": {
+            "svc-0": ["svc-1", "svc-2"],
+            "svc-1": ["svc-3"],
+            "svc-2": ["svc-3"]
+        }
+    }
+
+which must be a DAG. An object without a "graph" is a linear chain of its
+"services".
+"""
+
+
+class TopologyError(ValueError):
+    """
+    Raised for a services config that isn't a usable DAG
+    """
+
+
+class Topology:
+    """
+    The services and the precomputed adjacency of the chain
+    """
+
+    def __init__(self, services, graph):
+        self.services = list(services)
+        self.children = {name: tuple(graph.get(name, ())) for name in self.services}
+        self.entry = self.services[0] if self.services else None
+        self.validate()
+
+    @classmethod
+    def from_config(cls, services_config):
+        """
+        Create the topology from the parsed services.json
+        """
+        if isinstance(services_config, list):
+            return cls.chain(services_config)
+
+        graph = services_config.get("graph")
+        services = services_config.get("services")
+        if graph is None:
+            return cls.chain(services or [])
+        if services is None:
+            # every service in the graph, in the order they first show up
+            services = list(
+                dict.fromkeys(
+                    name
+                    for parent, children in graph.items()
+                    for name in (parent, *children)
+                )
+            )
+        return cls(services, graph)
+
+    @classmethod
+    def chain(cls, services):
+        """
+        A linear chain where each service forwards to the one after it
+        """
+        return cls(
+            services, {parent: [child] for parent, child in zip(services, services[1:])}
+        )
+
+    @classmethod
+    def tree(cls, services, fan_out):
+        """
+        A tree where each service forwards to the next fan_out services, in
+        breadth first order
+        """
+        if fan_out < 1:
+            raise TopologyError("The fan out must be at least 1")
+        graph = {}
+        for i, service in enumerate(services):
+            first_child = i * fan_out + 1
+            graph[service] = services[first_child : first_child + fan_out]
+        return cls(services, graph)
+
+    def calls(self, svc_name=None):
+        """
+        How many requests one request to svc_name makes the services handle,
+        itself included. A service reached along two paths is called twice.
+        """
+        svc_name = svc_name or self.entry
+        if svc_name not in self.children:
+            return 0
+        # count the children of a service before the service itself
+        counts = {}
+        stack = [svc_name]
+        while stack:
+            service = stack[-1]
+            pending = [child for child in self.children[service] if child not in counts]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            counts[service] = 1 + sum(counts[child] for child in self.children[service])
+        return counts[svc_name]
+
+    def validate(self):
+        """
+        Check every child is a known service and that there are no cycles
+        """
+        for parent, children in self.children.items():
+            unknown = [child for child in children if child not in self.children]
+            if unknown:
+                raise TopologyError(f"{parent} forwards to unknown services {unknown}")
+
+        # depth first search, a service seen again while it is still on the
+        # stack closes a cycle
+        visiting, done = set(), set()
+        for root in self.services:
+            if root in done:
+                continue
+            stack = [(root, iter(self.children[root]))]
+            visiting.add(root)
+            while stack:
+                parent, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    stack.pop()
+                    visiting.discard(parent)
+                    done.add(parent)
+                elif child in visiting:
+                    raise TopologyError(f"{parent} -> {child} makes a cycle")
+                elif child not in done:
+                    visiting.add(child)
+                    stack.append((child, iter(self.children[child])))
+
+    def __len__(self):
+        return len(self.services)
+
+    def __contains__(self, svc_name):
+        return svc_name in self.children
+
+    def next_services(self, svc_name):
+        """
+        The services that svc_name forwards requests to
+        """
+        return self.children.get(svc_name, ())
+
+    def to_config(self):
+        """
+        The services config for this topology, as written to the configmap
+        """
+        return {
+            "services": self.services,
+            "graph": {
+                parent: list(children)
+                for parent, children in self.children.items()
+                if children
+            },
+        }
@@ -0,0 +1,245 @@
+"""
+OpenTelemetry setup shared by the sync and async apps, sending spans to Zipkin
+or an OTLP collector.
+
+The exporter is picked with CHAIN_LINK_TRACE_EXPORTER:
+
+    zipkin_json   Zipkin v2 JSON, the default
+    zipkin_proto  Zipkin v2 protobuf, smaller to send than JSON
+    otlp_http     OTLP protobuf over HTTP
+    none          nothing, spans are made and batched but thrown away
+
+and where it sends to with CHAIN_LINK_TRACE_ENDPOINT. The batching is tuned
+with the standard OTEL_BSP_MAX_QUEUE_SIZE, OTEL_BSP_MAX_EXPORT_BATCH_SIZE,
+OTEL_BSP_SCHEDULE_DELAY and OTEL_BSP_EXPORT_TIMEOUT env vars. With
+CHAIN_LINK_TRACE_SPOOL the Zipkin exporters spool spans to disk first, see
+spool.py.
+
+The thread of the batch span processor, and the connections of its exporter,
+don't survive a fork. Each worker process builds its own processor and
+exporter the first time it ends a span, so the app can be imported once by
+gunicorn and forked into its workers. The tracer provider is shared, it only
+holds the sampler and the processors.
+"""
+
+import os
+import threading
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+from opentelemetry.exporter.zipkin.json import ZipkinExporter
+from opentelemetry.exporter.zipkin.proto.http import (
+    ZipkinExporter as ZipkinProtoExporter,
+)
+from .env import env_bool, env_str
+from .metrics import SPAN_QUEUE_DEPTH, SPANS_DROPPED, SPANS_EXPORTED
+from .sampling import SamplingSettings
+from .spool import SpoolingSpanExporter
+
+EXPORTERS = ("zipkin_json", "zipkin_proto", "otlp_http", "none")
+
+# this is specific to Zipkin deployed into Kubernetes with the cli.py script
+# NOTE(curtis): this is expecting a service called zipkin-service-0 listening on
+# port 80!
+ZIPKIN_ENDPOINT = "http://zipkin-service/api/v2/spans"
+
+
+class TracingError(ValueError):
+    """
+    Raised for an exporter that can't be used
+    """
+
+
+class NullSpanExporter(SpanExporter):
+    """
+    Throws spans away, to measure the cost of tracing without a collector
+    """
+
+    def export(self, spans):
+        return SpanExportResult.SUCCESS
+
+
+class ExportSettings:
+    """
+    Which exporter spans are sent with, and where to
+    """
+
+    def __init__(self, exporter="zipkin_json", endpoint=None, spool=False):
+        if exporter not in EXPORTERS:
+            raise TracingError(
+                f"Unknown exporter {exporter}, use one of {', '.join(EXPORTERS)}"
+            )
+        if spool and not exporter.startswith("zipkin"):
+            raise TracingError(f"Spans can only be spooled for Zipkin, not {exporter}")
+        self.exporter = exporter
+        self.endpoint = endpoint
+        self.spool = spool
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the settings from CHAIN_LINK_TRACE_EXPORTER,
+        CHAIN_LINK_TRACE_ENDPOINT and CHAIN_LINK_TRACE_SPOOL
+        """
+        return cls(
+            exporter=env_str("CHAIN_LINK_TRACE_EXPORTER", "zipkin_json"),
+            endpoint=env_str("CHAIN_LINK_TRACE_ENDPOINT"),
+            spool=env_bool("CHAIN_LINK_TRACE_SPOOL", False),
+        )
+
+    def create_exporter(self):
+        """
+        Create the span exporter
+        """
+        if self.exporter == "none":
+            return NullSpanExporter()
+        if self.exporter == "otlp_http":
+            # without an endpoint the exporter falls back to the OTEL_EXPORTER_OTLP_*
+            # env vars, and then localhost
+            return OTLPSpanExporter(endpoint=self.endpoint)
+        if self.exporter == "zipkin_proto":
+            span_exporter = ZipkinProtoExporter(
+                endpoint=self.endpoint or ZIPKIN_ENDPOINT
+            )
+        else:
+            span_exporter = ZipkinExporter(endpoint=self.endpoint or ZIPKIN_ENDPOINT)
+        if self.spool:
+            return SpoolingSpanExporter.from_env(span_exporter)
+        return span_exporter
+
+
+class CountingSpanExporter(SpanExporter):
+    """
+    Counts the spans an exporter sent or lost, and the spans left in the
+    queue of the processor after each batch. A spooling exporter counts the
+    spans it sent itself, later.
+    """
+
+    def __init__(self, span_exporter, span_processor):
+        self.span_exporter = span_exporter
+        self.span_processor = span_processor
+        self.count_exported = not isinstance(span_exporter, SpoolingSpanExporter)
+
+    def export(self, spans):
+        try:
+            result = self.span_exporter.export(spans)
+        except Exception:
+            SPANS_DROPPED.labels("export_failed").inc(len(spans))
+            raise
+        finally:
+            SPAN_QUEUE_DEPTH.set(len(self.span_processor.queue))
+        if result is SpanExportResult.SUCCESS:
+            if self.count_exported:
+                SPANS_EXPORTED.inc(len(spans))
+        else:
+            SPANS_DROPPED.labels("export_failed").inc(len(spans))
+        return result
+
+    def shutdown(self):
+        self.span_exporter.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+        return self.span_exporter.force_flush(timeout_millis)
+
+
+class CountingBatchSpanProcessor(BatchSpanProcessor):
+    """
+    A BatchSpanProcessor that counts the spans it drops when its queue is
+    full, instead of only warning about the first one
+    """
+
+    def __init__(self, span_exporter, **kwargs):
+        super().__init__(CountingSpanExporter(span_exporter, self), **kwargs)
+
+    def on_end(self, span):
+        if span.context.trace_flags.sampled and not self.done:
+            # the queue is a bounded deque, so a full queue pushes out the
+            # oldest span
+            if len(self.queue) >= self.max_queue_size:
+                SPANS_DROPPED.labels("queue_full").inc()
+        super().on_end(span)
+        SPAN_QUEUE_DEPTH.set(len(self.queue))
+
+
+class ForkSafeSpanProcessor(SpanProcessor):
+    """
+    Builds the span processor, and so its exporter, once per process, since
+    neither survives a fork
+    """
+
+    def __init__(self, create_processor):
+        self.create_processor = create_processor
+        self._lock = threading.Lock()
+        self._pid = None
+        self._processor = None
+
+    @property
+    def processor(self):
+        """
+        The span processor of this process
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._processor = self.create_processor()
+                    self._pid = os.getpid()
+        return self._processor
+
+    def post_fork(self):
+        """
+        Build the processor of a forked worker now, rather than on its first
+        request
+        """
+        return self.processor
+
+    def on_start(self, span, parent_context=None):
+        self.processor.on_start(span, parent_context=parent_context)
+
+    def on_end(self, span):
+        self.processor.on_end(span)
+
+    def shutdown(self):
+        # a process that never traced anything has nothing to flush
+        if self._pid == os.getpid():
+            self._processor.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+        if self._pid != os.getpid():
+            return True
+        return self._processor.force_flush(timeout_millis)
+
+
+def setup_tracing(service_name, sampling=None, export=None):
+    """
+    Configure the global TracerProvider to sample traces and batch their spans
+    out to the collector
+    """
+    if sampling is None:
+        sampling = SamplingSettings.from_env()
+    if export is None:
+        export = ExportSettings.from_env()
+    trace.set_tracer_provider(
+        TracerProvider(
+            resource=Resource.create({"service.name": service_name}),
+            sampler=sampling.get_sampler(),
+        )
+    )
+
+    # batch the spans up, the size of the batches and the queue are set with
+    # the OTEL_BSP_* env vars
+    span_processor = ForkSafeSpanProcessor(
+        lambda: sampling.wrap_span_processor(
+            CountingBatchSpanProcessor(export.create_exporter())
+        )
+    )
+
+    # add to the tracer
+    trace.get_tracer_provider().add_span_processor(span_processor)
+
+    return span_processor
@@ -0,0 +1,60 @@
+"""
+How a chain link talks to its next hop.
+
+With CHAIN_LINK_TRANSPORT=http1, the default, a request to a next service
+takes a keep-alive connection out of the pool for as long as it is in
+flight, so a link holds as many connections to a next service as it has
+requests in flight to it.
+
+With http2 the async app calls its next services over cleartext HTTP/2, with
+prior knowledge (h2c), and every request in flight to a next service is a
+stream on one long-lived connection per worker. A link that accepts HTTP/2
+can't be run by gunicorn, whose workers only speak HTTP/1.1, so it is run by
+hypercorn with hypercorn.conf.py, which still answers the load generator and
+the probes over HTTP/1.1. requests has no HTTP/2, so the sync app can't use
+it. The trace context is passed on in the same headers either way.
+
+CHAIN_LINK_H2_MAX_STREAMS is how many streams a link lets a caller have open
+on one connection at once, past which the caller opens another connection.
+"""
+
+from .env import env_int, env_str
+
+TRANSPORTS = ("http1", "http2")
+
+
+class TransportSettings:
+    """
+    Whether a chain link talks HTTP/1.1 or HTTP/2 to its next hop
+    """
+
+    def __init__(self, transport="http1", max_streams=100):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"The transport has to be http1 or http2, not {transport}")
+        self.transport = transport
+        self.max_streams = max_streams
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the settings from CHAIN_LINK_TRANSPORT and
+        CHAIN_LINK_H2_MAX_STREAMS
+        """
+        return cls(
+            transport=env_str("CHAIN_LINK_TRANSPORT", "http1"),
+            max_streams=env_int("CHAIN_LINK_H2_MAX_STREAMS", 100),
+        )
+
+    @property
+    def http2(self):
+        """
+        Whether the next hop is called over HTTP/2
+        """
+        return self.transport == "http2"
+
+    def client_options(self):
+        """
+        The httpx client options of the transport, HTTP/2 without falling back
+        to HTTP/1.1, which is how httpx speaks h2c to an http:// URL
+        """
+        return {"http1": not self.http2, "http2": self.http2}
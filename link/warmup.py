@@ -0,0 +1,262 @@
+"""
+Warming a worker up before it reports ready, so the first requests after a
+rollout don't pay for what a worker does only once.
+
+Each worker, once it has started or been forked, builds its span processor and exporter,
+and opens CHAIN_LINK_WARMUP_CONNECTIONS pooled keep-alive connections to
+each of its next services by calling their /readiness. That resolves their
+names and connects to them, and the connections are left in the pool for
+the first requests. Any response will do, a next hop that is still warming
+up itself answers with a 503 over a connection that is just as good. A next
+service that can't be reached is tried again every RETRY_INTERVAL seconds.
+
+/readiness answers 503 until the worker is warm, or CHAIN_LINK_WARMUP_TIMEOUT
+seconds after it started, so a next service that is down doesn't keep the
+link out of its service forever. CHAIN_LINK_WARMUP=false turns this off.
+
+How long each phase of starting up took is logged, served with /readiness
+and kept in chain_link_startup_seconds, by phase:
+
+    init     setting the app up once its modules were imported
+    tracing  building the span processor and exporter
+    connect  opening the connections to the next services
+    ready    from the start of the warmup until the worker was ready
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from opentelemetry import context
+from opentelemetry.instrumentation.utils import _SUPPRESS_INSTRUMENTATION_KEY
+from .autosize import preloading
+from .env import env_bool, env_float, env_int
+from .metrics import STARTUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# seconds between attempts to reach a next service that isn't up yet
+RETRY_INTERVAL = 0.2
+
+# seconds to wait for one warmup request
+CONNECT_TIMEOUT = 1.0
+
+
+class WarmupSettings:
+    """
+    Whether a worker warms up before it is ready, with how many connections
+    to each next service, and for how long at most
+    """
+
+    def __init__(self, enabled=True, timeout=10.0, connections=2):
+        self.enabled = enabled
+        self.timeout = timeout
+        self.connections = connections
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the settings from CHAIN_LINK_WARMUP, CHAIN_LINK_WARMUP_TIMEOUT
+        and CHAIN_LINK_WARMUP_CONNECTIONS, which is at most the pool size
+        """
+        return cls(
+            enabled=env_bool("CHAIN_LINK_WARMUP", True),
+            timeout=env_float("CHAIN_LINK_WARMUP_TIMEOUT", 10.0),
+            connections=min(
+                env_int("CHAIN_LINK_WARMUP_CONNECTIONS", 2),
+                env_int("CHAIN_LINK_POOL_SIZE", 10),
+            ),
+        )
+
+
+class StartupTimer:
+    """
+    How long each phase of starting a worker took, in seconds
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+
+    def record(self, phase, seconds):
+        """
+        Record how long a phase took
+        """
+        self.phases[phase] = round(seconds, 6)
+        STARTUP_SECONDS.labels(phase).set(seconds)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time the phase run in the with block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def since_start(self, phase):
+        """
+        Record a phase that lasted from when the timer was created until now
+        """
+        self.record(phase, time.perf_counter() - self.start)
+
+
+@contextmanager
+def untraced():
+    """
+    Don't trace the warmup requests, they aren't part of any chain
+    """
+    token = context.attach(context.set_value(_SUPPRESS_INSTRUMENTATION_KEY, True))
+    try:
+        yield
+    finally:
+        context.detach(token)
+
+
+class Warmup:
+    """
+    Warms a worker up once, and tells whether it is ready
+    """
+
+    def __init__(self, settings, timer=None):
+        self.settings = settings
+        self.timer = timer or StartupTimer()
+        self.done = threading.Event()
+        self._pid = None
+        self._started = None
+        if not settings.enabled:
+            self.done.set()
+
+    @classmethod
+    def from_env(cls, timer=None):
+        """
+        Create a Warmup with the settings from the CHAIN_LINK_WARMUP* env vars
+        """
+        return cls(WarmupSettings.from_env(), timer)
+
+    def ready(self):
+        """
+        Whether the worker is warm, or has tried to be for long enough
+        """
+        if self.done.is_set():
+            return True
+        return (
+            self._started is not None
+            and time.perf_counter() - self._started > self.settings.timeout
+        )
+
+    def _begin(self):
+        # once per worker process, a forked worker starts all over again, and
+        # never in the gunicorn master that preloads the app and doesn't
+        # serve it, its connections would be thrown away
+        if self._pid == os.getpid() or preloading():
+            return False
+        self._pid = os.getpid()
+        self._started = time.perf_counter()
+        if self.settings.enabled:
+            self.done.clear()
+        return True
+
+    def _finish(self, services, pending):
+        self.timer.record("ready", time.perf_counter() - self._started)
+        self.done.set()
+        if pending:
+            logger.warning(
+                "Ready without connections to %s, they couldn't be reached",
+                ", ".join(sorted(pending)),
+            )
+        logger.info(
+            "Warmed up %s connections to %s: %s",
+            self.settings.connections,
+            ", ".join(services) or "no next services",
+            ", ".join(
+                f"{name} {seconds:.3f}s" for name, seconds in self.timer.phases.items()
+            ),
+        )
+
+    def start(self, services, connect, prime=None):
+        """
+        Warm up in a background thread: call prime(), then connect(service)
+        connections times at once for each of the next services, until each
+        of them has answered or the warmup timed out
+        """
+        if not self._begin() or not self.settings.enabled:
+            return
+        threading.Thread(
+            target=self._run,
+            args=(list(services), connect, prime),
+            name="chain-link-warmup",
+            daemon=True,
+        ).start()
+
+    def _run(self, services, connect, prime):
+        if prime is not None:
+            with self.timer.phase("tracing"):
+                prime()
+
+        pending = set(services)
+        with self.timer.phase("connect"):
+            threads = []
+            for service in services:
+                for _ in range(self.settings.connections):
+                    thread = threading.Thread(
+                        target=self._connect, args=(service, connect, pending)
+                    )
+                    thread.start()
+                    threads.append(thread)
+            for thread in threads:
+                thread.join()
+        self._finish(services, pending)
+
+    def _connect(self, service, connect, pending):
+        with untraced():
+            while not self.ready():
+                try:
+                    connect(service)
+                except Exception as exc:
+                    logger.debug(
+                        "Unable to warm up a connection to %s: %s", service, exc
+                    )
+                    time.sleep(RETRY_INTERVAL)
+                else:
+                    pending.discard(service)
+                    return
+
+    async def run_async(self, services, connect, prime=None):
+        """
+        Warm up on the event loop like start does, awaiting connect(service)
+        """
+        if not self._begin() or not self.settings.enabled:
+            return
+        if prime is not None:
+            with self.timer.phase("tracing"):
+                prime()
+
+        pending = set(services)
+
+        async def warm(service):
+            while not self.ready():
+                try:
+                    await connect(service)
+                except Exception as exc:
+                    logger.debug(
+                        "Unable to warm up a connection to %s: %s", service, exc
+                    )
+                    await asyncio.sleep(RETRY_INTERVAL)
+                else:
+                    pending.discard(service)
+                    return
+
+        with self.timer.phase("connect"), untraced():
+            await asyncio.gather(
+                *(
+                    warm(service)
+                    for service in services
+                    for _ in range(self.settings.connections)
+                )
+            )
+        self._finish(services, pending)
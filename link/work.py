@@ -0,0 +1,234 @@
+"""
+Work a link does on a request besides sleeping, so a chain can be made to
+use CPU and memory and show GIL contention, CPU saturation and allocator
+pressure.
+
+The work is set per service in the "work" section of the services.json, e.g.
+
+    "work": {
+        "chain-link-service-2": {"cpu": {"units": 200}},
+        "chain-link-service-3": {
+            "cpu": {"units": 50, "release_gil": true},
+            "alloc": {"bytes": "64KiB", "count": 16, "lifetime": 2},
+            "probability": 0.5,
+            "ballast": "256MiB"
+        }
+    }
+
+or with CHAIN_LINK_WORK for the pod's own service.
+
+"cpu" is units of hashing, each about a tenth of a millisecond of a CPU. A
+unit holds the GIL, as a loop of small SHA-256 rounds in Python, so the
+threads of a worker take turns at it. With "release_gil" a unit hashes a
+64KiB block instead, which hashlib does without the GIL, like NumPy vector
+math, so the threads of a worker can keep more than one CPU busy. In async
+mode the work blocks the event loop, as CPU-bound code in a handler would.
+
+"alloc" allocates "count" buffers of "bytes" on each request and keeps them
+for "lifetime" seconds, so that later requests free them, with at most
+"max_bytes" of them held by a worker. "ballast" is memory each worker of the
+pod's own service allocates once and keeps resident.
+
+Whether a request does the work, with "probability", and what it hashes are
+drawn from its trace ID, like the injected latency, so a run can be replayed.
+"""
+
+import os
+import time
+import random
+import hashlib
+import threading
+from collections import deque
+from .env import get_service_specs
+from .metrics import WORK_BALLAST_BYTES, WORK_DURATION
+from .payload import parse_size
+
+# SHA-256 rounds of a unit that holds the GIL, and the block a unit that
+# releases it hashes, hashlib lets go of the GIL for more than 2047 bytes
+ROUNDS_PER_UNIT = 64
+BLOCK_BYTES = 64 * 1024
+
+
+class WorkPolicy:
+    """
+    The CPU and memory one service uses on each request, and the memory it
+    keeps
+    """
+
+    def __init__(
+        self,
+        cpu_units=0,
+        release_gil=False,
+        probability=1.0,
+        alloc_bytes=0,
+        alloc_count=1,
+        alloc_lifetime=0.0,
+        alloc_max_bytes="256MiB",
+        ballast=0,
+    ):
+        if cpu_units < 0 or alloc_count < 0 or alloc_lifetime < 0:
+            raise ValueError("The work of a service can't be below 0")
+        self.cpu_units = cpu_units
+        self.release_gil = release_gil
+        self.probability = probability
+        self.alloc_bytes = parse_size(alloc_bytes)
+        self.alloc_count = alloc_count
+        self.alloc_lifetime = alloc_lifetime
+        self.alloc_max_bytes = parse_size(alloc_max_bytes)
+        self.ballast = parse_size(ballast)
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Create a policy from a work config block
+        """
+        cpu = spec.get("cpu", {})
+        alloc = spec.get("alloc", {})
+        return cls(
+            cpu_units=int(cpu.get("units", 0)),
+            release_gil=bool(cpu.get("release_gil", False)),
+            probability=float(spec.get("probability", 1.0)),
+            alloc_bytes=alloc.get("bytes", 0),
+            alloc_count=int(alloc.get("count", 1)),
+            alloc_lifetime=float(alloc.get("lifetime", 0.0)),
+            alloc_max_bytes=alloc.get("max_bytes", "256MiB"),
+            ballast=spec.get("ballast", 0),
+        )
+
+    @property
+    def enabled(self):
+        """
+        Whether the service does any work on a request
+        """
+        return bool(self.cpu_units or (self.alloc_bytes and self.alloc_count))
+
+
+class WorkProfiles:
+    """
+    Looks up the WorkPolicy of a service, and knows the ballast of this pod's
+    service
+    """
+
+    def __init__(self, policies, default_policy, ballast=0):
+        self.policies = policies
+        self.default_policy = default_policy
+        self.ballast = ballast
+
+    @classmethod
+    def from_config(cls, services_config, service_name):
+        """
+        Build the policies from the "work" section of the services config,
+        with CHAIN_LINK_WORK overriding the policy of this pod's service
+        """
+        section = get_service_specs(
+            services_config, "work", "CHAIN_LINK_WORK", service_name
+        )
+        default_policy = WorkPolicy.from_spec(section.pop("default", {}))
+        policies = {name: WorkPolicy.from_spec(spec) for name, spec in section.items()}
+        ballast = policies.get(service_name, default_policy).ballast
+        return cls(policies, default_policy, ballast)
+
+    def policy(self, service):
+        """
+        Get the policy for a service
+        """
+        return self.policies.get(service, self.default_policy)
+
+
+def burn(units, seed, release_gil=False, block=None):
+    """
+    Hash for units of work starting from seed, and return the digest
+    """
+    digest = seed
+    if release_gil:
+        for _ in range(units):
+            hasher = hashlib.sha256(digest)
+            hasher.update(block)
+            digest = hasher.digest()
+        return digest
+    for _ in range(units * ROUNDS_PER_UNIT):
+        digest = hashlib.sha256(digest).digest()
+    return digest
+
+
+class Work:
+    """
+    Does the work of the services for a worker, and keeps the memory it holds
+    on to: the allocations still alive and the ballast
+    """
+
+    def __init__(self):
+        self.block = random.Random(BLOCK_BYTES).randbytes(BLOCK_BYTES)
+        self.retained_bytes = 0
+        self._retained = deque()
+        self._ballast = b""
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def hold_ballast(self, size):
+        """
+        Keep size bytes resident in this worker, allocated again after a fork
+        so every worker has its own rather than pages shared with its parent
+        """
+        if len(self._ballast) == size and self._pid == os.getpid():
+            return
+        with self._lock:
+            if len(self._ballast) != size or self._pid != os.getpid():
+                # freed before the new one is made, so a resize doesn't
+                # briefly hold both
+                self._ballast = b""
+                # filling the bytes touches every page, so they are resident
+                self._ballast = b"\x5a" * size
+                self._pid = os.getpid()
+                WORK_BALLAST_BYTES.set(size)
+
+    def _allocate(self, policy, rng):
+        fill = bytes([rng.randrange(1, 256)])
+        buffers = [fill * policy.alloc_bytes for _ in range(policy.alloc_count)]
+        if not policy.alloc_lifetime:
+            return
+        now = time.monotonic()
+        size = policy.alloc_bytes * policy.alloc_count
+        with self._lock:
+            self._retained.append((now + policy.alloc_lifetime, size, buffers))
+            self.retained_bytes += size
+            # the oldest go first, when they have lived long enough or there
+            # are too many
+            while self._retained and (
+                self._retained[0][0] <= now
+                or self.retained_bytes > policy.alloc_max_bytes
+            ):
+                _, freed, _ = self._retained.popleft()
+                self.retained_bytes -= freed
+
+    def run(self, profiles, service, trace_id=0):
+        """
+        Do the work of service for the request of trace_id, and hold the
+        ballast of this pod's service. Returns the seconds it took.
+        """
+        self.hold_ballast(profiles.ballast)
+        policy = profiles.policy(service)
+        if not policy.enabled:
+            return 0.0
+
+        # the same work for every run of a trace through a service
+        if trace_id:
+            rng = random.Random(f"{trace_id:032x}:{service}:work")
+        else:
+            rng = random.Random()
+        if policy.probability < 1 and rng.random() >= policy.probability:
+            return 0.0
+        start = time.perf_counter()
+        if policy.cpu_units:
+            burn(policy.cpu_units, rng.randbytes(32), policy.release_gil, self.block)
+        if policy.alloc_bytes and policy.alloc_count:
+            self._allocate(policy, rng)
+        elapsed = time.perf_counter() - start
+        WORK_DURATION.labels(service).observe(elapsed)
+        return elapsed
+
+    def stats(self):
+        """
+        The memory the work holds in this worker
+        """
+        return {"ballast": len(self._ballast), "retained": self.retained_bytes}
@@ -0,0 +1,102 @@
+import unittest
+import asyncio
+import threading
+from link.admission import (
+    AdmissionController,
+    AdmissionSettings,
+    AIMDLimit,
+    GradientLimit,
+)
+
+
+def controller(**kwargs):
+    return AdmissionController(AdmissionSettings(**kwargs))
+
+
+class TestAdmission(unittest.TestCase):
+    def test_invalid_limit(self):
+        with self.assertRaises(ValueError):
+            AdmissionSettings(max_in_flight=1, limit="vegas")
+
+    def test_sheds_over_limit(self):
+        admission = controller(max_in_flight=2)
+        first, second = admission.acquire(), admission.acquire()
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertIsNone(admission.acquire())
+
+        first.respond(200)
+        admission.release(first)
+        self.assertIsNotNone(admission.acquire())
+
+    def test_rejection(self):
+        message, status, headers = controller(max_in_flight=1, retry_after=3).rejection(
+            "service-a"
+        )
+        self.assertEqual(status, 503)
+        self.assertEqual(headers, {"Retry-After": "3"})
+        self.assertIn("service-a", message["message"])
+
+    def test_queue(self):
+        admission = controller(max_in_flight=1, queue=1, queue_timeout=2)
+        ticket = admission.acquire()
+        waited = []
+        waiter = threading.Thread(target=lambda: waited.append(admission.acquire()))
+        waiter.start()
+        # wait for the second request to be queued, a third is shed
+        while admission._waiting == 0:
+            pass
+        self.assertIsNone(admission.acquire())
+
+        admission.release(ticket)
+        waiter.join()
+        self.assertIsNotNone(waited[0])
+        self.assertEqual(admission.in_flight, 1)
+
+    def test_queue_timeout(self):
+        admission = controller(max_in_flight=1, queue=1, queue_timeout=10)
+        admission.acquire()
+        # the deadline is sooner than the queue timeout
+        self.assertIsNone(admission.acquire(remaining=0.01))
+
+    def test_async_queue(self):
+        admission = controller(max_in_flight=1, queue=1, queue_timeout=2)
+
+        async def run():
+            ticket = await admission.acquire_async()
+            waiter = asyncio.ensure_future(admission.acquire_async())
+            await asyncio.sleep(0)
+            shed = await admission.acquire_async()
+            admission.release(ticket)
+            return shed, await waiter
+
+        shed, admitted = asyncio.run(run())
+        self.assertIsNone(shed)
+        self.assertIsNotNone(admitted)
+        self.assertEqual(admission.in_flight, 1)
+
+    def test_aimd(self):
+        limit = AIMDLimit(10, target=0.1)
+        limit.update(0.5, False, 10)
+        self.assertEqual(limit.value, 9)
+        limit.update(0.01, True, 9)
+        self.assertAlmostEqual(limit.value, 8.1)
+        limit.update(0.01, False, 8)
+        self.assertAlmostEqual(limit.value, 9.1)
+        # no growth while the limit isn't being used
+        limit.update(0.01, False, 1)
+        self.assertAlmostEqual(limit.value, 9.1)
+
+    def test_gradient(self):
+        limit = GradientLimit(100)
+        for _ in range(50):
+            limit.update(0.01, False, 50)
+        self.assertEqual(limit.value, 100)
+        # requests start to queue
+        for _ in range(50):
+            limit.update(0.1, False, 50)
+        self.assertLess(limit.value, 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
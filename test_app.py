@@ -1,7 +1,16 @@
 import unittest
 from unittest.mock import patch, MagicMock
+import io
 import json
+import time
+import app as chain_link_app
 from app import app, get_service_urls
+from link.admission import AdmissionController, AdmissionSettings
+from link.cache import CACHE_HEADER, ResponseCaches
+from link.config import LinkConfig
+from link.deadline import DEADLINE_HEADER
+from link.hedging import ATTEMPT_HEADER, HedgeSettings, Hedger
+from link.timing import parse_server_timing
 
 
 class TestApp(unittest.TestCase):
@@ -15,16 +24,313 @@ class TestApp(unittest.TestCase):
             ["service-a", "service-b", "service-c", "service-d"]
         )
 
-        self.mock_open = patch("builtins.open", return_value=self.mock_file).start()
+        self.mock_file.__enter__.return_value = self.mock_file
+
+        self.open_patcher = patch("builtins.open", return_value=self.mock_file)
+        self.mock_open = self.open_patcher.start()
 
     def tearDown(self):
-        self.mock_open.stop()
+        self.open_patcher.stop()
 
     def test_get_service_urls(self):
         self.assertEqual(
             get_service_urls(), ["service-a", "service-b", "service-c", "service-d"]
         )
 
+    def test_fan_out(self):
+        link_config = LinkConfig(
+            {"graph": {"service-a": ["service-b", "service-c"]}}, "service-a"
+        )
+        responses = {
+            "http://service-b/forward": MagicMock(status_code=200, text="{}"),
+            "http://service-c/forward": MagicMock(status_code=200, text="{}"),
+        }
+        with patch.object(
+            chain_link_app.services_watcher, "current", link_config
+        ), patch.object(
+            link_config.latency_injector, "delay", return_value=0.0
+        ), patch.object(
+            chain_link_app.session_pool,
+            "request",
+            side_effect=lambda method, url, **kwargs: responses[url],
+        ):
+            response = self.client.get("/", headers={"X-Current-Service": "service-a"})
+
+        self.assertEqual(response.status_code, 200)
+        children = [child["service"] for child in response.get_json()["children"]]
+        self.assertEqual(children, ["service-b", "service-c"])
+
+    def test_batch(self):
+        link_config = LinkConfig({"graph": {"service-a": ["service-b"]}}, "service-a")
+        downstream = MagicMock(
+            status_code=200,
+            text=json.dumps(
+                {
+                    "items": [
+                        {"id": "0", "status": 200, "service": "service-b"},
+                        {"id": "1", "status": 504, "service": "service-b"},
+                    ]
+                }
+            ),
+            headers={},
+        )
+        with patch.object(
+            chain_link_app.services_watcher, "current", link_config
+        ), patch.object(
+            link_config.latency_injector, "delay", return_value=0.0
+        ), patch.object(
+            chain_link_app.session_pool, "request", return_value=downstream
+        ) as request:
+            response = self.client.post(
+                "/batch",
+                json={"items": [{"id": 0}, {"id": 1}]},
+                headers={"X-Current-Service": "service-a"},
+            )
+            invalid = self.client.post(
+                "/batch", data="[]", headers={"X-Current-Service": "service-a"}
+            )
+
+        # the items go down the chain in one request
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(request.call_args.args[1], "http://service-b/batch")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item["status"] for item in response.get_json()["items"]], [200, 504]
+        )
+        self.assertEqual(invalid.status_code, 400)
+
+    def test_final_link_payload(self):
+        link_config = LinkConfig(
+            {
+                "services": ["service-a"],
+                "payload": {"service-a": {"response": "300KiB"}},
+            },
+            "service-a",
+        )
+        with patch.object(
+            chain_link_app.services_watcher, "current", link_config
+        ), patch.object(link_config.latency_injector, "delay", return_value=0.0):
+            response = self.client.get("/", headers={"X-Current-Service": "service-a"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 300 * 1024)
+        self.assertEqual(response.headers["Content-Length"], str(300 * 1024))
+
+    def test_cache(self):
+        link_config = LinkConfig(
+            {
+                "graph": {"service-a": ["service-b"]},
+                "cache": {"service-a": {"ttl": 60}},
+            },
+            "service-a",
+        )
+        downstream = MagicMock(status_code=200, text="from service-b", headers={})
+        with patch.object(
+            chain_link_app.services_watcher, "current", link_config
+        ), patch.object(
+            chain_link_app, "response_caches", ResponseCaches()
+        ), patch.object(
+            link_config.latency_injector, "delay", return_value=0.0
+        ), patch.object(
+            chain_link_app.session_pool, "request", return_value=downstream
+        ) as request:
+            responses = [
+                self.client.get("/", headers={"X-Current-Service": "service-a"})
+                for _ in range(2)
+            ]
+            other = self.client.get(
+                "/?page=2", headers={"X-Current-Service": "service-a"}
+            )
+
+        self.assertEqual(
+            [response.data for response in responses], [b"from service-b"] * 2
+        )
+        self.assertEqual(
+            [response.headers[CACHE_HEADER] for response in responses], ["miss", "hit"]
+        )
+        self.assertEqual(other.headers[CACHE_HEADER], "miss")
+        self.assertEqual(request.call_count, 2)
+
+    def test_stream_next_service(self):
+        downstream = MagicMock(
+            status_code=201,
+            headers={"Content-Type": "text/plain", "Connection": "keep-alive"},
+        )
+        downstream.raw.stream.return_value = iter([b"from ", b"the next hop"])
+        with patch.object(
+            chain_link_app.stream_settings, "enabled", True
+        ), patch.object(
+            chain_link_app.services_watcher.current.latency_injector,
+            "delay",
+            return_value=0.0,
+        ), patch.object(
+            chain_link_app.session_pool, "request", return_value=downstream
+        ):
+            services = chain_link_app.services_watcher.current.topology.services
+            response = self.client.get("/", headers={"X-Current-Service": services[0]})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, b"from the next hop")
+        self.assertEqual(response.headers["Content-Type"], "text/plain")
+        self.assertNotIn("Connection", response.headers)
+        downstream.close.assert_called_once()
+
+    def test_server_timing(self):
+        link_config = LinkConfig(["service-a", "service-b"], "service-a")
+        downstream = MagicMock(
+            status_code=200,
+            text="{}",
+            headers={
+                "Server-Timing": 'hop;desc="service-b";dur=1.5;proc=1.5;delay=0;wait=0'
+            },
+        )
+        with patch.object(
+            chain_link_app.services_watcher, "current", link_config
+        ), patch.object(
+            link_config.latency_injector, "delay", return_value=0.0
+        ), patch.object(
+            chain_link_app.session_pool, "request", return_value=downstream
+        ):
+            response = self.client.get("/", headers={"X-Current-Service": "service-a"})
+
+        hops = parse_server_timing(response.headers["Server-Timing"])
+        self.assertEqual([hop["service"] for hop in hops], ["service-a", "service-b"])
+        self.assertGreaterEqual(hops[0]["dur"], hops[0]["wait"])
+        self.assertEqual(hops[1]["dur"], 1.5)
+
+    def test_deadline(self):
+        link_config = LinkConfig(["service-a", "service-b"], "service-a")
+        downstream = MagicMock(status_code=200, text="{}", headers={})
+        soon = str(int((time.time() + 0.2) * 1000))
+        with patch.object(
+            chain_link_app.services_watcher, "current", link_config
+        ), patch.object(
+            link_config.latency_injector, "delay", return_value=0.0
+        ), patch.object(
+            chain_link_app.session_pool, "request", return_value=downstream
+        ) as request:
+            response = self.client.get(
+                "/", headers={"X-Current-Service": "service-a", DEADLINE_HEADER: soon}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        kwargs = request.call_args.kwargs
+        self.assertLess(int(kwargs["headers"][DEADLINE_HEADER]), int(soon))
+        self.assertLessEqual(kwargs["timeout"], 0.2)
+
+    def test_deadline_exceeded(self):
+        link_config = LinkConfig(["service-a", "service-b"], "service-a")
+        with patch.object(
+            chain_link_app.services_watcher, "current", link_config
+        ), patch.object(
+            link_config.latency_injector, "delay", return_value=5.0
+        ), patch.object(
+            chain_link_app.session_pool, "request"
+        ) as request:
+            start = time.perf_counter()
+            slow = self.client.get(
+                "/",
+                headers={
+                    "X-Current-Service": "service-a",
+                    DEADLINE_HEADER: str(int((time.time() + 0.05) * 1000)),
+                },
+            )
+            elapsed = time.perf_counter() - start
+            late = self.client.get(
+                "/", headers={"X-Current-Service": "service-a", DEADLINE_HEADER: "1"}
+            )
+
+        # the injected latency is cut short and the next hop isn't called
+        self.assertEqual(slow.status_code, 504)
+        self.assertEqual(slow.get_json()["stage"], "delay")
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(late.status_code, 504)
+        self.assertEqual(late.get_json()["stage"], "arrival")
+        request.assert_not_called()
+
+    def test_hedge(self):
+        link_config = LinkConfig(["service-a", "service-b"], "service-a")
+        hedger = Hedger(HedgeSettings(enabled=True, delay=0.02, budget=1))
+
+        def request(method, url, headers, **kwargs):
+            # the first attempt is stuck on a slow pod
+            if ATTEMPT_HEADER not in headers:
+                time.sleep(0.5)
+            return MagicMock(status_code=200, text=headers.get(ATTEMPT_HEADER, "0"))
+
+        with patch.object(
+            chain_link_app.services_watcher, "current", link_config
+        ), patch.object(
+            link_config.latency_injector, "delay", return_value=0.0
+        ), patch.object(
+            chain_link_app, "hedger", hedger
+        ), patch.object(
+            chain_link_app.session_pool, "request", side_effect=request
+        ):
+            start = time.perf_counter()
+            response = self.client.get("/", headers={"X-Current-Service": "service-a"})
+
+        self.assertEqual(response.data, b"1")
+        self.assertLess(time.perf_counter() - start, 0.4)
+
+    def test_admission(self):
+        admission = AdmissionController(
+            AdmissionSettings(max_in_flight=1, retry_after=2)
+        )
+        # the only slot is taken
+        ticket = admission.acquire()
+
+        with patch.object(chain_link_app, "admission", admission), patch.object(
+            chain_link_app.warmup, "ready", return_value=True
+        ):
+            shed = self.client.get("/")
+            readiness = self.client.get("/readiness")
+            admission.release(ticket)
+            response = self.client.get(
+                "/forward",
+                headers={
+                    "X-Current-Service": chain_link_app.services_watcher.current.topology.services[
+                        -1
+                    ]
+                },
+            )
+
+        self.assertEqual(shed.status_code, 503)
+        self.assertEqual(shed.headers["Retry-After"], "2")
+        self.assertEqual(readiness.status_code, 200)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(admission.in_flight, 0)
+
+    def test_readiness_warming_up(self):
+        with patch.object(chain_link_app.warmup, "ready", return_value=False):
+            response = self.client.get("/readiness")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json["message"], "warming up")
+        self.assertIn("init", response.json["startup"])
+
+        with patch.object(chain_link_app.warmup, "ready", return_value=True):
+            response = self.client.get("/readiness")
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics(self):
+        services = chain_link_app.services_watcher.current.topology.services
+        with patch.object(
+            chain_link_app.services_watcher.current.latency_injector,
+            "delay",
+            return_value=0.0,
+        ):
+            self.client.get("/forward", headers={"X-Current-Service": services[-1]})
+        # the process metrics are read from /proc
+        with patch("builtins.open", io.open):
+            response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'chain_link_requests_total{route="/forward"}', response.data)
+        self.assertIn(
+            f'chain_link_injected_sleep_seconds_count{{service="{services[-1]}"}}'.encode(),
+            response.data,
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+from unittest.mock import patch
+import httpx
+from starlette.testclient import TestClient
+import asgi
+from link.deadline import DEADLINE_HEADER
+from link.timing import parse_server_timing
+
+
+class TestAsgiApp(unittest.TestCase):
+    def setUp(self):
+        # never pick this node as the slow one
+        self.delay_patcher = patch.object(
+            asgi.services_watcher.current.latency_injector, "delay", return_value=0.0
+        )
+        self.delay_patcher.start()
+
+    def tearDown(self):
+        self.delay_patcher.stop()
+
+    def test_forwards_to_next_service(self):
+        def next_hop(request):
+            self.assertEqual(
+                request.url.host, asgi.services_watcher.current.topology.services[1]
+            )
+            self.assertEqual(
+                request.headers["X-Current-Service"],
+                asgi.services_watcher.current.topology.services[1],
+            )
+            return httpx.Response(
+                200,
+                text="from the next hop",
+                headers={
+                    "Server-Timing": 'hop;desc="next";dur=1;proc=1;delay=0;wait=0'
+                },
+            )
+
+        with TestClient(asgi.app) as client:
+            asgi.client = httpx.AsyncClient(transport=httpx.MockTransport(next_hop))
+            response = client.get(
+                "/",
+                headers={
+                    "X-Current-Service": asgi.services_watcher.current.topology.services[
+                        0
+                    ]
+                },
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, "from the next hop")
+        hops = parse_server_timing(response.headers["Server-Timing"])
+        self.assertEqual(
+            [hop["service"] for hop in hops],
+            [asgi.services_watcher.current.topology.services[0], "next"],
+        )
+
+    def test_next_hop_timeout(self):
+        def next_hop(request):
+            self.assertIn(DEADLINE_HEADER, request.headers)
+            raise httpx.ReadTimeout("too slow", request=request)
+
+        with TestClient(asgi.app) as client:
+            asgi.client = httpx.AsyncClient(transport=httpx.MockTransport(next_hop))
+            response = client.get(
+                "/",
+                headers={
+                    "X-Current-Service": asgi.services_watcher.current.topology.services[
+                        0
+                    ]
+                },
+            )
+
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(response.json()["stage"], "next_hop")
+
+    def test_final_chain_link(self):
+        with TestClient(asgi.app) as client:
+            response = client.get(
+                "/forward",
+                headers={
+                    "X-Current-Service": asgi.services_watcher.current.topology.services[
+                        -1
+                    ]
+                },
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("final chain link", response.json()["message"])
+
+    def test_invalid_service(self):
+        with TestClient(asgi.app) as client:
+            response = client.get("/", headers={"X-Current-Service": "nope"})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_admission(self):
+        # the only slot is taken
+        with patch.object(asgi.admission.settings, "max_in_flight", 1), patch.object(
+            asgi.admission.limit, "value", 1
+        ), patch.object(asgi.admission, "in_flight", 1), patch.object(
+            asgi.warmup, "ready", return_value=True
+        ), TestClient(
+            asgi.app
+        ) as client:
+            shed = client.get("/")
+            readiness = client.get("/readiness")
+
+        self.assertEqual(shed.status_code, 503)
+        self.assertEqual(shed.headers["Retry-After"], "1")
+        self.assertIn("overloaded", shed.json()["message"])
+        self.assertEqual(readiness.status_code, 200)
+
+    def test_metrics(self):
+        with TestClient(asgi.app) as client:
+            client.get("/nope")
+            response = client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('chain_link_requests_total{route="unmatched"}', response.text)
+
+    def test_stats(self):
+        with TestClient(asgi.app) as client:
+            response = client.get("/stats")
+
+        self.assertEqual(response.status_code, 200)
+        stats = response.json()
+        self.assertEqual(set(stats), {"pool", "cache", "work"})
+        self.assertEqual(stats["pool"]["connections"], 0)
+        self.assertEqual(stats["pool"]["transport"], "http1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from link.autosize import (
+    PRELOADING_ENV,
+    ServerSizing,
+    cgroup_cpus,
+    cgroup_memory,
+    preloading,
+)
+
+
+class TestAutosize(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_cgroup(self, name, value):
+        with open(os.path.join(self.directory, name), "w", encoding="utf-8") as f:
+            f.write(f"{value}\n")
+
+    def test_cgroup_limits(self):
+        self.assertIsNone(cgroup_cpus(self.directory))
+        self.assertIsNone(cgroup_memory(self.directory))
+
+        self.write_cgroup("cpu.max", "150000 100000")
+        self.write_cgroup("memory.max", str(512 * 2**20))
+        self.assertEqual(cgroup_cpus(self.directory), 1.5)
+        self.assertEqual(cgroup_memory(self.directory), 512 * 2**20)
+
+        self.write_cgroup("cpu.max", "max 100000")
+        self.write_cgroup("memory.max", "max")
+        self.assertIsNone(cgroup_cpus(self.directory))
+        self.assertIsNone(cgroup_memory(self.directory))
+
+    def test_sizing(self):
+        # a fraction of a CPU still gets a worker, the default of before
+        sizing = ServerSizing(cpus=0.5)
+        self.assertEqual((sizing.workers, sizing.threads), (1, 2))
+        self.assertEqual(sizing.worker_class, "gthread")
+        self.assertFalse(sizing.preload)
+
+        sizing = ServerSizing(cpus=4)
+        self.assertEqual(sizing.workers, 4)
+        self.assertTrue(sizing.preload)
+        self.assertEqual(sizing.app, "app:app")
+
+    def test_memory_limit(self):
+        sizing = ServerSizing(cpus=8, memory=300 * 2**20, worker_memory=100 * 2**20)
+        self.assertEqual(sizing.workers, 3)
+        sizing = ServerSizing(cpus=8, memory=50 * 2**20, worker_memory=100 * 2**20)
+        self.assertEqual(sizing.workers, 1)
+
+    def test_overrides(self):
+        sizing = ServerSizing(cpus=4, workers=2, threads=1, preload=False)
+        self.assertEqual((sizing.workers, sizing.threads), (2, 1))
+        self.assertEqual(sizing.worker_class, "sync")
+        self.assertFalse(sizing.preload)
+
+    def test_admission_threads(self):
+        sizing = ServerSizing(cpus=1, max_in_flight=8, admission_queue=4)
+        self.assertEqual(sizing.threads, 14)
+
+    def test_async(self):
+        sizing = ServerSizing(server="async", cpus=2)
+        self.assertEqual((sizing.workers, sizing.threads), (2, 1))
+        self.assertEqual(sizing.worker_class, "uvicorn.workers.UvicornWorker")
+        self.assertEqual(sizing.app, "asgi:app")
+
+    def test_http2(self):
+        sizing = ServerSizing(server="async", transport="http2", cpus=2)
+        self.assertEqual(sizing.worker_class, "asyncio")
+        with self.assertRaises(ValueError):
+            ServerSizing(transport="http2")
+
+    def test_preloading(self):
+        with patch.dict(os.environ, {PRELOADING_ENV: "true"}):
+            self.assertTrue(preloading())
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertFalse(preloading())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import json
+import unittest
+from link.batch import Batch, BatchError
+from link.config import LinkConfig
+from link.fanout import HopResult
+from link.payload import PayloadBuffer
+
+
+def batch_response(*items):
+    return json.dumps({"items": [dict(item) for item in items]})
+
+
+class TestBatch(unittest.TestCase):
+    def test_parse(self):
+        batch = Batch.parse(b'{"items": [{"id": 0, "trace_id": "ff"}, {"id": "b"}]}')
+        self.assertEqual([item["id"] for item in batch.items], ["0", "b"])
+        self.assertEqual([item["trace_id"] for item in batch.items], [255, 0])
+        self.assertEqual(batch.pending(), [0, 1])
+
+        for body in (b"not json", b"{}", b'{"items": 1}', b'{"items": [{}]}'):
+            with self.assertRaises(BatchError):
+                Batch.parse(body)
+        with self.assertRaises(BatchError):
+            Batch.parse(b'{"items": [{"id": 0, "trace_id": "xyz"}]}')
+        with self.assertRaises(BatchError):
+            Batch.parse(b'{"items": [{"id": 0}, {"id": 1}]}', max_items=1)
+
+    def test_delays(self):
+        link_config = LinkConfig(
+            {
+                "services": ["service-a"],
+                "latency": {
+                    "default": {
+                        "distribution": "uniform",
+                        "low": 0,
+                        "high": 1,
+                    }
+                },
+            },
+            "service-a",
+        )
+        batch = Batch.parse(b'{"items": [{"id": 0, "trace_id": "1"}, {"id": 1}]}')
+        delays = batch.delays("service-a", link_config.latency_injector)
+        # an item has the latency its trace would have on its own
+        self.assertEqual(delays[0], link_config.latency_injector.delay("service-a", 1))
+
+        batch.expire("service-a", [0.5, 0.1], 0.2)
+        self.assertEqual(batch.pending(), [1])
+        self.assertEqual(batch.answers[0]["status"], 504)
+        batch.expire("service-a", [0.5, 0.1], 0.2, expired=True)
+        self.assertEqual(batch.pending(), [])
+
+    def test_trace_delays(self):
+        link_config = LinkConfig(
+            {
+                "services": ["service-a", "service-b"],
+                "latency": {"default": {"distribution": "fixed", "value": 0.5}},
+            },
+            "service-a",
+        )
+        batch = Batch.parse(
+            b'{"items": [{"id": 0, "trace_id": "1"}, {"id": 1, "trace_delay": 2}]}'
+        )
+        batch.trace_delays(link_config.latency_injector)
+        # the hop before already worked out the second one
+        self.assertEqual([item["trace_delay"] for item in batch.items], [1.0, 2.0])
+        body = json.loads(batch.forward_body())
+        self.assertEqual([item["trace_delay"] for item in body["items"]], [1.0, 2.0])
+        with self.assertRaises(BatchError):
+            Batch.parse(b'{"items": [{"id": 0, "trace_delay": "slow"}]}')
+
+    def test_forward_body(self):
+        batch = Batch.parse(b'{"items": [{"id": 0, "trace_id": "1"}, {"id": 1}]}')
+        batch.answer(1, "service-a", 504)
+        body = json.loads(batch.forward_body("abc"))
+        self.assertEqual(
+            body["items"], [{"id": "0", "trace_id": f"{1:032x}", "payload": "abc"}]
+        )
+
+    def test_payload_text(self):
+        payload_buffer = PayloadBuffer(chunk_size=4)
+        text = payload_buffer.text(10)
+        self.assertEqual(text, b"".join(payload_buffer.payload(10)).decode())
+        # joined once per size
+        self.assertIs(payload_buffer.text(10), text)
+
+    def test_merge(self):
+        batch = Batch.parse(b'{"items": [{"id": 0}, {"id": 1}, {"id": 2}]}')
+        batch.answer(2, "service-a", 504)
+        batch.merge(
+            [
+                HopResult(
+                    "service-b",
+                    200,
+                    batch_response(
+                        {"id": "0", "status": 200, "service": "service-d"},
+                        {"id": "1", "status": 200, "service": "service-b"},
+                    ),
+                    0.1,
+                ),
+                HopResult(
+                    "service-c", 503, '{"message": "service-c is overloaded"}', 0.1
+                ),
+            ]
+        )
+        response = batch.response("service-a")
+        self.assertEqual(
+            [item["status"] for item in response["items"]], [503, 503, 504]
+        )
+        self.assertEqual(response["items"][0]["service"], "service-c")
+        self.assertEqual(response["items"][0]["message"], "service-c is overloaded")
+
+        # an item the next service left out has failed
+        batch = Batch.parse(b'{"items": [{"id": 0}]}')
+        batch.merge([HopResult("service-b", 200, batch_response(), 0.1)])
+        self.assertEqual(batch.answers[0]["status"], 502)
+
+    def test_finish(self):
+        batch = Batch.parse(b'{"items": [{"id": 0, "payload": "abc"}]}')
+        batch.finish("service-a", echo=True)
+        self.assertEqual(
+            batch.response("service-a")["items"],
+            [{"id": "0", "service": "service-a", "status": 200, "payload": "abc"}],
+        )
+        batch = Batch.parse(b'{"items": [{"id": 0}]}')
+        batch.finish("service-a", "xy")
+        self.assertEqual(batch.answers[0]["payload"], "xy")
+
+
+if __name__ == "__main__":
+    unittest.main()
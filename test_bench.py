@@ -0,0 +1,70 @@
+import unittest
+import requests
+from bench.__main__ import compare, measure, parse_servers
+from bench.chain import LocalChain, ZipkinStub, services_config
+
+
+def result(name, rps, p50, p99, errors=None):
+    return {
+        "name": name,
+        "requests_per_second": rps,
+        "errors": errors or {},
+        "latency_ms": {"p50": p50, "p99": p99},
+    }
+
+
+class TestBench(unittest.TestCase):
+    def test_services_config(self):
+        config = services_config([8001, 8002], payload="1KiB")
+        self.assertEqual(config["services"], ["127.0.0.1:8001", "127.0.0.1:8002"])
+        self.assertEqual(config["graph"]["127.0.0.1:8001"], ["127.0.0.1:8002"])
+        self.assertEqual(config["latency"]["default"]["value"], 0)
+        self.assertEqual(config["payload"]["default"]["response"], "1KiB")
+        config = services_config([8001], work={"cpu": {"units": 10}})
+        self.assertEqual(config["work"]["default"]["cpu"]["units"], 10)
+
+    def test_parse_servers(self):
+        self.assertEqual(parse_servers("1x2,async"), [(1, 2, "sync"), (1, 1, "async")])
+
+    def test_compare(self):
+        baseline = {"results": [result("a", 100, 10, 50), result("b", 100, 10, 50)]}
+        self.assertEqual(compare({"results": [result("a", 90, 11, 60)]}, baseline), [])
+        regressions = compare(
+            {
+                "results": [
+                    result("a", 70, 10, 50),
+                    result("b", 100, 13, 80, errors={"500": 1}),
+                    result("c", 1, 1000, 1000),
+                ]
+            },
+            baseline,
+        )
+        self.assertEqual(len(regressions), 4)
+        self.assertTrue(regressions[0].startswith("a: 70 requests/second"))
+
+    def test_local_chain(self):
+        with ZipkinStub() as zipkin:
+            env = {
+                "CHAIN_LINK_TRACE_ENDPOINT": zipkin.endpoint,
+                "OTEL_BSP_SCHEDULE_DELAY": "100",
+            }
+            with LocalChain(2, env=env) as chain:
+                response = requests.get(chain.url, timeout=10)
+                summary = measure(chain.url, concurrency=2, duration=0.5)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("127.0.0.1", response.json()["message"])
+        self.assertGreater(summary["requests"], 0)
+        self.assertEqual(summary["errors"], {})
+        self.assertGreater(zipkin.requests, 0)
+
+    def test_local_chain_start_failure(self):
+        chain = LocalChain(1, env={"CHAIN_LINK_MAX_IN_FLIGHT": "lots"})
+        with self.assertRaises(RuntimeError) as raised:
+            chain.start()
+        # the error has the link's own output, from before its files were removed
+        self.assertIn("'lots'", str(raised.exception))
+        self.assertIsNone(chain.directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
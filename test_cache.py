@@ -0,0 +1,193 @@
+import os
+import time
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch
+from link.cache import (
+    CachedResponse,
+    CachePolicies,
+    CachePolicy,
+    CacheTimeout,
+    ResponseCache,
+    ResponseCaches,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def ok(body):
+    return CachedResponse(body, 200, "text/html")
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def create_cache(self, **kwargs):
+        return ResponseCache("service-a", CachePolicy(**kwargs), clock=self.clock)
+
+    def test_policies(self):
+        services_config = {
+            "services": ["service-a", "service-b"],
+            "cache": {"service-b": {"ttl": 5, "max_bytes": "1KiB", "vary": ["X-User"]}},
+        }
+        policies = CachePolicies.from_config(services_config, "service-a")
+        self.assertFalse(policies.policy("service-a").enabled)
+        policy = policies.policy("service-b")
+        self.assertTrue(policy.enabled)
+        self.assertEqual(policy.max_bytes, 1024)
+        self.assertEqual(policy.vary, ("x-user",))
+
+        with patch.dict(os.environ, {"CHAIN_LINK_CACHE": '{"ttl": 1}'}):
+            policies = CachePolicies.from_config(services_config, "service-a")
+        self.assertEqual(policies.policy("service-a").ttl, 1)
+
+    def test_key(self):
+        cache = self.create_cache(ttl=1, vary=["X-User"])
+        self.assertIsNone(cache.key("POST", "/?", {}))
+        self.assertEqual(cache.key("GET", "/?a=1", {"x-user": "u"}), ("/?a=1", "u"))
+
+    def test_ttl(self):
+        cache = self.create_cache(ttl=5)
+        calls = []
+
+        def load():
+            calls.append(True)
+            return ok(b"body")
+
+        self.assertEqual(cache.fetch(("/",), load), (ok(b"body"), "miss"))
+        self.clock.now = 4.9
+        self.assertEqual(cache.fetch(("/",), load), (ok(b"body"), "hit"))
+        self.clock.now = 5.0
+        self.assertEqual(cache.fetch(("/",), load)[1], "miss")
+        self.assertEqual(len(calls), 2)
+
+    def test_only_ok_responses_are_kept(self):
+        cache = self.create_cache(ttl=5)
+        error = CachedResponse(b"error", 500, "text/html")
+        self.assertEqual(cache.fetch(("/",), lambda: error), (error, "miss"))
+        self.assertEqual(cache.fetch(("/",), lambda: error), (error, "miss"))
+
+    def test_lru(self):
+        cache = self.create_cache(ttl=5, max_entries=2)
+        cache.fetch(("a",), lambda: ok(b"a"))
+        cache.fetch(("b",), lambda: ok(b"b"))
+        # a is used more recently than b, so b is evicted for c
+        cache.fetch(("a",), lambda: ok(b"a"))
+        cache.fetch(("c",), lambda: ok(b"c"))
+        self.assertEqual(cache.fetch(("a",), lambda: ok(b"a"))[1], "hit")
+        self.assertEqual(cache.fetch(("b",), lambda: ok(b"b"))[1], "miss")
+
+    def test_max_bytes(self):
+        cache = self.create_cache(ttl=5, max_bytes=10)
+        cache.fetch(("a",), lambda: ok(b"aaaaaa"))
+        cache.fetch(("b",), lambda: ok(b"bbbbbb"))
+        self.assertEqual(cache.stats(), {"entries": 1, "bytes": 6, "pending": 0})
+        # too big to keep at all
+        cache.fetch(("c",), lambda: ok(b"c" * 11))
+        self.assertEqual(cache.fetch(("b",), lambda: ok(b"bbbbbb"))[1], "hit")
+
+    def test_coalescing(self):
+        cache = self.create_cache(ttl=5)
+        loading = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def load():
+            calls.append(True)
+            loading.set()
+            release.wait(5)
+            return ok(b"body")
+
+        def fetch():
+            results.append(cache.fetch(("/",), load, 5)[1])
+
+        first = threading.Thread(target=fetch)
+        first.start()
+        self.assertTrue(loading.wait(5))
+        others = [threading.Thread(target=fetch) for _ in range(3)]
+        for thread in others:
+            thread.start()
+        # give the others time to miss and wait on the first one
+        time.sleep(0.1)
+        release.set()
+        for thread in [first] + others:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), ["coalesced"] * 3 + ["miss"])
+
+    def test_coalesced_timeout(self):
+        cache = self.create_cache(ttl=5)
+        loading = threading.Event()
+        release = threading.Event()
+
+        def load():
+            loading.set()
+            release.wait(5)
+            return ok(b"body")
+
+        thread = threading.Thread(target=cache.fetch, args=(("/",), load))
+        thread.start()
+        self.assertTrue(loading.wait(5))
+        with self.assertRaises(CacheTimeout):
+            cache.fetch(("/",), load, 0.01)
+        release.set()
+        thread.join()
+
+    def test_fetch_async(self):
+        cache = self.create_cache(ttl=5)
+        calls = []
+
+        async def load():
+            calls.append(True)
+            await asyncio.sleep(0.01)
+            return ok(b"body")
+
+        async def fetch_all():
+            return await asyncio.gather(
+                *(cache.fetch_async(("/",), load, 5) for _ in range(4))
+            )
+
+        results = asyncio.run(fetch_all())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(
+            sorted(result for _, result in results), ["coalesced"] * 3 + ["miss"]
+        )
+
+    def test_fetch_async_error(self):
+        cache = self.create_cache(ttl=5)
+
+        async def load():
+            await asyncio.sleep(0.01)
+            raise ValueError("broken")
+
+        async def fetch_all():
+            return await asyncio.gather(
+                *(cache.fetch_async(("/",), load) for _ in range(2)),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(fetch_all())
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(cache.stats()["pending"], 0)
+
+    def test_caches(self):
+        caches = ResponseCaches()
+        self.assertIsNone(caches.cache("service-a", CachePolicy()))
+        cache = caches.cache("service-a", CachePolicy(ttl=5))
+        self.assertIs(caches.cache("service-a", CachePolicy(ttl=5)), cache)
+        # a reloaded config with another policy starts a new cache
+        self.assertIsNot(caches.cache("service-a", CachePolicy(ttl=10)), cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from link.config import ServicesWatcher
+
+
+class TestServicesWatcher(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "services.json")
+        self.write_services(["service-a", "service-b"])
+        self.watcher = ServicesWatcher("service-a", path=self.path, interval=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_services(self, services_config):
+        # the way kubelet updates a configmap volume, a new file renamed over
+        # the old one
+        new_path = f"{self.path}.new"
+        with open(new_path, "w", encoding="utf-8") as services_file:
+            json.dump(services_config, services_file)
+        os.replace(new_path, self.path)
+
+    def test_reload(self):
+        old_config = self.watcher.current
+        self.assertFalse(self.watcher.check())
+
+        self.write_services(["service-a", "service-b", "service-c"])
+        self.assertTrue(self.watcher.check())
+        self.assertEqual(
+            self.watcher.current.topology.next_services("service-b"), ("service-c",)
+        )
+        # the old config is left as it was for requests still using it
+        self.assertEqual(old_config.topology.next_services("service-b"), ())
+
+    def test_invalid_config_is_ignored(self):
+        old_config = self.watcher.current
+        self.write_services({"graph": {"service-a": ["service-a"]}})
+        self.assertFalse(self.watcher.check())
+        self.assertIs(self.watcher.current, old_config)
+
+
+if __name__ == "__main__":
+    unittest.main()
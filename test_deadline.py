@@ -0,0 +1,34 @@
+import time
+import unittest
+from link.deadline import DEADLINE_HEADER, Deadline, DeadlineSettings
+
+
+class TestDeadline(unittest.TestCase):
+    def test_budget(self):
+        deadline = DeadlineSettings(budget=2.0).deadline()
+        self.assertAlmostEqual(deadline.remaining(), 2.0, delta=0.1)
+        self.assertFalse(deadline.expired)
+
+    def test_header(self):
+        expires = time.time() + 1.0
+        settings = DeadlineSettings(budget=10.0)
+        deadline = settings.deadline(str(int(expires * 1000)))
+        self.assertAlmostEqual(deadline.expires, expires, delta=0.001)
+        # a header that can't be read gets the budget
+        self.assertGreater(settings.deadline("soon").remaining(), 9.0)
+        with self.assertRaises(ValueError):
+            DeadlineSettings(budget=0)
+
+    def test_next_hop(self):
+        expires = time.time() + 1.0
+        headers, timeout = Deadline(expires, reserve=0.1).next_hop()
+        self.assertAlmostEqual(timeout, 1.0, delta=0.1)
+        # the next hop gives up first
+        self.assertEqual(headers[DEADLINE_HEADER], str(int((expires - 0.1) * 1000)))
+
+        self.assertIsNone(Deadline(time.time() + 0.05, reserve=0.1).next_hop())
+        self.assertTrue(Deadline(time.time() - 1).expired)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+import unittest
+import asyncio
+import threading
+import time
+from link.deadline import Deadline
+from link.fanout import HopResult
+from link.hedging import (
+    MIN_SAMPLES,
+    HedgeSettings,
+    Hedger,
+    LatencyWindow,
+    parse_attempt,
+)
+
+
+class Interrupts:
+    """
+    Sleeps that can be cut short from another thread, like a call waiting on
+    a connection that SessionPool.interrupt shuts down
+    """
+
+    def __init__(self):
+        self.events = {}
+        self.interrupted = []
+
+    def sleep(self, seconds, attempt):
+        event = self.events[threading.get_ident()] = threading.Event()
+        if event.wait(seconds):
+            self.interrupted.append(attempt)
+            raise ConnectionError("interrupted")
+
+    def __call__(self, thread_id):
+        if thread_id in self.events:
+            self.events[thread_id].set()
+
+
+def sender(delays, calls, interrupts=None):
+    """
+    A send function that takes delays[attempt] seconds to answer
+    """
+
+    def send(attempt):
+        calls.append(attempt)
+        if interrupts is None:
+            time.sleep(delays[attempt])
+        else:
+            interrupts.sleep(delays[attempt], attempt)
+        return HopResult("service-b", 200, str(attempt), delays[attempt])
+
+    return send
+
+
+def async_sender(delays, calls, cancelled):
+    async def send(attempt):
+        calls.append(attempt)
+        try:
+            await asyncio.sleep(delays[attempt])
+        except asyncio.CancelledError:
+            cancelled.append(attempt)
+            raise
+        return HopResult("service-b", 200, str(attempt), delays[attempt])
+
+    return send
+
+
+class TestHedging(unittest.TestCase):
+    def test_latency_window(self):
+        window = LatencyWindow(0.95)
+        for elapsed in range(MIN_SAMPLES - 1):
+            window.observe(elapsed / 1000)
+        self.assertIsNone(window.value)
+        for elapsed in range(MIN_SAMPLES - 1, 100):
+            window.observe(elapsed / 1000)
+        self.assertAlmostEqual(window.value, 0.095, delta=0.02)
+
+    def test_parse_attempt(self):
+        self.assertEqual(parse_attempt(None), 0)
+        self.assertEqual(parse_attempt("1"), 1)
+        self.assertEqual(parse_attempt("one"), 0)
+
+    def test_invalid_budget(self):
+        with self.assertRaises(ValueError):
+            HedgeSettings(budget=2)
+
+    def test_disabled(self):
+        calls = []
+        hedger = Hedger(HedgeSettings(enabled=False, delay=0.01))
+        result = hedger.call("service-b", sender({0: 0.05}, calls))
+        self.assertEqual((result.body, calls), ("0", [0]))
+
+    def test_no_delay_until_observed(self):
+        calls = []
+        hedger = Hedger(HedgeSettings(enabled=True, budget=1))
+        hedger.call("service-b", sender({0: 0.05, 1: 0.0}, calls))
+        self.assertEqual(calls, [0])
+        self.assertIsNone(hedger.delay("service-b"))
+
+    def test_hedge_wins(self):
+        calls, interrupts = [], Interrupts()
+        hedger = Hedger(HedgeSettings(enabled=True, delay=0.02, budget=1))
+        start = time.perf_counter()
+        result = hedger.call(
+            "service-b", sender({0: 0.5, 1: 0.0}, calls, interrupts), None, interrupts
+        )
+        self.assertLess(time.perf_counter() - start, 0.4)
+        self.assertEqual(result.body, "1")
+        self.assertEqual(calls, [0, 1])
+        self.assertGreaterEqual(result.elapsed, 0.02)
+        # the first call is cut short
+        time.sleep(0.1)
+        self.assertEqual(interrupts.interrupted, [0])
+
+    def test_first_wins(self):
+        calls, interrupts = [], Interrupts()
+        hedger = Hedger(HedgeSettings(enabled=True, delay=0.02, budget=1))
+        result = hedger.call(
+            "service-b", sender({0: 0.05, 1: 0.5}, calls, interrupts), None, interrupts
+        )
+        self.assertEqual(result.body, "0")
+        # the hedge is cut short rather than holding a thread of the pool
+        time.sleep(0.1)
+        self.assertEqual(interrupts.interrupted, [1])
+
+    def test_hedge_wins_without_interrupt(self):
+        calls = []
+        hedger = Hedger(HedgeSettings(enabled=True, delay=0.02, budget=1))
+        start = time.perf_counter()
+        result = hedger.call("service-b", sender({0: 0.5, 1: 0.0}, calls))
+        # the first call can't be cut short, but isn't waited for
+        self.assertLess(time.perf_counter() - start, 0.4)
+        self.assertEqual(result.body, "1")
+
+    def test_full_pool(self):
+        threads = []
+
+        def send(attempt):
+            threads.append(threading.get_ident())
+            time.sleep(0.02)
+            return HopResult("service-b", 200, str(attempt), 0.02)
+
+        hedger = Hedger(HedgeSettings(enabled=True, delay=0.001, budget=1, workers=1))
+        # the only thread of the pool is busy, so the call isn't hedged and
+        # is made on the calling thread rather than waiting for it
+        self.assertTrue(hedger._reserve())
+        hedger.pool.submit(time.sleep, 0.3).add_done_callback(
+            lambda _: hedger._release()
+        )
+        start = time.perf_counter()
+        result = hedger.call("service-b", send)
+        self.assertLess(time.perf_counter() - start, 0.2)
+        self.assertEqual(result.body, "0")
+        self.assertEqual(threads, [threading.get_ident()])
+
+    def test_budget(self):
+        calls = []
+        hedger = Hedger(HedgeSettings(enabled=True, delay=0.001, budget=0.5))
+        send = sender({0: 0.01, 1: 0.0}, calls)
+        for _ in range(4):
+            hedger.call("service-b", send)
+        # half a token per call pays for a hedge every other call
+        self.assertEqual(calls.count(1), 2)
+
+    def test_no_hedge_past_deadline(self):
+        calls = []
+        hedger = Hedger(HedgeSettings(enabled=True, delay=0.02, budget=1))
+        deadline = Deadline(time.time() + 0.03, reserve=0.02)
+        hedger.call("service-b", sender({0: 0.05}, calls), deadline)
+        self.assertEqual(calls, [0])
+
+    def test_failed_first_call(self):
+        def send(attempt):
+            if attempt == 0:
+                time.sleep(0.03)
+                raise ConnectionError("reset")
+            time.sleep(0.05)
+            return HopResult("service-b", 200, "1", 0.05)
+
+        hedger = Hedger(HedgeSettings(enabled=True, delay=0.01, budget=1))
+        self.assertEqual(hedger.call("service-b", send).body, "1")
+
+    def test_async_cancels_loser(self):
+        calls, cancelled = [], []
+        hedger = Hedger(HedgeSettings(enabled=True, delay=0.02, budget=1))
+        result = asyncio.run(
+            hedger.call_async(
+                "service-b", async_sender({0: 0.5, 1: 0.0}, calls, cancelled)
+            )
+        )
+        self.assertEqual(result.body, "1")
+        self.assertEqual(cancelled, [0])
+
+
+if __name__ == "__main__":
+    unittest.main()
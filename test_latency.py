@@ -0,0 +1,82 @@
+import math
+import unittest
+from statistics import NormalDist
+from link.latency import (
+    LatencyInjector,
+    LatencyModelError,
+    LogNormal,
+    Pareto,
+    build_model,
+)
+
+SERVICES = ["service-a", "service-b", "service-c"]
+
+
+class TestLatencyModels(unittest.TestCase):
+    def test_lognormal_percentile_targets(self):
+        model = build_model(
+            {"distribution": "lognormal", "percentiles": {"p50": 0.05, "p99": 0.8}}
+        )
+        self.assertIsInstance(model, LogNormal)
+        quantiles = NormalDist(model.mu, model.sigma)
+        self.assertAlmostEqual(math.exp(quantiles.inv_cdf(0.5)), 0.05)
+        self.assertAlmostEqual(math.exp(quantiles.inv_cdf(0.99)), 0.8)
+
+    def test_pareto_percentile_targets(self):
+        model = build_model(
+            {"distribution": "pareto", "percentiles": {"p90": 0.1, "p99.9": 2.0}}
+        )
+        self.assertIsInstance(model, Pareto)
+        for p, x in ((0.9, 0.1), (0.999, 2.0)):
+            self.assertAlmostEqual(model.scale * (1 - p) ** (-1 / model.alpha), x)
+
+    def test_unknown_distribution(self):
+        with self.assertRaises(LatencyModelError):
+            build_model({"distribution": "weibull"})
+
+
+class TestLatencyInjector(unittest.TestCase):
+    def test_legacy_default(self):
+        injector = LatencyInjector.from_config(SERVICES, SERVICES, "service-a")
+        delays = {injector.delay("service-a", trace_id) for trace_id in range(1, 300)}
+        self.assertEqual(delays, {0.0, 2.0})
+
+    def test_per_service_config(self):
+        config = {
+            "services": SERVICES,
+            "latency": {
+                "default": {"distribution": "fixed", "value": 0.0},
+                "service-b": {"distribution": "uniform", "low": 0.1, "high": 0.2},
+            },
+        }
+        injector = LatencyInjector.from_config(config, SERVICES, "service-a")
+        self.assertEqual(injector.delay("service-a", 1234), 0.0)
+        self.assertTrue(0.1 <= injector.delay("service-b", 1234) <= 0.2)
+
+    def test_same_trace_same_delay(self):
+        config = {
+            "services": SERVICES,
+            "latency": {
+                "default": {"distribution": "pareto", "scale": 0.01, "alpha": 1.2}
+            },
+        }
+        injector = LatencyInjector.from_config(config, SERVICES, "service-a")
+        trace_id = 0x5B8EFFF798038103D269B633813FC60C
+        self.assertEqual(
+            injector.delay("service-b", trace_id), injector.delay("service-b", trace_id)
+        )
+        self.assertNotEqual(
+            injector.delay("service-b", trace_id), injector.delay("service-c", trace_id)
+        )
+        self.assertEqual(
+            injector.delay("service-b", trace_id, attempt=0),
+            injector.delay("service-b", trace_id),
+        )
+        self.assertNotEqual(
+            injector.delay("service-b", trace_id, attempt=1),
+            injector.delay("service-b", trace_id),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+import io
+import json
+import asyncio
+import unittest
+from link.loadgen import Histogram, LoadGenerator
+
+
+async def serve(delay, headers=b""):
+    """
+    A keep-alive HTTP server that answers every request after delay seconds
+    """
+
+    async def handle(reader, writer):
+        while await reader.readline():
+            while await reader.readline() not in (b"\r\n", b""):
+                pass
+            await asyncio.sleep(delay)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n" + headers + b"\r\nok"
+            )
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+async def serve_batches():
+    """
+    A keep-alive HTTP server that answers a batch with every other item failed
+    """
+
+    async def handle(reader, writer):
+        while request_line := await reader.readline():
+            length = 0
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.decode().partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            items = json.loads(await reader.readexactly(length))["items"]
+            assert request_line.startswith(b"POST /batch ")
+            body = json.dumps(
+                {
+                    "items": [
+                        {"id": item["id"], "status": 200 if i % 2 else 504}
+                        for i, item in enumerate(items)
+                    ]
+                }
+            ).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body) + body
+            )
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+class TestHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = Histogram()
+        for value in range(1, 100001):
+            histogram.record(value)
+        self.assertEqual(histogram.total, 100000)
+        self.assertEqual(histogram.max, 100000)
+        self.assertAlmostEqual(histogram.mean, 50000.5)
+        # three significant figures
+        self.assertAlmostEqual(histogram.percentile(50), 50000, delta=50)
+        self.assertAlmostEqual(histogram.percentile(99), 99000, delta=99)
+        self.assertEqual(histogram.percentile(100), 100000)
+        self.assertEqual(Histogram().percentile(99), 0)
+
+    def test_small_values_are_exact(self):
+        histogram = Histogram()
+        for value in (3, 1, 2):
+            histogram.record(value)
+        self.assertEqual(histogram.percentile(50), 2)
+
+    def test_record_corrected(self):
+        histogram = Histogram()
+        histogram.record_corrected(1000, 100)
+        # the 9 requests that would have been sent while waiting
+        self.assertEqual(histogram.total, 10)
+        self.assertEqual(histogram.percentile(0), 100)
+        self.assertEqual(histogram.max, 1000)
+
+    def test_merge(self):
+        first, second = Histogram(), Histogram()
+        first.record(10)
+        second.record(5000, count=3)
+        first.merge(second)
+        self.assertEqual(first.total, 4)
+        self.assertEqual(first.max, 5000)
+
+
+class TestLoadGenerator(unittest.TestCase):
+    def run_generator(self, delay, headers=b"", batches=False, **kwargs):
+        async def run():
+            server = await (serve_batches() if batches else serve(delay, headers))
+            port = server.sockets[0].getsockname()[1]
+            output = io.StringIO()
+            generator = LoadGenerator(
+                f"http://127.0.0.1:{port}/",
+                report_interval=0.2,
+                json_output=True,
+                output=output,
+                **kwargs,
+            )
+            async with server:
+                summary = await generator.run()
+            reports = [json.loads(line) for line in output.getvalue().splitlines()]
+            return summary, reports
+
+        return asyncio.run(run())
+
+    def test_open_loop(self):
+        summary, reports = self.run_generator(0.0, rate=100, duration=0.5)
+        self.assertEqual(summary["requests"], 50)
+        self.assertEqual(summary["errors"], {})
+        self.assertTrue(reports[-1]["total"])
+        self.assertEqual(sum(r["requests"] for r in reports[:-1]), 50)
+
+    def test_open_loop_counts_queueing(self):
+        # one connection answering every 50ms can't keep up with 100 a
+        # second, so the requests that waited for it count as slow
+        summary, _ = self.run_generator(0.05, rate=100, concurrency=1, duration=0.5)
+        self.assertEqual(summary["requests"], 50)
+        self.assertGreater(summary["latency_ms"]["p99"], 1000)
+
+    def test_open_loop_drops_past_the_timeout(self):
+        # 10ms of requests can be in flight, and the one connection answers
+        # every 50ms, so the others are dropped rather than queued
+        summary, _ = self.run_generator(
+            0.05, rate=1000, concurrency=1, timeout=0.01, duration=0.2
+        )
+        self.assertEqual(summary["requests"], 200)
+        self.assertGreater(summary["errors"]["dropped"], 0)
+        self.assertEqual(sum(summary["errors"].values()), 200)
+
+    def test_open_loop_stops_when_behind(self):
+        async def run():
+            server = await serve(0.0)
+            port = server.sockets[0].getsockname()[1]
+            # far faster than it can send, and without a duration
+            generator = LoadGenerator(
+                f"http://127.0.0.1:{port}/", rate=1e6, output=io.StringIO()
+            )
+            asyncio.get_running_loop().call_later(0.2, generator.stop)
+            async with server:
+                return await asyncio.wait_for(generator.run(), 10)
+
+        summary = asyncio.run(run())
+        self.assertGreater(summary["requests"], 0)
+
+    def test_closed_loop(self):
+        summary, _ = self.run_generator(0.01, concurrency=2, duration=0.3)
+        self.assertGreater(summary["requests"], 10)
+        self.assertGreaterEqual(summary["latency_ms"]["p50"], 10)
+
+    def test_hops(self):
+        summary, _ = self.run_generator(
+            0.0,
+            headers=b'Server-Timing: hop;desc="a";dur=3;proc=1;delay=0;wait=2, '
+            b'hop;desc="b";dur=1.5;proc=1.5;delay=0;wait=0\r\n',
+            rate=100,
+            duration=0.2,
+            hops=True,
+        )
+        self.assertEqual([hop["service"] for hop in summary["hops"]], ["a", "b"])
+        self.assertEqual(summary["hops"][0]["requests"], 20)
+        self.assertEqual(summary["hops"][0]["wait_ms"]["mean"], 2.0)
+        self.assertEqual(summary["hops"][1]["dur_ms"]["p99"], 1.5)
+
+    def test_batch(self):
+        # 10 batches of 4 items a second, half of which fail
+        summary, _ = self.run_generator(
+            0.0, batches=True, batch=4, rate=40, duration=0.5
+        )
+        self.assertEqual(summary["requests"], 20)
+        self.assertEqual(summary["errors"], {"504": 10})
+
+    def test_rate(self):
+        with self.assertRaises(ValueError):
+            LoadGenerator("http://127.0.0.1/", rate=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import io
+import json
+import logging
+import threading
+import unittest
+from opentelemetry import trace
+from opentelemetry.trace import NonRecordingSpan, SpanContext, TraceFlags
+from prometheus_client import REGISTRY
+from link.logs import LogPipeline, LogSettings, parse_sample
+
+
+class BlockingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.writing = threading.Event()
+        self.unblock = threading.Event()
+        self.records = []
+
+    def emit(self, record):
+        self.writing.set()
+        self.unblock.wait(5)
+        self.records.append(record)
+
+
+def dropped(reason):
+    return (
+        REGISTRY.get_sample_value(
+            "chain_link_log_records_dropped_total", {"reason": reason}
+        )
+        or 0.0
+    )
+
+
+def create_logger(name, pipeline):
+    logger = logging.getLogger(f"test_logs.{name}")
+    logger.setLevel(logging.DEBUG)
+    pipeline.install(logger)
+    return logger
+
+
+class TestLogs(unittest.TestCase):
+    def test_parse_sample(self):
+        self.assertEqual(parse_sample(None), {})
+        self.assertEqual(
+            parse_sample("info=100, debug=10"), {logging.INFO: 100, logging.DEBUG: 10}
+        )
+        with self.assertRaises(ValueError):
+            parse_sample("chatty=10")
+        with self.assertRaises(ValueError):
+            parse_sample("info=0")
+        with self.assertRaises(ValueError):
+            LogSettings(format="xml")
+
+    def test_json(self):
+        pipeline = LogPipeline(
+            LogSettings(queue_size=0), logging.getLogger(), "service-a"
+        )
+        stream = io.StringIO()
+        pipeline.output.setStream(stream)
+        logger = create_logger("json", pipeline)
+
+        span = NonRecordingSpan(
+            SpanContext(0xABC, 0xDEF, is_remote=False, trace_flags=TraceFlags(1))
+        )
+        with trace.use_span(span):
+            logger.info("next_service: %s", "service-b")
+        logger.warning("no trace")
+
+        first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(first["message"], "next_service: service-b")
+        self.assertEqual(first["level"], "INFO")
+        self.assertEqual(first["service"], "service-a")
+        self.assertEqual(first["trace_id"], f"{0xABC:032x}")
+        self.assertEqual(first["span_id"], f"{0xDEF:016x}")
+        self.assertNotIn("trace_id", second)
+
+    def test_sample(self):
+        target = logging.getLogger("test_logs.sample_target")
+        handler = BlockingHandler()
+        handler.unblock.set()
+        target.handlers = [handler]
+        target.propagate = False
+        pipeline = LogPipeline(
+            LogSettings(format="text", queue_size=0, sample={logging.INFO: 4}),
+            target,
+        )
+        logger = create_logger("sample", pipeline)
+        sampled = dropped("sampled")
+
+        for i in range(8):
+            logger.info("record %s", i)
+            logger.warning("record %s", i)
+        self.assertEqual(
+            [record.getMessage() for record in handler.records[::5]],
+            ["record 0", "record 4"],
+        )
+        self.assertEqual(len(handler.records), 10)
+        self.assertEqual(dropped("sampled") - sampled, 6)
+
+        # a record in a trace is kept along with its trace
+        for trace_id in (8, 9):
+            span = NonRecordingSpan(SpanContext(trace_id, 1, is_remote=False))
+            with trace.use_span(span):
+                logger.info("trace %s", trace_id)
+        self.assertEqual(handler.records[-1].getMessage(), "trace 8")
+
+    def test_queue_full(self):
+        target = logging.getLogger("test_logs.queue_target")
+        handler = BlockingHandler()
+        target.handlers = [handler]
+        target.propagate = False
+        pipeline = LogPipeline(LogSettings(format="text", queue_size=2), target)
+        logger = create_logger("queue", pipeline)
+        queue_full = dropped("queue_full")
+
+        # the first record holds up the writer, two wait and the rest are dropped
+        logger.info("record 0")
+        self.assertTrue(handler.writing.wait(5))
+        for i in range(1, 6):
+            logger.info("record %s", i)
+        self.assertEqual(dropped("queue_full") - queue_full, 3)
+
+        handler.unblock.set()
+        pipeline.close()
+        self.assertEqual(
+            [record.getMessage() for record in handler.records],
+            ["record 0", "record 1", "record 2"],
+        )
+
+    def test_rendered_when_logged(self):
+        target = logging.getLogger("test_logs.prepare_target")
+        handler = BlockingHandler()
+        target.handlers = [handler]
+        target.propagate = False
+        pipeline = LogPipeline(LogSettings(format="text", queue_size=10), target)
+        logger = create_logger("prepare", pipeline)
+
+        logger.info("record 0")
+        self.assertTrue(handler.writing.wait(5))
+        services = ["service-b"]
+        logger.info("next services %s", services)
+        try:
+            raise ValueError("failed")
+        except ValueError:
+            logger.exception("call failed")
+        # changed after it was logged, and before it is written
+        services.append("service-c")
+
+        handler.unblock.set()
+        pipeline.close()
+        record, failed = handler.records[1:]
+        self.assertEqual(record.getMessage(), "next services ['service-b']")
+        self.assertIsNone(failed.exc_info)
+        self.assertIn("ValueError: failed", failed.exc_text)
+        self.assertIn("ValueError: failed", logging.Formatter().format(failed))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+from link.metrics import render
+
+WORKER = """
+from link.metrics import NEXT_HOP_DURATION, RequestMetrics
+
+request_metrics = RequestMetrics("/")
+NEXT_HOP_DURATION.labels("chain-link-service-1").observe(0.02)
+request_metrics.respond(502)
+request_metrics.finish()
+"""
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_adds_up_workers(self):
+        env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=self.path)
+        for _ in range(2):
+            subprocess.run([sys.executable, "-c", WORKER], env=env, check=True)
+
+        body, _ = render(self.path)
+        metrics = body.decode()
+
+        self.assertIn('chain_link_requests_total{route="/"} 2.0', metrics)
+        self.assertIn(
+            'chain_link_request_errors_total{route="/",status="502"} 2.0', metrics
+        )
+        self.assertIn(
+            'chain_link_next_hop_duration_seconds_count{next_service="chain-link-service-1"} 2.0',
+            metrics,
+        )
+        self.assertIn('chain_link_requests_in_flight{route="/"} 0.0', metrics)
+
+
+if __name__ == "__main__":
+    unittest.main()
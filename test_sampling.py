@@ -0,0 +1,121 @@
+import unittest
+from unittest.mock import Mock, patch
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from opentelemetry.sdk.trace.sampling import Decision
+from link.sampling import (
+    KEEP_ATTRIBUTE,
+    RateLimitingSampler,
+    SamplingError,
+    SamplingSettings,
+    TailSamplingSpanProcessor,
+)
+
+
+class TestRateLimitingSampler(unittest.TestCase):
+    def test_limits_rate(self):
+        with patch("link.sampling.time.monotonic", return_value=100.0):
+            sampler = RateLimitingSampler(5)
+            decisions = [
+                sampler.should_sample(None, trace_id, "span").decision
+                for trace_id in range(1, 11)
+            ]
+        self.assertEqual(decisions.count(Decision.RECORD_AND_SAMPLE), 5)
+
+        # half a second later the bucket has half a second of traces again
+        with patch("link.sampling.time.monotonic", return_value=100.5):
+            decisions = [
+                sampler.should_sample(None, trace_id, "span").decision
+                for trace_id in range(1, 11)
+            ]
+        self.assertEqual(decisions.count(Decision.RECORD_AND_SAMPLE), 2)
+
+    def test_fractional_rate(self):
+        with patch("link.sampling.time.monotonic", return_value=100.0):
+            sampler = RateLimitingSampler(0.5)
+            decisions = [
+                sampler.should_sample(None, trace_id, "span").decision
+                for trace_id in range(1, 4)
+            ]
+        self.assertEqual(decisions.count(Decision.RECORD_AND_SAMPLE), 1)
+
+        # one trace every two seconds
+        with patch("link.sampling.time.monotonic", return_value=101.0):
+            decision = sampler.should_sample(None, 4, "span").decision
+        self.assertEqual(decision, Decision.DROP)
+        with patch("link.sampling.time.monotonic", return_value=102.0):
+            decision = sampler.should_sample(None, 5, "span").decision
+        self.assertEqual(decision, Decision.RECORD_AND_SAMPLE)
+
+
+class TestTailSampling(unittest.TestCase):
+    def setUp(self):
+        self.exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(
+            TailSamplingSpanProcessor(SimpleSpanProcessor(self.exporter))
+        )
+        self.tracer = provider.get_tracer(__name__)
+
+    def run_hop(self, keep=False, status_code=200):
+        with self.tracer.start_as_current_span("hop") as span:
+            with self.tracer.start_as_current_span("next hop") as child:
+                child.set_attribute("http.status_code", status_code)
+            if keep:
+                span.set_attribute(KEEP_ATTRIBUTE, True)
+
+    def test_drops_fast_traces(self):
+        self.run_hop()
+        self.assertEqual(self.exporter.get_finished_spans(), ())
+
+    def test_keeps_slow_traces(self):
+        self.run_hop(keep=True)
+        self.assertEqual(
+            [span.name for span in self.exporter.get_finished_spans()],
+            ["next hop", "hop"],
+        )
+
+    def test_keeps_errors(self):
+        self.run_hop(status_code=503)
+        self.assertEqual(len(self.exporter.get_finished_spans()), 2)
+
+
+class TestSamplingSettings(unittest.TestCase):
+    def test_unknown_sampler(self):
+        with self.assertRaises(SamplingError):
+            SamplingSettings("sometimes")
+
+    def test_ratio_follows_parent(self):
+        sampler = SamplingSettings("parentbased_ratio", 0.0).get_sampler()
+        parent = trace.set_span_in_context(
+            trace.NonRecordingSpan(
+                trace.SpanContext(
+                    1,
+                    2,
+                    is_remote=True,
+                    trace_flags=trace.TraceFlags(trace.TraceFlags.SAMPLED),
+                )
+            )
+        )
+        self.assertEqual(
+            sampler.should_sample(parent, 1, "span").decision,
+            Decision.RECORD_AND_SAMPLE,
+        )
+        self.assertEqual(sampler.should_sample(None, 1, "span").decision, Decision.DROP)
+
+    def test_trace_delay(self):
+        settings = SamplingSettings("keep_slow")
+        latency_injector = Mock()
+        latency_injector.trace_delay.return_value = 0.25
+        # only the first hop goes through the services to work it out
+        self.assertEqual(settings.trace_delay(None, latency_injector, 1), 0.25)
+        self.assertEqual(settings.trace_delay("1.5", latency_injector, 1), 1.5)
+        latency_injector.trace_delay.assert_called_once_with(1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import time
+import threading
+import unittest
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from link.sessions import SessionPool
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/slow":
+            time.sleep(1)
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSessionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        pool = SessionPool(pool_size=2)
+        for _ in range(3):
+            self.assertEqual(pool.get(self.url, timeout=3).text, "ok")
+
+        stats = pool.stats()
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["connections_created"], 1)
+        self.assertEqual(stats["connections_reused"], 2)
+
+    def test_idle_pools_are_evicted(self):
+        pool = SessionPool(pool_size=2, idle_timeout=0)
+        pool.get(self.url, timeout=3)
+        pool.get(self.url.replace("127.0.0.1", "localhost"), timeout=3)
+
+        stats = pool.stats()
+        self.assertEqual(stats["evicted_pools"], 1)
+        self.assertEqual(stats["requests"], 2)
+
+    def test_pools_in_use_are_not_evicted(self):
+        pool = SessionPool(pool_size=2, idle_timeout=0)
+        responses = []
+        thread = threading.Thread(
+            target=lambda: responses.append(pool.get(self.url + "slow", timeout=3))
+        )
+        thread.start()
+        time.sleep(0.2)
+        # the slow request is still going, so its pool is kept
+        pool.get(self.url.replace("127.0.0.1", "localhost"), timeout=3)
+        self.assertEqual(pool.stats()["evicted_pools"], 0)
+
+        thread.join()
+        self.assertEqual(responses[0].text, "ok")
+        pool.get(self.url.replace("127.0.0.1", "localhost"), timeout=3)
+        self.assertEqual(pool.stats()["evicted_pools"], 1)
+
+    def test_interrupt(self):
+        pool = SessionPool(pool_size=2)
+        errors = []
+
+        def call():
+            try:
+                pool.get(self.url + "slow", timeout=3)
+            except requests.ConnectionError as exc:
+                errors.append(exc)
+
+        thread = threading.Thread(target=call)
+        start = time.perf_counter()
+        thread.start()
+        time.sleep(0.2)
+        pool.interrupt(thread.ident)
+        thread.join()
+        self.assertLess(time.perf_counter() - start, 0.8)
+        self.assertEqual(len(errors), 1)
+
+        # a thread that isn't waiting on a response has nothing to interrupt
+        pool.interrupt(threading.get_ident())
+        self.assertEqual(pool.get(self.url, timeout=3).text, "ok")
+
+
+if __name__ == "__main__":
+    unittest.main()
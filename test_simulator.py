@@ -0,0 +1,80 @@
+import sys
+import json
+import subprocess
+import unittest
+from link.simulator import InProcessFanOut, chain_config, percentile
+
+# the simulator loads the app module with its own config, so it runs apart
+# from the other tests
+SIMULATION = """
+import json
+from link.simulator import Simulator, chain_config
+
+simulator = Simulator(chain_config({length}, fan_out=2))
+print(json.dumps(simulator.run(count=20, concurrency={concurrency}, warmup=5)))
+"""
+
+
+def simulate(length, concurrency):
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            SIMULATION.format(length=length, concurrency=concurrency),
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+        timeout=60,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+class TestSimulator(unittest.TestCase):
+    def test_chain_config(self):
+        config = chain_config(3)
+        self.assertEqual(
+            config["graph"],
+            {
+                "chain-link-service-0": ["chain-link-service-1"],
+                "chain-link-service-1": ["chain-link-service-2"],
+            },
+        )
+        self.assertEqual(config["latency"]["default"]["value"], 0)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 51)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([], 99), 0.0)
+
+    def test_nested_fan_out(self):
+        fan_out = InProcessFanOut(max_workers=2)
+
+        # a tree of nested calls, more of them at once than the pool has
+        # threads, as the hops of a chain in one process make
+        def call(depth):
+            if not depth:
+                return 1
+            return sum(fan_out.map(call, [depth - 1] * 2))
+
+        self.assertEqual(call(4), 16)
+
+    def test_run(self):
+        report = simulate(3, 2)
+        self.assertEqual(report["services"], 3)
+        self.assertEqual(report["hops_per_request"], 3)
+        self.assertEqual(report["requests"], 20)
+        self.assertGreater(report["per_hop_us"], 0)
+        self.assertLessEqual(report["latency_us"]["p50"], report["latency_us"]["max"])
+
+    def test_fan_out_past_the_pool(self):
+        # more requests at once than the app's 16 fan-out threads, each of
+        # them fanning out twice below
+        report = simulate(7, 16)
+        self.assertEqual(report["hops_per_request"], 7)
+        self.assertEqual(report["requests"], 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from opentelemetry.exporter.zipkin.json import ZipkinExporter
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from link.spool import SpanSpool, SpoolingSpanExporter
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        status = 202 if self.server.up.is_set() else 503
+        if status == 202:
+            self.server.spans.extend(span["name"] for span in json.loads(body))
+            if len(self.server.spans) >= self.server.expected:
+                self.server.done.set()
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSpanSpool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_drops_oldest_when_full(self):
+        spool = SpanSpool.open(self.directory, 64)
+        for i in range(5):
+            dropped = spool.append(bytes([i]) * 20, 2)
+        # 28 byte records, two fit in 64 bytes
+        self.assertEqual(dropped, 2)
+        self.assertEqual(spool.peek().data, bytes([3]) * 20)
+        spool.pop(spool.peek())
+        self.assertEqual(spool.peek().data, bytes([4]) * 20)
+        spool.close()
+
+    def test_wraps_around(self):
+        spool = SpanSpool.open(self.directory, 50)
+        for i in range(10):
+            spool.append(bytes(range(i, i + 30)), 1)
+            record = spool.peek()
+            self.assertEqual(record.data, bytes(range(i, i + 30)))
+            spool.pop(record)
+        self.assertIsNone(spool.peek())
+        spool.close()
+
+    def test_reopens_left_behind_spool(self):
+        spool = SpanSpool.open(self.directory, 1024)
+        spool.append(b"left behind", 1)
+        # a second worker gets a spool of its own
+        other = SpanSpool.open(self.directory, 1024)
+        self.assertNotEqual(other.path, spool.path)
+        self.assertIsNone(other.peek())
+        other.close()
+        spool.close()
+
+        spool = SpanSpool.open(self.directory, 1024)
+        self.assertEqual(spool.peek().data, b"left behind")
+        spool.close()
+
+
+class TestSpoolingSpanExporter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), CollectorHandler)
+        self.server.up = threading.Event()
+        self.server.done = threading.Event()
+        self.server.spans = []
+        self.server.expected = 3
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_replays_spans_when_collector_is_back(self):
+        span_exporter = SpoolingSpanExporter(
+            ZipkinExporter(
+                endpoint=f"http://127.0.0.1:{self.server.server_port}/api/v2/spans"
+            ),
+            self.directory,
+            1024 * 1024,
+            max_backoff=0.1,
+        )
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(span_exporter))
+        tracer = provider.get_tracer(__name__)
+
+        # the collector is down, so the spans wait in the spool
+        for name in ("one", "two", "three"):
+            tracer.start_span(name).end()
+        self.assertFalse(self.server.done.wait(0.3))
+        self.assertGreater(span_exporter.spool().used, 0)
+
+        self.server.up.set()
+        self.assertTrue(self.server.done.wait(5))
+        self.assertEqual(self.server.spans, ["one", "two", "three"])
+        span_exporter.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
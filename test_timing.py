@@ -0,0 +1,52 @@
+import unittest
+from link.timing import HopTiming, parse_server_timing
+
+DOWNSTREAM = 'hop;desc="service-b";dur=2.000;proc=2.000;delay=0.000;wait=0.000'
+
+
+class TestHopTiming(unittest.TestCase):
+    def test_header(self):
+        timing = HopTiming()
+        self.assertIsNone(timing.header())
+
+        timing.service = "service-a"
+        with timing.delaying():
+            pass
+        with timing.waiting():
+            timing.add_downstream(DOWNSTREAM)
+        hops = parse_server_timing(timing.header())
+
+        self.assertEqual([hop["service"] for hop in hops], ["service-a", "service-b"])
+        first = hops[0]
+        self.assertAlmostEqual(
+            first["dur"], first["proc"] + first["delay"] + first["wait"], delta=0.002
+        )
+        self.assertEqual(hops[1]["dur"], 2.0)
+
+    def test_max_hops(self):
+        timing = HopTiming()
+        timing.service = "service-a"
+        timing.add_downstream(", ".join([DOWNSTREAM] * 3 + ["omitted;count=5"]))
+        header = timing.header(max_hops=2)
+
+        self.assertEqual(len(parse_server_timing(header)), 2)
+        self.assertTrue(header.endswith("omitted;count=7"))
+
+    def test_parse_ignores_other_metrics(self):
+        self.assertEqual(
+            parse_server_timing('cache;desc="hit";dur=0.1, ' + DOWNSTREAM),
+            [
+                {
+                    "service": "service-b",
+                    "dur": 2.0,
+                    "proc": 2.0,
+                    "delay": 0.0,
+                    "wait": 0.0,
+                }
+            ],
+        )
+        self.assertEqual(parse_server_timing(None), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+from link.fanout import HopResult, aggregate
+from link.topology import Topology, TopologyError
+
+
+class TestTopology(unittest.TestCase):
+    def test_list_is_a_chain(self):
+        topology = Topology.from_config(["service-a", "service-b", "service-c"])
+        self.assertEqual(topology.entry, "service-a")
+        self.assertEqual(topology.next_services("service-a"), ("service-b",))
+        self.assertEqual(topology.next_services("service-c"), ())
+
+    def test_graph(self):
+        topology = Topology.from_config(
+            {
+                "graph": {
+                    "service-a": ["service-b", "service-c"],
+                    "service-b": ["service-d"],
+                    "service-c": ["service-d"],
+                }
+            }
+        )
+        self.assertEqual(
+            topology.services, ["service-a", "service-b", "service-c", "service-d"]
+        )
+        self.assertEqual(
+            topology.next_services("service-a"), ("service-b", "service-c")
+        )
+        self.assertIn("service-d", topology)
+        self.assertEqual(
+            Topology.from_config(topology.to_config()).children, topology.children
+        )
+
+    def test_cycle(self):
+        with self.assertRaises(TopologyError):
+            Topology.from_config(
+                {"graph": {"service-a": ["service-b"], "service-b": ["service-a"]}}
+            )
+
+    def test_unknown_child(self):
+        with self.assertRaises(TopologyError):
+            Topology(["service-a"], {"service-a": ["service-b"]})
+
+    def test_tree(self):
+        services = [f"service-{i}" for i in range(7)]
+        topology = Topology.tree(services, 2)
+        self.assertEqual(
+            topology.next_services("service-0"), ("service-1", "service-2")
+        )
+        self.assertEqual(
+            topology.next_services("service-2"), ("service-5", "service-6")
+        )
+        self.assertEqual(topology.next_services("service-3"), ())
+        self.assertEqual(
+            Topology.tree(services, 1).children, Topology.chain(services).children
+        )
+        with self.assertRaises(TopologyError):
+            Topology.tree(services, 0)
+
+    def test_calls(self):
+        topology = Topology.from_config(
+            {
+                "graph": {
+                    "service-a": ["service-b", "service-c"],
+                    "service-b": ["service-d"],
+                    "service-c": ["service-d"],
+                }
+            }
+        )
+        self.assertEqual(topology.calls(), 5)
+        self.assertEqual(topology.calls("service-b"), 2)
+        self.assertEqual(topology.calls("service-e"), 0)
+
+
+class TestAggregate(unittest.TestCase):
+    def test_critical_path(self):
+        message, status = aggregate(
+            "service-a",
+            [
+                HopResult("service-b", 200, '{"message": "ok"}', 0.010),
+                HopResult(
+                    "service-c",
+                    503,
+                    '{"critical_path": ["service-c", "service-d"]}',
+                    0.250,
+                ),
+            ],
+        )
+        self.assertEqual(status, 503)
+        self.assertEqual(
+            message["critical_path"], ["service-a", "service-c", "service-d"]
+        )
+        self.assertEqual(message["critical_path_ms"], 250.0)
+
+    def test_critical_path_through_a_chain(self):
+        # service-b forwarded to service-c alone, which fanned out
+        message, _ = aggregate(
+            "service-a",
+            [
+                HopResult(
+                    "service-b",
+                    200,
+                    '{"critical_path": ["service-c", "service-d"]}',
+                    0.250,
+                ),
+                HopResult("service-e", 200, '{"message": "ok"}', 0.010),
+            ],
+        )
+        self.assertEqual(
+            message["critical_path"],
+            ["service-a", "service-b", "service-c", "service-d"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
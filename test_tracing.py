@@ -0,0 +1,103 @@
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+from prometheus_client import REGISTRY
+from link.tracing import (
+    CountingBatchSpanProcessor,
+    ExportSettings,
+    ForkSafeSpanProcessor,
+    TracingError,
+)
+
+
+class BlockingExporter(SpanExporter):
+    def __init__(self, result=SpanExportResult.SUCCESS):
+        self.result = result
+        self.exporting = threading.Event()
+        self.release = threading.Event()
+
+    def export(self, spans):
+        self.exporting.set()
+        self.release.wait(5)
+        return self.result
+
+
+def dropped(reason):
+    return (
+        REGISTRY.get_sample_value("chain_link_spans_dropped_total", {"reason": reason})
+        or 0.0
+    )
+
+
+class TestCountingBatchSpanProcessor(unittest.TestCase):
+    def start_spans(self, exporter, count, **kwargs):
+        span_processor = CountingBatchSpanProcessor(exporter, **kwargs)
+        provider = TracerProvider()
+        provider.add_span_processor(span_processor)
+        tracer = provider.get_tracer(__name__)
+
+        # the first span is taken off the queue and held up in the exporter
+        tracer.start_span("first").end()
+        self.assertTrue(exporter.exporting.wait(5))
+        for _ in range(count):
+            tracer.start_span("next").end()
+        return span_processor
+
+    def test_counts_full_queue(self):
+        before = dropped("queue_full")
+        exporter = BlockingExporter()
+        span_processor = self.start_spans(
+            exporter, 5, max_queue_size=2, max_export_batch_size=1
+        )
+
+        self.assertEqual(dropped("queue_full") - before, 3)
+        self.assertEqual(REGISTRY.get_sample_value("chain_link_span_queue_depth"), 2.0)
+        exporter.release.set()
+        span_processor.shutdown()
+
+    def test_counts_failed_exports(self):
+        before = dropped("export_failed")
+        exporter = BlockingExporter(SpanExportResult.FAILURE)
+        span_processor = self.start_spans(exporter, 2, max_export_batch_size=1)
+        exporter.release.set()
+        span_processor.shutdown()
+
+        self.assertEqual(dropped("export_failed") - before, 3)
+
+
+class TestForkSafeSpanProcessor(unittest.TestCase):
+    def test_one_processor_per_process(self):
+        create_processor = MagicMock(side_effect=lambda: MagicMock())
+        span_processor = ForkSafeSpanProcessor(create_processor)
+        # nothing is built until a process traces something
+        self.assertTrue(span_processor.force_flush())
+        span_processor.shutdown()
+        create_processor.assert_not_called()
+
+        parent = span_processor.post_fork()
+        span_processor.on_end(MagicMock())
+        self.assertIs(span_processor.processor, parent)
+        parent.on_end.assert_called_once()
+
+        with patch("os.getpid", return_value=-1):
+            child = span_processor.processor
+        self.assertIsNot(child, parent)
+        self.assertEqual(create_processor.call_count, 2)
+
+
+class TestExportSettings(unittest.TestCase):
+    def test_exporters(self):
+        for exporter in ("zipkin_json", "zipkin_proto", "otlp_http"):
+            self.assertIsInstance(
+                ExportSettings(exporter).create_exporter(), SpanExporter
+            )
+
+    def test_unknown_exporter(self):
+        with self.assertRaises(TracingError):
+            ExportSettings("carrier_pigeon")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+import os
+import unittest
+from unittest.mock import patch
+from link.transport import TransportSettings
+
+
+class TestTransport(unittest.TestCase):
+    def test_settings(self):
+        settings = TransportSettings()
+        self.assertFalse(settings.http2)
+        self.assertEqual(settings.client_options(), {"http1": True, "http2": False})
+
+        env = {"CHAIN_LINK_TRANSPORT": "http2", "CHAIN_LINK_H2_MAX_STREAMS": "50"}
+        with patch.dict(os.environ, env):
+            settings = TransportSettings.from_env()
+        self.assertTrue(settings.http2)
+        self.assertEqual(settings.max_streams, 50)
+        self.assertEqual(settings.client_options(), {"http1": False, "http2": True})
+
+        with self.assertRaises(ValueError):
+            TransportSettings("grpc")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import os
+import unittest
+import asyncio
+import threading
+from unittest.mock import patch
+from opentelemetry import context
+from opentelemetry.instrumentation.utils import _SUPPRESS_INSTRUMENTATION_KEY
+from link import warmup
+from link.autosize import PRELOADING_ENV
+from link.warmup import StartupTimer, Warmup, WarmupSettings
+
+
+def flaky_connect(failures, calls):
+    """
+    A connect function that fails the first failures calls for each service
+    """
+    lock = threading.Lock()
+
+    def connect(service):
+        with lock:
+            calls.append(service)
+            failed = calls.count(service) <= failures
+        if failed:
+            raise ConnectionError(f"{service} isn't up yet")
+        # the warmup requests aren't traced
+        assert context.get_value(_SUPPRESS_INSTRUMENTATION_KEY)
+
+    return connect
+
+
+class TestWarmup(unittest.TestCase):
+    def setUp(self):
+        self.retry_patcher = patch.object(warmup, "RETRY_INTERVAL", 0.01)
+        self.retry_patcher.start()
+
+    def tearDown(self):
+        self.retry_patcher.stop()
+
+    def test_settings(self):
+        with patch.dict(
+            os.environ,
+            {"CHAIN_LINK_WARMUP_CONNECTIONS": "20", "CHAIN_LINK_POOL_SIZE": "4"},
+        ):
+            settings = WarmupSettings.from_env()
+        self.assertTrue(settings.enabled)
+        self.assertEqual(settings.connections, 4)
+
+    def test_disabled(self):
+        link_warmup = Warmup(WarmupSettings(enabled=False))
+        self.assertTrue(link_warmup.ready())
+        link_warmup.start(["service-b"], lambda service: self.fail("connected"))
+        self.assertTrue(link_warmup.ready())
+
+    def test_connects_to_next_services(self):
+        calls = []
+        primed = []
+        link_warmup = Warmup(WarmupSettings(connections=2))
+        self.assertFalse(link_warmup.ready())
+
+        link_warmup.start(
+            ["service-b", "service-c"],
+            flaky_connect(1, calls),
+            lambda: primed.append(True),
+        )
+        self.assertTrue(link_warmup.done.wait(5))
+
+        self.assertTrue(link_warmup.ready())
+        self.assertEqual(primed, [True])
+        # two connections to each, one of them tried again
+        self.assertEqual(calls.count("service-b"), 3)
+        self.assertEqual(calls.count("service-c"), 3)
+        self.assertEqual(set(link_warmup.timer.phases), {"tracing", "connect", "ready"})
+
+    def test_once_per_process(self):
+        calls = []
+        link_warmup = Warmup(WarmupSettings(connections=1))
+        link_warmup.start(["service-b"], flaky_connect(0, calls))
+        self.assertTrue(link_warmup.done.wait(5))
+        link_warmup.start(["service-b"], flaky_connect(0, calls))
+        self.assertEqual(calls, ["service-b"])
+
+    def test_not_while_preloading(self):
+        calls = []
+        link_warmup = Warmup(WarmupSettings(connections=1))
+        with patch.dict(os.environ, {PRELOADING_ENV: "true"}):
+            link_warmup.start(["service-b"], flaky_connect(0, calls))
+        self.assertFalse(link_warmup.ready())
+        self.assertEqual(calls, [])
+
+        # the worker forked from the master warms up
+        link_warmup.start(["service-b"], flaky_connect(0, calls))
+        self.assertTrue(link_warmup.done.wait(5))
+        self.assertEqual(calls, ["service-b"])
+
+    def test_timeout(self):
+        calls = []
+        link_warmup = Warmup(WarmupSettings(timeout=0.1, connections=1))
+        link_warmup.start(["service-b"], flaky_connect(1000, calls))
+
+        # ready once it has tried for long enough, even if it never connected
+        self.assertFalse(link_warmup.ready())
+        self.assertTrue(link_warmup.done.wait(5))
+        self.assertTrue(link_warmup.ready())
+        self.assertGreater(len(calls), 1)
+
+    def test_run_async(self):
+        calls = []
+
+        async def connect(service):
+            calls.append(service)
+            if len(calls) == 1:
+                raise ConnectionError(f"{service} isn't up yet")
+            assert context.get_value(_SUPPRESS_INSTRUMENTATION_KEY)
+
+        link_warmup = Warmup(WarmupSettings(connections=1))
+        asyncio.run(link_warmup.run_async(["service-b"], connect))
+
+        self.assertTrue(link_warmup.ready())
+        self.assertEqual(calls, ["service-b", "service-b"])
+        self.assertIn("connect", link_warmup.timer.phases)
+
+    def test_startup_timer(self):
+        timer = StartupTimer()
+        with timer.phase("tracing"):
+            pass
+        timer.since_start("init")
+        self.assertGreaterEqual(timer.phases["init"], timer.phases["tracing"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import unittest
+from unittest.mock import patch
+from link.work import Work, WorkPolicy, WorkProfiles, burn
+
+
+def profiles(spec, service_name="service-a"):
+    return WorkProfiles.from_config(
+        {"services": ["service-a", "service-b"], "work": {"service-a": spec}},
+        service_name,
+    )
+
+
+class TestWork(unittest.TestCase):
+    def test_profiles(self):
+        work_profiles = profiles(
+            {
+                "cpu": {"units": 10, "release_gil": True},
+                "alloc": {"bytes": "1KiB", "count": 4},
+                "ballast": "1MiB",
+            }
+        )
+        policy = work_profiles.policy("service-a")
+        self.assertEqual((policy.cpu_units, policy.release_gil), (10, True))
+        self.assertEqual((policy.alloc_bytes, policy.alloc_count), (1024, 4))
+        self.assertEqual(work_profiles.ballast, 2**20)
+        self.assertFalse(work_profiles.policy("service-b").enabled)
+        # the ballast is only that of the pod's own service
+        self.assertEqual(profiles({"ballast": "1MiB"}, "service-b").ballast, 0)
+
+        with patch.dict(os.environ, {"CHAIN_LINK_WORK": '{"cpu": {"units": 5}}'}):
+            work_profiles = profiles({})
+        self.assertEqual(work_profiles.policy("service-a").cpu_units, 5)
+
+        with self.assertRaises(ValueError):
+            WorkPolicy(cpu_units=-1)
+
+    def test_burn(self):
+        # the same seed does the same work
+        self.assertEqual(burn(2, b"seed"), burn(2, b"seed"))
+        self.assertNotEqual(burn(2, b"seed"), burn(2, b"other"))
+        block = bytes(4096)
+        self.assertEqual(
+            burn(2, b"seed", release_gil=True, block=block),
+            burn(2, b"seed", release_gil=True, block=block),
+        )
+
+    def test_probability(self):
+        work = Work()
+        work_profiles = profiles({"cpu": {"units": 1}, "probability": 0.5})
+        # whether a trace does the work is the same on every run
+        done = [
+            bool(work.run(work_profiles, "service-a", trace_id))
+            for trace_id in range(1, 41)
+        ]
+        self.assertEqual(
+            done,
+            [
+                bool(work.run(work_profiles, "service-a", trace_id))
+                for trace_id in range(1, 41)
+            ],
+        )
+        self.assertTrue(any(done))
+        self.assertFalse(all(done))
+
+    def test_alloc(self):
+        work = Work()
+        work_profiles = profiles(
+            {
+                "alloc": {
+                    "bytes": "1KiB",
+                    "count": 2,
+                    "lifetime": 60,
+                    "max_bytes": "5KiB",
+                }
+            }
+        )
+        work.run(work_profiles, "service-a", 1)
+        self.assertEqual(work.stats()["retained"], 2048)
+        # the oldest are freed past max_bytes
+        for trace_id in range(2, 5):
+            work.run(work_profiles, "service-a", trace_id)
+        self.assertEqual(work.stats()["retained"], 4096)
+
+        # without a lifetime nothing outlives the request
+        work = Work()
+        work.run(profiles({"alloc": {"bytes": "1KiB"}}), "service-a", 1)
+        self.assertEqual(work.stats()["retained"], 0)
+
+    def test_ballast(self):
+        work = Work()
+        work.run(profiles({"ballast": "1MiB"}), "service-a")
+        self.assertEqual(work.stats()["ballast"], 2**20)
+        work.hold_ballast(0)
+        self.assertEqual(work.stats()["ballast"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()